@@ -1,9 +1,10 @@
-from typing import Generator
-from fastapi import Depends, HTTPException, status
+from typing import Generator, Optional, Type
+import msgspec
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from sqlalchemy.orm import Session
-from app.core import config, security
+from app.core import config, metrics, security
 from app.core.database import get_db
 from app.models.user import User
 from app.schemas import token as token_schema
@@ -50,3 +51,41 @@ def get_current_active_superuser(
             status_code=400, detail="The user doesn't have enough privileges"
         )
     return current_user
+
+async def _read_body(request: Request, max_bytes: int) -> bytes:
+    """The request body, or 413 as soon as it is known to exceed `max_bytes` (before buffering the rest)."""
+    too_large = HTTPException(status_code=413, detail=f"Request body exceeds {max_bytes} bytes")
+    try:
+        declared = int(request.headers.get("content-length", 0))
+    except ValueError:
+        declared = 0
+    if declared > max_bytes:
+        raise too_large
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def msgspec_body(model: Type[msgspec.Struct], max_bytes: Optional[int] = None):
+    """
+    Dependency factory decoding the raw JSON body straight into a msgspec Struct.
+    Usage: `apps_in: AppLogUpload = Depends(deps.msgspec_body(AppLogUpload))`
+    With `max_bytes`, larger bodies are refused with 413 before they are read in full.
+    """
+    decoder = msgspec.json.Decoder(model)
+
+    async def decode(request: Request) -> msgspec.Struct:
+        body = await (request.body() if max_bytes is None else _read_body(request, max_bytes))
+        metrics.uploads.inc((model.__name__,))
+        metrics.upload_bytes.inc((model.__name__,), len(body))
+        try:
+            return decoder.decode(body)
+        except msgspec.ValidationError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except msgspec.DecodeError:
+            raise HTTPException(status_code=400, detail="Malformed JSON body")
+
+    return decode
@@ -1,20 +1,33 @@
-from datetime import datetime, time
-from typing import Any, List
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, List, Optional
 import base64
+import hashlib
 import os
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import func
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy import func, select, text, true
 from sqlalchemy.orm import Session
+from starlette.background import BackgroundTask
 from app.api import deps
+from app.core import app_deltas, archive, cache, counters, exports, images, pagination, rollups, search, titles
+from app.core.config import settings
+from app.core.profiling import ProfiledRoute
 from app.core.redis import get_redis
+from app.core.responses import ORJSONResponse, dumps
+from app.core.security import sign_path, verify_signed_path
+from app.core.polling import OVERRIDE_KEY, polling_advisor
 from app.models.user import User, Device
-from app.models.data import Command, Screenshot, AppLog, BrowserLog
+from app.models.data import ActivityTitle, Command, ExportWatermark, Screenshot, BrowserLog
 from app.schemas import user as user_schema, client as client_schema
 import logging
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
+
+# Screenshot images never change under a given id
+IMMUTABLE_HEADERS = {"Cache-Control": "private, max-age=86400, immutable"}
 
 @router.get("/online-users")
 def get_online_users(
@@ -45,12 +58,15 @@ def get_online_users(
 
 @router.get("/users", response_model=List[user_schema.User])
 def get_all_users(
-    skip: int = 0,
-    limit: int = 100,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=settings.PAGE_MAX_LIMIT),
     db: Session = Depends(deps.get_db),
     current_user: User = Depends(deps.get_current_active_superuser),
 ) -> Any:
-    users = db.query(User).offset(skip).limit(limit).all()
+    """Newest users first; the next page's cursor is in X-Next-Cursor."""
+    users, next_cursor = pagination.paginate(db.query(User), User.created_at, User.id, cursor, limit)
+    pagination.set_next_cursor(response, next_cursor)
     return users
 
 @router.post("/command/send", response_model=client_schema.CommandResponse)
@@ -131,7 +147,8 @@ def stop_live_stream(
 def get_screenshot(
     command_id: str,
     current_user: User = Depends(deps.get_current_active_superuser),
-    db: Session = Depends(deps.get_db)
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
 ) -> Any:
     shot = db.query(Screenshot).filter(Screenshot.command_id == command_id).first()
     if not shot:
@@ -149,107 +166,585 @@ def get_screenshot(
                 image_data = f"data:image/png;base64,{encoded_string}"
         except Exception as e:
             logger.error(f"Error reading image file: {e}")
+    else:
+        # Moved to cold storage
+        image = archive.fetch(db, redis, shot.id)
+        if image is not None:
+            image_data = f"data:{image[1]};base64,{base64.b64encode(image[0]).decode()}"
 
-    return {"url": shot.url, "created_at": shot.created_at, "image_data": image_data}
+    return {"url": images.screenshot_url(shot), "created_at": shot.created_at, "image_data": image_data}
 
 @router.get("/screenshot/latest/{user_id}")
 def get_latest_screenshot(
     user_id: str,
     current_user: User = Depends(deps.get_current_active_superuser),
-    db: Session = Depends(deps.get_db)
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
 ) -> Any:
     """Get the most recent screenshot for a user (prioritizes auto-screenshots)"""
-    
-    # Get the latest screenshot (auto-screenshots have command_id = None)
-    shot = db.query(Screenshot).filter(
-        Screenshot.user_id == user_id
-    ).order_by(Screenshot.created_at.desc()).first()
-    
-    if not shot:
-        raise HTTPException(status_code=404, detail="No screenshots found for this user")
-    
-    # Load image data
-    image_data = None
-    if shot.url and shot.url.startswith("data:"):
-        image_data = shot.url
-    # Fallback for older screenshots on disk
-    elif shot.file_path and os.path.exists(shot.file_path):
-        try:
-            with open(shot.file_path, "rb") as image_file:
-                encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                image_data = f"data:image/png;base64,{encoded_string}"
-        except Exception as e:
-            logger.error(f"Error reading image file: {e}")
-    
-    return {
-        "url": shot.url,
-        "created_at": shot.created_at,
-        "image_data": image_data,
-        "is_auto": shot.command_id is None
-    }
+    body, ref = cache.get(redis, "screenshot", user_id)
+    if body is not None:
+        return Response(content=body, media_type="application/json")
+
+    # Large screenshots are cached by id only: a primary-key lookup instead of the ORDER BY
+    shot = db.get(Screenshot, ref) if ref is not None else None
+    if ref is not None and shot is None:
+        # Not in the table (yet: still in the ingest queue). Drop the ref so a fill can replace it;
+        # the ref's created_at stays, so only that row itself will, once committed
+        cache.invalidate(redis, "screenshot", user_id)
+    if shot is None:
+        # Get the latest screenshot (auto-screenshots have command_id = None)
+        shot = db.query(Screenshot).filter(
+            Screenshot.user_id == user_id
+        ).order_by(Screenshot.created_at.desc()).first()
+        cache.record_miss("screenshot", shot.created_at if shot else None)
+        if not shot:
+            raise HTTPException(status_code=404, detail="No screenshots found for this user")
+        body = cache.put(redis, "screenshot", user_id, cache.screenshot_view(shot), row_id=shot.id, fill=True)
+        return Response(content=body, media_type="application/json")
+
+    return ORJSONResponse(cache.screenshot_view(shot))
+
+def _latest_row(db: Session, view: str, user_id: str):
+    if view == "apps":
+        # Rebuilt from the newest keyframe and its deltas
+        return app_deltas.apps_at(db, user_id)
+    return db.query(BrowserLog).filter(BrowserLog.user_id == user_id).order_by(BrowserLog.created_at.desc()).first()
+
+LATEST_VIEWS = {"apps": cache.apps_view, "browser": cache.browser_view}
+
+def _latest_body(db: Session, redis, view: str, user_id: str) -> bytes:
+    """Encoded latest-view response: from the cache, else from the newest row (filling the cache)."""
+    body, _ = cache.get(redis, view, user_id)
+    if body is None:
+        log = _latest_row(db, view, user_id)
+        cache.record_miss(view, log.created_at if log else None)
+        body = cache.put(redis, view, user_id, LATEST_VIEWS[view](log), fill=True)
+    return body
 
 @router.get("/apps/{user_id}")
 def get_user_apps(
     user_id: str,
+    at: Optional[datetime] = None,
     current_user: User = Depends(deps.get_current_active_superuser),
-    db: Session = Depends(deps.get_db)
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
 ) -> Any:
-    # Get latest
-    log = db.query(AppLog).filter(AppLog.user_id == user_id).order_by(AppLog.created_at.desc()).first()
-    if not log:
-         return {"apps": []}
-    return {"apps": log.apps, "created_at": log.created_at}
+    """The latest app snapshot, or with `at` the one that was current at that time."""
+    if at is not None:
+        if at.tzinfo is None:
+            at = at.replace(tzinfo=timezone.utc)
+        return ORJSONResponse(cache.apps_view(app_deltas.apps_at(db, user_id, at)))
+    # Served as pre-encoded JSON: the (large, icon-heavy) list never goes through jsonable_encoder
+    return Response(content=_latest_body(db, redis, "apps", user_id), media_type="application/json")
 
 @router.get("/browser/{user_id}")
 def get_user_browser_logs(
     user_id: str,
     current_user: User = Depends(deps.get_current_active_superuser),
-    db: Session = Depends(deps.get_db)
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
 ) -> Any:
-    log = db.query(BrowserLog).filter(BrowserLog.user_id == user_id).order_by(BrowserLog.created_at.desc()).first()
-    if not log:
-        return {"browser": "No Data", "youtube_open": False, "details": None}
-    
-    # Ensure details is a dict if it was stored as a JSON string by some chance
-    details = log.details
-    if isinstance(details, str):
-        try:
-            import json
-            details = json.loads(details)
-        except:
-            pass
+    return Response(content=_latest_body(db, redis, "browser", user_id), media_type="application/json")
 
-    return {
-        "browser": log.browser,
-        "youtube_open": log.youtube_open,
-        "details": details,
-        "created_at": log.created_at
+@router.get("/users/{user_id}/overview")
+def get_user_overview(
+    user_id: str,
+    request: Request,
+    current_user: User = Depends(deps.get_current_active_superuser),
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
+) -> Any:
+    """
+    Everything the dashboard's user panel shows, in one compact document: the
+    screenshot is a signed image URL, apps and browser are summaries (full lists
+    stay on /apps and /browser). Supports If-None-Match, so an unchanged panel
+    costs a 304 on refresh.
+    """
+    device_name = select(Device.name).where(Device.user_id == User.id).limit(1).scalar_subquery()
+    latest_shot = select(Screenshot.id, Screenshot.created_at, Screenshot.command_id).where(
+        Screenshot.user_id == user_id
+    ).order_by(Screenshot.created_at.desc()).limit(1).subquery()
+
+    # User, device and latest screenshot metadata in a single round trip
+    row = db.execute(
+        select(User.id, User.name, User.email, User.is_active, device_name.label("device_name"),
+               latest_shot.c.id.label("shot_id"), latest_shot.c.created_at.label("shot_created_at"),
+               latest_shot.c.command_id.label("shot_command_id"))
+        .outerjoin(latest_shot, true())
+        .where(User.id == user_id)
+    ).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    commands = db.query(Command.id, Command.command, Command.status, Command.created_at).filter(
+        Command.user_id == user_id
+    ).order_by(Command.created_at.desc()).limit(20).all()
+
+    online = bool(redis.exists(f"online:{user_id}"))
+    apps = orjson.loads(_latest_body(db, redis, "apps", user_id))
+    browser = orjson.loads(_latest_body(db, redis, "browser", user_id))
+    sessions = (browser.get("details") or {}).get("sessions") or {}
+
+    overview = {
+        "user": {"id": row.id, "name": row.name, "email": row.email, "is_active": row.is_active},
+        "device_name": row.device_name or "Unknown",
+        "online": online,
+        "screenshots_today": counters.get_day(redis, db, user_id)["screenshots"],
+        "screenshot": None if row.shot_id is None else {
+            "id": row.shot_id,
+            "url": sign_path(f"{settings.API_V1_STR}/admin/screenshots/{row.shot_id}/image"),
+            "created_at": row.shot_created_at,
+            "is_auto": row.shot_command_id is None
+        },
+        "apps": {
+            "count": len(apps["apps"]),
+            "created_at": apps.get("created_at")
+        },
+        "browser": {
+            "browser": browser["browser"],
+            "youtube_open": browser["youtube_open"],
+            "tabs": sum(len(tabs) for tabs in sessions.values() if isinstance(tabs, list)),
+            "created_at": browser.get("created_at")
+        },
+        "commands": [{"id": c.id, "command": c.command, "status": c.status, "created_at": c.created_at}
+                     for c in commands]
     }
 
+    body = dumps(overview)
+    # Weak: the compression middleware may re-encode the same document
+    etag = f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag[2:] in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.get("/screenshots/{screenshot_id}/image")
+def get_screenshot_image(
+    screenshot_id: str,
+    exp: int,
+    sig: str,
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
+) -> Any:
+    """Screenshot as an image file. Authorized by the signed URL handed out in the overview, not a bearer token."""
+    if not verify_signed_path(f"{settings.API_V1_STR}/admin/screenshots/{screenshot_id}/image", exp, sig):
+        raise HTTPException(status_code=403, detail="Invalid or expired image link")
+    image = images.screenshot_bytes(_get_screenshot(db, screenshot_id), db, redis)
+    if image is None:
+        raise HTTPException(status_code=404, detail="Screenshot image not available")
+    # A screenshot id never changes content
+    return Response(content=image[0], media_type=image[1], headers=IMMUTABLE_HEADERS)
+
+@router.get("/screenshots/{screenshot_id}/thumbnail")
+def get_screenshot_thumbnail(
+    screenshot_id: str,
+    exp: int,
+    sig: str,
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
+) -> Any:
+    """Gallery thumbnail, generated once and kept in Redis (base64, the sync client decodes responses)."""
+    if not verify_signed_path(f"{settings.API_V1_STR}/admin/screenshots/{screenshot_id}/thumbnail", exp, sig):
+        raise HTTPException(status_code=403, detail="Invalid or expired image link")
+    key = f"thumb:{screenshot_id}"
+    try:
+        cached = redis.hmget(key, "data", "type")
+    except Exception as e:
+        logger.warning(f"Thumbnail cache unavailable: {e}")
+        cached = (None, None)
+    if cached[0] is not None:
+        return Response(content=base64.b64decode(cached[0]), media_type=cached[1], headers=IMMUTABLE_HEADERS)
+
+    image = images.screenshot_bytes(_get_screenshot(db, screenshot_id), db, redis)
+    if image is None:
+        raise HTTPException(status_code=404, detail="Screenshot image not available")
+    content, media_type = images.thumbnail(*image)
+    try:
+        pipe = redis.pipeline(transaction=False)
+        pipe.hset(key, mapping={"data": base64.b64encode(content).decode(), "type": media_type})
+        pipe.expire(key, settings.THUMBNAIL_CACHE_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not cache thumbnail {screenshot_id}: {e}")
+    return Response(content=content, media_type=media_type, headers=IMMUTABLE_HEADERS)
+
+def _get_screenshot(db: Session, screenshot_id: str) -> Screenshot:
+    shot = db.get(Screenshot, screenshot_id)
+    if not shot:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    return shot
+
+@router.get("/screenshots")
+def get_screenshot_gallery(
+    user_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=settings.PAGE_MAX_LIMIT),
+    current_user: User = Depends(deps.get_current_active_superuser),
+    db: Session = Depends(deps.get_db)
+) -> Any:
+    """Screenshot history, newest first, as signed thumbnail/image links (the image column is never read)."""
+    query = db.query(Screenshot.id, Screenshot.created_at, Screenshot.command_id).filter(Screenshot.user_id == user_id)
+    shots, next_cursor = pagination.paginate(query, Screenshot.created_at, Screenshot.id, cursor, limit)
+    pagination.set_next_cursor(response, next_cursor)
+    base = f"{settings.API_V1_STR}/admin/screenshots"
+    return [{
+        "id": s.id,
+        "created_at": s.created_at,
+        "is_auto": s.command_id is None,
+        "thumbnail_url": sign_path(f"{base}/{s.id}/thumbnail"),
+        "url": sign_path(f"{base}/{s.id}/image")
+    } for s in shots]
+
 @router.get("/commands")
 def get_command_history(
     user_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=settings.PAGE_MAX_LIMIT),
     current_user: User = Depends(deps.get_current_active_superuser),
     db: Session = Depends(deps.get_db)
 ) -> Any:
-    cmds = db.query(Command).filter(Command.user_id == user_id).order_by(Command.created_at.desc()).limit(20).all()
+    query = db.query(Command.id, Command.command, Command.status, Command.created_at).filter(Command.user_id == user_id)
+    cmds, next_cursor = pagination.paginate(query, Command.created_at, Command.id, cursor, limit)
+    pagination.set_next_cursor(response, next_cursor)
     return [{"id": c.id, "command": c.command, "status": c.status, "created_at": c.created_at} for c in cmds]
 
+@router.get("/app-logs")
+def get_app_log_history(
+    user_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=settings.PAGE_MAX_LIMIT),
+    current_user: User = Depends(deps.get_current_active_superuser),
+    db: Session = Depends(deps.get_db)
+) -> Any:
+    # Keyframes and deltas alike, each rebuilt into its full app list
+    snapshots, next_cursor = app_deltas.history(db, user_id, cursor, limit)
+    pagination.set_next_cursor(response, next_cursor)
+    return ORJSONResponse(snapshots, headers=response.headers)
+
+@router.get("/browser-logs")
+def get_browser_log_history(
+    user_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=settings.PAGE_MAX_LIMIT),
+    current_user: User = Depends(deps.get_current_active_superuser),
+    db: Session = Depends(deps.get_db)
+) -> Any:
+    logs, next_cursor = pagination.paginate(
+        db.query(BrowserLog).filter(BrowserLog.user_id == user_id), BrowserLog.created_at, BrowserLog.id, cursor, limit
+    )
+    pagination.set_next_cursor(response, next_cursor)
+    return ORJSONResponse([{**cache.browser_view(l), "id": l.id, "command_id": l.command_id} for l in logs],
+                          headers=response.headers)
+
+@router.get("/search")
+def search_activity(
+    domain: Optional[str] = None,
+    app: Optional[str] = None,
+    user_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: User = Depends(deps.get_current_active_superuser),
+    db: Session = Depends(deps.get_db)
+) -> Any:
+    """
+    Who had a domain open (any tab, subdomains included) or an app running (exe name,
+    e.g. "chrome.exe") in [since, until): one entry per user with the matching snapshots.
+    """
+    if not domain and not app:
+        raise HTTPException(status_code=400, detail="Give a domain or an app to search for")
+    hits = search.activity(db, domain=domain, app=app, user_id=user_id, since=since, until=until)
+    users = {u.id: u for u in db.query(User.id, User.name, User.email).filter(User.id.in_([h["user_id"] for h in hits]))}
+    return [{**h, "name": users[h["user_id"]].name, "email": users[h["user_id"]].email}
+            for h in hits if h["user_id"] in users]
+
+@router.get("/search/commands")
+def search_commands(
+    response: Response,
+    payload: Optional[str] = Query(None, description='JSON object the payload must contain, e.g. {"title": "Reminder"}'),
+    command: Optional[str] = None,
+    user_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=settings.PAGE_MAX_LIMIT),
+    current_user: User = Depends(deps.get_current_active_superuser),
+    db: Session = Depends(deps.get_db)
+) -> Any:
+    contains = None
+    if payload:
+        try:
+            contains = orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="payload must be JSON")
+        if not isinstance(contains, dict):
+            raise HTTPException(status_code=400, detail="payload must be a JSON object")
+    cmds, next_cursor = pagination.paginate(
+        search.commands_query(db, contains, command, user_id), Command.created_at, Command.id, cursor, limit
+    )
+    pagination.set_next_cursor(response, next_cursor)
+    return ORJSONResponse([{
+        "id": c.id, "user_id": c.user_id, "command": c.command, "payload": c.payload,
+        "status": c.status, "created_at": c.created_at
+    } for c in cmds], headers=response.headers)
+
+@router.get("/search/titles")
+def search_titles(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    user_id: Optional[str] = None,
+    source: Optional[str] = Query(None, pattern="^(app|tab)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=settings.PAGE_MAX_LIMIT),
+    current_user: User = Depends(deps.get_current_active_superuser),
+    db: Session = Depends(deps.get_db)
+) -> Any:
+    """
+    Window and tab titles matching `q` (web-search syntax: words, "phrases", -excluded,
+    OR), one entry per user, day and title, most recently seen first. `highlight` is
+    the title as HTML with the matched words in <mark>.
+    """
+    rows, next_cursor = pagination.paginate(
+        titles.search_query(db, q, user_id=user_id, source=source, since=since, until=until),
+        ActivityTitle.last_seen, ActivityTitle.id, cursor, limit
+    )
+    pagination.set_next_cursor(response, next_cursor)
+    words = titles.terms(q)
+    return ORJSONResponse([{
+        "id": r.id, "user_id": r.user_id, "date": r.day, "source": r.source, "context": r.context,
+        "title": r.title, "highlight": titles.highlight(r.title, words),
+        "first_seen": r.first_seen, "last_seen": r.created_at, "seen": r.seen
+    } for r in rows], headers=response.headers)
+
 @router.get("/screenshot-count/{user_id}")
 def get_screenshot_count(
     user_id: str,
     current_user: User = Depends(deps.get_current_active_superuser),
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
+) -> Any:
+    # Screenshots received today (UTC), from the Redis day counter
+    return {"count": counters.get_day(redis, db, user_id)["screenshots"]}
+
+@router.get("/daily-counts/{user_id}")
+def get_daily_counts(
+    user_id: str,
+    day: Optional[date] = None,
+    current_user: User = Depends(deps.get_current_active_superuser),
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
+) -> Any:
+    """Screenshots, uploads and executed commands for one UTC day (default today)."""
+    day = day or counters.today()
+    return {"user_id": user_id, "date": day, **counters.get_day(redis, db, user_id, day)}
+
+
+# Overlapping sessions (same agent seen by several workers, or several devices) are merged
+# with range_agg before being clipped to UTC day boundaries, so nothing is counted twice.
+PRESENCE_DAILY_SQL = text("""
+    WITH merged AS (
+        SELECT user_id, unnest(range_agg(tstzrange(started_at, ended_at, '[]'))) AS span
+        FROM presence_sessions
+        WHERE started_at < :range_end AND ended_at > :range_start
+          AND (CAST(:user_id AS VARCHAR) IS NULL OR user_id = :user_id)
+        GROUP BY user_id
+    ),
+    -- Days are stepped in UTC wall time (timestamp without time zone), so the session
+    -- time zone and its DST changes never move a day boundary
+    days AS (
+        SELECT CAST(d AS date) AS day,
+               tstzrange(d AT TIME ZONE 'UTC', (d + interval '1 day') AT TIME ZONE 'UTC') AS day_span
+        FROM generate_series(CAST(:range_start AS timestamptz) AT TIME ZONE 'UTC',
+                             CAST(:range_end AS timestamptz) AT TIME ZONE 'UTC' - interval '1 day',
+                             interval '1 day') AS d
+    )
+    SELECT merged.user_id,
+           days.day,
+           CAST(SUM(EXTRACT(EPOCH FROM upper(merged.span * days.day_span) - lower(merged.span * days.day_span))) AS bigint) AS seconds
+    FROM merged
+    JOIN days ON merged.span && days.day_span
+    GROUP BY merged.user_id, days.day
+    ORDER BY merged.user_id, days.day
+""")
+
+@router.get("/presence/daily", response_model=client_schema.PresenceReport)
+def get_presence_daily(
+    start: date,
+    end: date,
+    user_id: Optional[str] = None,
+    current_user: User = Depends(deps.get_current_active_superuser),
     db: Session = Depends(deps.get_db)
 ) -> Any:
-    # Get today's range
-    today_start = datetime.combine(datetime.now().date(), time.min)
-    
-    count = db.query(Screenshot).filter(
-        Screenshot.user_id == user_id,
-        Screenshot.created_at >= today_start
-    ).count()
-    
-    return {"count": count}
+    """Online time per employee per UTC day, for the inclusive range [start, end]."""
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    if (end - start).days > 366:
+        raise HTTPException(status_code=400, detail="Range is limited to one year")
+
+    range_start = datetime.combine(start, time.min, tzinfo=timezone.utc)
+    range_end = datetime.combine(end + timedelta(days=1), time.min, tzinfo=timezone.utc)
+    rows = db.execute(PRESENCE_DAILY_SQL, {
+        "range_start": range_start,
+        "range_end": range_end,
+        "user_id": user_id
+    }).all()
+
+    return {
+        "start": start,
+        "end": end,
+        "days": [{"user_id": r.user_id, "date": r.day, "seconds": r.seconds} for r in rows]
+    }
+
+def _chart_range(start: Optional[datetime], end: Optional[datetime]):
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=7)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if (end - start).days > 366:
+        raise HTTPException(status_code=400, detail="Range is limited to one year")
+    return start, end
+
+@router.get("/charts/apps")
+def get_app_usage_chart(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user_id: Optional[str] = None,
+    top: int = Query(8, ge=1, le=50),
+    current_user: User = Depends(deps.get_current_active_superuser),
+    db: Session = Depends(deps.get_db)
+) -> Any:
+    """Hours per app over [start, end) (default the last 7 days), one user or everyone, from the hourly rollups."""
+    start, end = _chart_range(start, end)
+    return {"start": start, "end": end, **rollups.breakdown(db, start, end, user_id=user_id, top=top)}
+
+@router.get("/charts/activity")
+def get_activity_chart(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user_id: Optional[str] = None,
+    app: Optional[str] = None,
+    points: int = Query(200, ge=1, le=settings.ROLLUP_MAX_POINTS),
+    current_user: User = Depends(deps.get_current_active_superuser),
+    db: Session = Depends(deps.get_db)
+) -> Any:
+    """
+    Hours tracked and in the foreground (or one app's hours) per bucket over [start, end),
+    downsampled to at most `points` buckets of 1 h, 3 h, 6 h, 12 h, 1 day or 1 week.
+    """
+    start, end = _chart_range(start, end)
+    return {"start": start, "end": end,
+            **rollups.series(db, start, end, user_id=user_id, app=app, points=points)}
+
+@router.get("/exports")
+def get_exports(
+    current_user: User = Depends(deps.get_current_active_superuser),
+    db: Session = Depends(deps.get_db)
+) -> Any:
+    """Per dataset: how far incremental Parquet exports have got and the files they wrote, newest first."""
+    marks = {m.dataset: m for m in db.query(ExportWatermark)}
+    return [{
+        "dataset": name,
+        "exported_until": marks[name].exported_until if name in marks else None,
+        "last_rows": marks[name].last_rows if name in marks else None,
+        "updated_at": marks[name].updated_at if name in marks else None,
+        "files": exports.files(name)
+    } for name in exports.DATASETS]
+
+@router.get("/exports/{dataset}/files/{filename}")
+def download_export_file(
+    dataset: str,
+    filename: str,
+    current_user: User = Depends(deps.get_current_active_superuser)
+) -> Any:
+    path = exports.file_path(dataset, filename)
+    if not path:
+        raise HTTPException(status_code=404, detail="Export file not found")
+    return FileResponse(path, media_type=exports.MEDIA_TYPE, filename=filename)
+
+@router.get("/exports/{dataset}.parquet")
+def export_dataset(
+    dataset: str,
+    since: datetime,
+    until: datetime,
+    user_id: Optional[str] = None,
+    current_user: User = Depends(deps.get_current_active_superuser)
+) -> Any:
+    """
+    Rows of a dataset (apps, browser, commands, presence) in [since, until) as one
+    Parquet file, read from the export database through a server-side cursor.
+    """
+    if dataset not in exports.DATASETS:
+        raise HTTPException(status_code=404, detail="Unknown dataset")
+    if not exports.available():
+        raise HTTPException(status_code=503, detail="Parquet exports are not available on this server")
+    since, until = _chart_range(since, until)
+    if not exports.slots.acquire(blocking=False):
+        raise HTTPException(status_code=429, detail="Another export is running, try again later")
+    try:
+        path, rows = exports.export_temp(dataset, since, until, user_id=user_id)
+    finally:
+        exports.slots.release()
+    return FileResponse(path, media_type=exports.MEDIA_TYPE, filename=f"{dataset}_{since:%Y%m%d}_{until:%Y%m%d}.parquet",
+                        headers={"X-Export-Rows": str(rows)}, background=BackgroundTask(os.remove, path))
+
+@router.get("/users/{user_id}/export/{kind}")
+def export_user_history(
+    user_id: str,
+    kind: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: User = Depends(deps.get_current_active_superuser),
+    db: Session = Depends(deps.get_db)
+) -> Any:
+    """
+    A user's full history of one kind (commands, app-logs, browser-logs, screenshots),
+    oldest first, streamed as NDJSON or CSV in constant memory.
+    """
+    if kind not in exports.HISTORY:
+        raise HTTPException(status_code=404, detail="Unknown history kind")
+    if not db.get(User, user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    return StreamingResponse(
+        exports.history_stream(kind, user_id, format, since=since, until=until),
+        media_type=exports.STREAM_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{user_id}-{kind}.{format}"',
+                 "Cache-Control": "no-store"}
+    )
+
+@router.get("/polling")
+def get_polling(
+    current_user: User = Depends(deps.get_current_active_superuser),
+    redis = Depends(get_redis)
+) -> Any:
+    multiplier, source = polling_advisor.multiplier(redis)
+    return {
+        "multiplier": multiplier,
+        "source": source,
+        "override": redis.get(OVERRIDE_KEY),
+        "override_ttl": redis.ttl(OVERRIDE_KEY)
+    }
+
+@router.put("/polling")
+def set_polling(
+    override_in: client_schema.PollingOverride,
+    current_user: User = Depends(deps.get_current_active_superuser),
+    redis = Depends(get_redis)
+) -> Any:
+    """Slow the whole fleet down (multiplier > 1) without redeploying agents. Expires after ttl_seconds."""
+    polling_advisor.set_override(redis, override_in.multiplier, override_in.ttl_seconds)
+    logger.info(f"Polling override set to {override_in.multiplier} by {current_user.id}")
+    return {"success": True}
+
 @router.post("/debug-log")
 async def debug_log(data: dict):
     logger.info(f"FRONTEND_LOG: {data.get('message')}")
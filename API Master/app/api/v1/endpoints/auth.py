@@ -4,12 +4,13 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from app.api import deps
+from app.core.profiling import ProfiledRoute
 from app.core import security
 from app.core.config import settings
 from app.models.user import User, Device
 from app.schemas import user as user_schema, token as token_schema
  
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 @router.post("/register", response_model=dict)
 def register(
@@ -1,47 +1,75 @@
 from typing import Any, List
-from fastapi import APIRouter, Depends, HTTPException
+from collections import Counter
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import case, insert, update
 from sqlalchemy.orm import Session
 from app.api import deps
+from app.core import app_deltas, cache, counters, icons, images, ingest, rollups, search, titles
+from app.core.config import settings
+from app.core.profiling import ProfiledRoute
 from app.core.redis import get_redis
+from app.core.presence import presence_tracker, save_sessions
+from app.core.polling import online_ttl, polling_advisor
 from app.models.data import Command, Screenshot, AppLog, BrowserLog
 from app.schemas import client as client_schema
 from app.models.user import User
 import json
+import msgspec
 import base64
 import os
 import uuid
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 
 # Setup logger
 logger = logging.getLogger(__name__)
+# Separate logger so the per-heartbeat line can be sampled without hiding other client logs
+heartbeat_logger = logging.getLogger(f"{__name__}.heartbeat")
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 @router.post("/heartbeat", response_model=client_schema.HeartbeatResponse)
 def heartbeat(
     *,
     status_in: client_schema.HeartbeatRequest,
     current_user: User = Depends(deps.get_current_user),
+    db: Session = Depends(deps.get_db),
     redis = Depends(get_redis)
 ) -> Any:
     # Diagnostic Log
-    logger.info(f"HEARTBEAT_ENTERED for user: {current_user.id}")
+    heartbeat_logger.info("HEARTBEAT_ENTERED", extra={"user_id": current_user.id})
+    heartbeat_interval = polling_advisor.heartbeat_interval(redis)
+    poll_interval = polling_advisor.command_interval(redis)
+
     # Update Redis
-    # PRD: online:{user_id} -> timestamp (TTL 30s)
+    # PRD: online:{user_id} -> timestamp (TTL 30s, longer when agents are told to heartbeat less often)
     try:
-        redis.setex(f"online:{current_user.id}", 30, "online")
+        redis.setex(f"online:{current_user.id}", online_ttl(heartbeat_interval), "online")
     except Exception as e:
         logger.error(f"Redis connection failed during heartbeat: {e}")
         # We don't want to crash the whole heartbeat just because Redis is down
         # Online status in dashboard might be affected, but client can still function
-    return {"success": True}
+
+    # Extend the in-memory presence session; the DB is only written when a gap closes one
+    closed = presence_tracker.touch(current_user.id, status_in.device_id)
+    if closed:
+        try:
+            save_sessions(db, closed)
+        except Exception as e:
+            logger.error(f"Failed to store presence session for {current_user.id}: {e}")
+            db.rollback()
+    return {"success": True, "heartbeat_interval": heartbeat_interval, "poll_interval": poll_interval}
 
 @router.get("/commands", response_model=List[client_schema.CommandSchema])
 def get_commands(
+    response: Response,
     current_user: User = Depends(deps.get_current_user),
-    db: Session = Depends(deps.get_db)
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
 ) -> Any:
+    # The body stays a plain list for older agents; the recommended interval travels in a header
+    response.headers["X-Poll-Interval"] = str(polling_advisor.command_interval(redis))
+
     # Get PENDING commands
     commands = db.query(Command).filter(
         Command.user_id == current_user.id,
@@ -53,21 +81,28 @@ def get_commands(
 def ack_command(
     ack_in: client_schema.CommandAck,
     current_user: User = Depends(deps.get_current_user),
-    db: Session = Depends(deps.get_db)
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
 ) -> Any:
     cmd = db.query(Command).filter(Command.id == ack_in.command_id).first()
     if not cmd:
         raise HTTPException(status_code=404, detail="Command not found")
     
+    executed = ack_in.status == "EXECUTED" and cmd.status != "EXECUTED"
     cmd.status = ack_in.status
+    if executed:
+        cmd.executed_at = datetime.now(timezone.utc)
     db.commit()
+    if executed:
+        counters.incr(redis, current_user.id, "commands_executed")
     return {"success": True}
 
 @router.post("/screenshot/upload", response_model=client_schema.ScreenshotResponse)
 def upload_screenshot(
-    screenshot_in: client_schema.ScreenshotUpload,
+    screenshot_in: client_schema.ScreenshotUpload = Depends(deps.msgspec_body(client_schema.ScreenshotUpload)),
     current_user: User = Depends(deps.get_current_user),
-    db: Session = Depends(deps.get_db)
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
 ) -> Any:
     real_url = ""
     try:
@@ -82,16 +117,28 @@ def upload_screenshot(
         real_url = "https://placehold.co/600x400?text=Error+Processing"
     
     shot = Screenshot(
+        id=str(uuid.uuid4()),
         user_id=current_user.id,
         command_id=screenshot_in.command_id,
         url=real_url,
-        file_path=None # No longer using filesystem
+        file_path=None, # No longer using filesystem
+        created_at=datetime.now(timezone.utc)
     )
-    db.add(shot)
-    db.commit()
+    queued = False
+    if ingest.enabled() and screenshot_in.image_base64:
+        # Only the row goes through the ingest stream; the image is kept out of Redis
+        ingest.store_image(shot, screenshot_in.image_base64)
+        queued = ingest.submit(redis, "screenshot", shot)
+    # Build the cached view before commit expires the row (reading it back would reload the image)
+    latest_view = cache.screenshot_view(shot)
+    if not queued:
+        db.add(shot)
+        db.commit()
+        counters.incr(redis, current_user.id, "screenshots", "uploads")
+    cache.put(redis, "screenshot", current_user.id, latest_view, row_id=shot.id)
     
-    # Cleanup old auto-screenshots if this is an auto-screenshot
-    if screenshot_in.is_auto:
+    # Cleanup old auto-screenshots if this is an auto-screenshot (queued ones are pruned by the ingest consumer)
+    if screenshot_in.is_auto and not queued:
         # Keep only the last 10 auto-screenshots (where command_id is None)
         old_screenshots = db.query(Screenshot).filter(
             Screenshot.user_id == current_user.id,
@@ -105,39 +152,207 @@ def upload_screenshot(
         if old_screenshots:
             db.commit()
     
-    return {"success": True, "screenshot_url": real_url}
+    return {"success": True, "screenshot_url": images.screenshot_url(shot)}
 
 @router.post("/apps/upload", response_model=dict)
 def upload_apps(
-    apps_in: client_schema.AppLogUpload,
+    apps_in: client_schema.AppLogUpload = Depends(deps.msgspec_body(client_schema.AppLogUpload)),
     current_user: User = Depends(deps.get_current_user),
-    db: Session = Depends(deps.get_db)
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
 ) -> Any:
-    log = AppLog(
-        user_id=current_user.id,
-        command_id=apps_in.command_id,
-        apps=[app.dict() for app in apps_in.apps]
-    )
-    db.add(log)
-    db.commit()
+    apps = msgspec.to_builtins(apps_in.apps)
+    # Older agents still embed icon data URLs
+    icons.intern_apps(db, apps)
+    created_at = datetime.now(timezone.utc)
+    # Usually a small delta against the previous snapshot, sometimes a full keyframe
+    kind, row = app_deltas.encode(redis, current_user.id, apps_in.command_id, apps, created_at)
+    latest_view = cache.apps_view(app_deltas.Snapshot(apps, created_at))
+    if not ingest.submit(redis, kind, row):
+        try:
+            db.add(row)
+            db.commit()
+        except Exception:
+            # The chain already points past this row; restart it with a keyframe
+            app_deltas.reset(redis, current_user.id)
+            raise
+        counters.incr(redis, current_user.id, "uploads")
+    cache.put(redis, "apps", current_user.id, latest_view)
+    titles.record_apps(current_user.id, apps, created_at)
+    rollups.submit(redis, row.id, current_user.id, apps, created_at)
     return {"success": True}
 
 @router.post("/browser/upload", response_model=dict)
 def upload_browser(
-    browser_in: client_schema.BrowserLogUpload,
+    browser_in: client_schema.BrowserLogUpload = Depends(deps.msgspec_body(client_schema.BrowserLogUpload)),
     current_user: User = Depends(deps.get_current_user),
-    db: Session = Depends(deps.get_db)
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
 ) -> Any:
+    icons.intern_browser(db, browser_in.details)
+    search.annotate_browser(browser_in.details)
     log = BrowserLog(
+        id=str(uuid.uuid4()),
         user_id=current_user.id,
         command_id=browser_in.command_id,
         browser=browser_in.browser,
         youtube_open=browser_in.youtube_open,
-        details=browser_in.details
+        details=browser_in.details,
+        created_at=datetime.now(timezone.utc)
     )
-    db.add(log)
-    db.commit()
+    latest_view = cache.browser_view(log)
+    if not ingest.submit(redis, "browser", log):
+        db.add(log)
+        db.commit()
+        counters.incr(redis, current_user.id, "uploads")
+    cache.put(redis, "browser", current_user.id, latest_view)
+    titles.record_browser(current_user.id, log.details, log.created_at)
     return {"success": True}
+
+@router.post("/batch", response_model=dict)
+def upload_batch(
+    batch_in: client_schema.BatchUpload = Depends(
+        deps.msgspec_body(client_schema.BatchUpload, max_bytes=settings.BATCH_MAX_BYTES)
+    ),
+    current_user: User = Depends(deps.get_current_user),
+    db: Session = Depends(deps.get_db),
+    redis = Depends(get_redis)
+) -> Any:
+    """
+    Mixed app/browser/screenshot records and command ACKs in one request, e.g. an
+    agent's offline backlog. Bodies over BATCH_MAX_BYTES are refused before they are
+    read, and the whole body is validated while decoding; each
+    table then gets one multi-row INSERT and all ACKs one UPDATE, in one transaction.
+    """
+    if len(batch_in.records) > settings.BATCH_MAX_RECORDS:
+        raise HTTPException(status_code=413, detail=f"At most {settings.BATCH_MAX_RECORDS} records per batch")
+    if sum(isinstance(r, client_schema.BatchScreenshot) for r in batch_in.records) > settings.BATCH_MAX_SCREENSHOTS:
+        raise HTTPException(status_code=413, detail=f"At most {settings.BATCH_MAX_SCREENSHOTS} screenshots per batch")
+
+    now = datetime.now(timezone.utc)
+
+    def when(captured_at):
+        if captured_at is None:
+            return now
+        if captured_at.tzinfo is None:
+            captured_at = captured_at.replace(tzinfo=timezone.utc)
+        return min(captured_at, now)
+
+    apps_rows, browser_rows, screenshot_rows, acks = [], [], [], {}
+    for record in batch_in.records:
+        if isinstance(record, client_schema.BatchCommandAck):
+            acks[record.command_id] = record.status  # Last ACK for a command wins
+        elif isinstance(record, client_schema.BatchAppSnapshot):
+            apps = msgspec.to_builtins(record.apps)
+            icons.intern_apps(db, apps)
+            apps_rows.append({"id": str(uuid.uuid4()), "user_id": current_user.id, "command_id": record.command_id,
+                              "apps": apps, "created_at": when(record.captured_at)})
+        elif isinstance(record, client_schema.BatchBrowserSnapshot):
+            icons.intern_browser(db, record.details)
+            search.annotate_browser(record.details)
+            browser_rows.append({"id": str(uuid.uuid4()), "user_id": current_user.id, "command_id": record.command_id,
+                                 "browser": record.browser, "youtube_open": record.youtube_open,
+                                 "details": record.details, "created_at": when(record.captured_at)})
+        else:
+            screenshot_rows.append({"id": str(uuid.uuid4()), "user_id": current_user.id, "command_id": record.command_id,
+                                    "url": f"data:image/png;base64,{record.image_base64}", "file_path": None,
+                                    "created_at": when(record.captured_at)})
+
+    # Core executemany on the table: on Postgres SQLAlchemy sends it as batched multi-row
+    # INSERT ... VALUES (the ORM bulk path would split rows by which keys are None)
+    for model, rows in ((AppLog, apps_rows), (BrowserLog, browser_rows), (Screenshot, screenshot_rows)):
+        if rows:
+            db.execute(insert(model.__table__), rows)
+
+    executed_ids = []
+    if acks:
+        result = db.execute(
+            update(Command)
+            .where(Command.id.in_(list(acks)), Command.user_id == current_user.id)
+            .values(
+                status=case(acks, value=Command.id),
+                executed_at=case(
+                    ((case(acks, value=Command.id) == "EXECUTED") & Command.executed_at.is_(None), now),
+                    else_=Command.executed_at
+                )
+            )
+            .returning(Command.id, Command.executed_at)
+            .execution_options(synchronize_session=False)
+        ).all()
+        acked_ids = {r.id for r in result}
+        # Newly executed rows are the ones stamped with this request's time
+        executed_ids = [r.id for r in result if r.executed_at is not None
+                        and r.executed_at.replace(tzinfo=r.executed_at.tzinfo or timezone.utc) == now]
+    else:
+        acked_ids = set()
+    db.commit()
+
+    if apps_rows:
+        cache.invalidate(redis, "apps", current_user.id)
+    if browser_rows:
+        cache.invalidate(redis, "browser", current_user.id)
+    if screenshot_rows:
+        cache.invalidate(redis, "screenshot", current_user.id)
+    for row in apps_rows:
+        titles.record_apps(current_user.id, row["apps"], row["created_at"])
+        rollups.submit(redis, row["id"], current_user.id, row["apps"], row["created_at"])
+    for row in browser_rows:
+        titles.record_browser(current_user.id, row["details"], row["created_at"])
+    per_day = Counter()
+    for rows, fields in ((apps_rows, ("uploads",)), (browser_rows, ("uploads",)),
+                         (screenshot_rows, ("screenshots", "uploads"))):
+        for row in rows:
+            for field in fields:
+                per_day[(row["created_at"].date(), field)] += 1
+    if executed_ids:
+        per_day[(now.date(), "commands_executed")] += len(executed_ids)
+    for (day, field), amount in per_day.items():
+        counters.incr(redis, current_user.id, field, amount=amount, day=day)
+
+    return {
+        "success": True,
+        "inserted": {"apps": len(apps_rows), "browser": len(browser_rows), "screenshots": len(screenshot_rows)},
+        "acked": len(acked_ids),
+        "unknown_commands": [command_id for command_id in acks if command_id not in acked_ids]
+    }
+
+@router.post("/icons/missing", response_model=dict)
+def check_icons(
+    check_in: client_schema.IconCheck = Depends(deps.msgspec_body(client_schema.IconCheck)),
+    current_user: User = Depends(deps.get_current_user),
+    db: Session = Depends(deps.get_db)
+) -> Any:
+    """Which of the given icon hashes the registry lacks (the agent uploads only those)."""
+    if len(check_in.hashes) > settings.ICON_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {settings.ICON_BATCH_MAX} hashes per check")
+    hashes = [h for h in check_in.hashes if icons.HASH_RE.match(h)]
+    return {"missing": icons.missing(db, hashes)}
+
+@router.post("/icons", response_model=dict)
+def upload_icons(
+    icons_in: client_schema.IconUpload = Depends(deps.msgspec_body(client_schema.IconUpload)),
+    current_user: User = Depends(deps.get_current_user),
+    db: Session = Depends(deps.get_db)
+) -> Any:
+    if len(icons_in.icons) > settings.ICON_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {settings.ICON_BATCH_MAX} icons per upload")
+    new = {}
+    for icon in icons_in.icons:
+        try:
+            data = base64.b64decode(icon.data, validate=True)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Icon {icon.hash} is not valid base64")
+        if len(data) > settings.ICON_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Icon {icon.hash} exceeds {settings.ICON_MAX_BYTES} bytes")
+        if icon.media_type not in icons.MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail=f"Icon {icon.hash} is not a {', '.join(sorted(icons.MEDIA_TYPES))} image")
+        # The hash is the address: it has to match the bytes
+        if icons.digest(data) != icon.hash:
+            raise HTTPException(status_code=400, detail=f"Icon {icon.hash} does not match its SHA-256")
+        new[icon.hash] = (data, icon.media_type)
+    icons.store(db, new)
+    return {"success": True, "stored": len(new)}
+
 @router.post("/notification/reply", response_model=dict)
 def notify_reply(
     reply_in: client_schema.NotificationReply,
@@ -0,0 +1,100 @@
+import io
+import pstats
+from typing import Any, Optional
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+from app.api import deps
+from app.core import metrics, profiling
+from app.core.config import settings
+from app.models.user import User
+
+router = APIRouter(route_class=profiling.ProfiledRoute)
+
+class ProfileTokenRequest(BaseModel):
+    ttl_seconds: int = 600
+
+class SamplerStart(BaseModel):
+    hz: Optional[float] = Field(None, gt=0, le=1000)
+    max_cpu: Optional[float] = Field(None, gt=0, le=1)  # Capped at SAMPLER_MAX_CPU
+    duration_seconds: Optional[float] = Field(None, gt=0)  # Stops by itself after this long
+
+@router.post("/profile-token")
+def create_profile_token(
+    token_in: ProfileTokenRequest,
+    current_user: User = Depends(deps.get_current_active_superuser)
+) -> Any:
+    """Mint a token to send as `X-Debug-Profile` (together with your usual Bearer token)."""
+    ttl = max(1, min(token_in.ttl_seconds, settings.PROFILE_TOKEN_MAX_TTL_SECONDS))
+    return {
+        "header": "X-Debug-Profile",
+        "token": profiling.create_profile_token(current_user.id, ttl),
+        "expires_in": ttl
+    }
+
+@router.get("/profiles")
+def list_profiles(
+    current_user: User = Depends(deps.get_current_active_superuser)
+) -> Any:
+    return {"profiles": profiling.list_profiles()}
+
+@router.get("/profiles/{profile_id}")
+def get_profile(
+    profile_id: str,
+    format: str = "pstats",
+    limit: int = 50,
+    current_user: User = Depends(deps.get_current_active_superuser)
+) -> Any:
+    """
+    Download a profile. `format=pstats` returns the raw file (open it with
+    `python -m pstats` or snakeviz); `format=text` returns the top functions by cumulative time.
+    """
+    path = profiling.get_profile_path(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "text":
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(limit)
+        return PlainTextResponse(out.getvalue())
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+# Continuous sampler. State is per worker: with several workers, each call reaches one of them
+# (the answering worker is reported in the response).
+@router.post("/sampler/start")
+def start_sampler(
+    sampler_in: SamplerStart,
+    current_user: User = Depends(deps.get_current_active_superuser)
+) -> Any:
+    hz = sampler_in.hz if sampler_in.hz is not None else settings.SAMPLER_HZ
+    max_cpu = min(sampler_in.max_cpu if sampler_in.max_cpu is not None else settings.SAMPLER_MAX_CPU,
+                  settings.SAMPLER_MAX_CPU)
+    started = profiling.stack_sampler.start(
+        hz, max_cpu, duration=sampler_in.duration_seconds, max_stacks=settings.SAMPLER_MAX_STACKS
+    )
+    if not started:
+        raise HTTPException(status_code=409, detail="Sampler already running")
+    return {"worker": metrics.WORKER_ID, **profiling.stack_sampler.status()}
+
+@router.post("/sampler/stop")
+def stop_sampler(
+    current_user: User = Depends(deps.get_current_active_superuser)
+) -> Any:
+    profiling.stack_sampler.stop()
+    return {"worker": metrics.WORKER_ID, **profiling.stack_sampler.status()}
+
+@router.get("/sampler/status")
+def sampler_status(
+    current_user: User = Depends(deps.get_current_active_superuser)
+) -> Any:
+    return {"worker": metrics.WORKER_ID, **profiling.stack_sampler.status()}
+
+@router.get("/sampler/stacks")
+def sampler_stacks(
+    reset: bool = False,
+    current_user: User = Depends(deps.get_current_active_superuser)
+) -> Any:
+    """Collapsed stacks, one `frame;frame;... count` per line (flamegraph.pl / speedscope input)."""
+    return PlainTextResponse(
+        profiling.stack_sampler.collapsed(reset=reset),
+        headers={"X-Worker-Id": metrics.WORKER_ID}
+    )
@@ -0,0 +1,32 @@
+from typing import Any
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy.orm import Session
+from app.api import deps
+from app.core import icons
+from app.core.profiling import ProfiledRoute
+from app.models.data import Icon
+
+router = APIRouter(route_class=ProfiledRoute)
+
+# Content-addressed: the bytes behind a hash can never change. Never sniffed or
+# rendered as a document, whatever an agent claimed the type was
+ICON_HEADERS = {
+    "Cache-Control": "public, max-age=31536000, immutable",
+    "X-Content-Type-Options": "nosniff",
+    "Content-Security-Policy": "default-src 'none'; sandbox",
+}
+
+@router.get("/{icon_hash}")
+def get_icon(
+    icon_hash: str,
+    request: Request,
+    db: Session = Depends(deps.get_db)
+) -> Any:
+    """Icon bytes by SHA-256. Public, like the app icons themselves, so <img> tags can load it."""
+    etag = f'"{icon_hash}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={**ICON_HEADERS, "ETag": etag})
+    icon = db.get(Icon, icon_hash) if icons.HASH_RE.match(icon_hash) else None
+    if icon is None:
+        raise HTTPException(status_code=404, detail="Icon not found")
+    return Response(content=icon.data, media_type=icon.media_type, headers={**ICON_HEADERS, "ETag": etag})
@@ -3,6 +3,7 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, status, De
 from jose import jwt, JWTError
 from app.core.config import settings
 from app.core.redis import get_async_redis
+from app.core import metrics
 from app.api.deps import get_db
 from app.models.user import User
 from sqlalchemy.orm import Session
@@ -26,6 +27,11 @@ class RoomState:
 local_rooms: Dict[str, RoomState] = {}
 admin_viewers: Set[WebSocket] = set()
 
+metrics.Gauge("ws_rooms", "WebRTC signaling rooms open on this worker.", lambda: len(local_rooms))
+metrics.Gauge("ws_room_connections", "Hosts and viewers connected to signaling rooms.",
+              lambda: sum(len(r.viewers) + (1 if r.host else 0) for r in list(local_rooms.values())))
+metrics.Gauge("ws_admin_viewers", "Admin event WebSocket connections.", lambda: len(admin_viewers))
+
 async def _webrtc_redis_listener():
     """
     Background multiplexer task. Listens to ALL WebRTC rooms via psubscribe and admin_events via subscribe.
@@ -0,0 +1,371 @@
+"""
+Delta-encoded app snapshots.
+
+Agents upload their whole window list, icons included, on every
+GET_RUNNING_APPS, and consecutive lists are nearly identical. Only keyframes
+are stored in full (as AppLog rows); every other snapshot is an AppDelta row
+with the events that turn the previous snapshot into it:
+
+    ["open", slot, app]     a window appeared
+    ["close", slot]         a window went away
+    ["set", slot, fields]   some of its fields (title, icon, ...) changed
+    ["focus", slot]         the foreground window changed (slot may be null)
+
+Slots number the windows of one keyframe chain. Durations are not diffed:
+each app keeps its process start time ("started") and the duration shown is
+derived from the snapshot time, the same way the agent computes it.
+
+The encoder keeps each user's chain state in Redis and advances it with a
+compare-and-set, before the row is committed. If the state is missing, Redis
+is down, or a concurrent upload won the race, the snapshot is simply stored as
+a keyframe. A keyframe also starts a new chain every APP_KEYFRAME_EVERY
+snapshots, after APP_KEYFRAME_MAX_SECONDS, or when the delta would be larger
+than APP_DELTA_MAX_RATIO of the full list. So "apps at time T" is one keyframe
+plus at most APP_KEYFRAME_EVERY small deltas, all read through indexes.
+"""
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import orjson
+from sqlalchemy import literal, select, union_all
+from sqlalchemy.orm import Session
+
+from app.core import metrics, pagination
+from app.core.config import settings
+from app.models.data import AppDelta, AppLog
+
+logger = logging.getLogger(__name__)
+
+# Start times derived from whole-second durations jitter by a second or two
+STARTED_TOLERANCE = 2
+
+# KEYS[1]: chain hash. ARGV: expected tag ('' = unconditional), new tag, state, ttl
+STORE_LUA = """
+if ARGV[1] ~= '' and redis.call('HGET', KEYS[1], 'tag') ~= ARGV[1] then return 0 end
+redis.call('HSET', KEYS[1], 'tag', ARGV[2], 'state', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+snapshots = metrics.Counter("app_snapshots_total", "App snapshots stored, by kind and keyframe reason.", ("kind", "reason"))
+snapshot_bytes = metrics.Counter("app_snapshot_bytes_total", "JSON bytes of app snapshots: as uploaded and as stored.", ("form",))
+
+_last_error_log = 0.0
+
+
+class Snapshot(NamedTuple):
+    """A reconstructed snapshot; has the `apps` and `created_at` that cache.apps_view reads."""
+    apps: List[dict]
+    created_at: datetime
+
+
+def _log_error(action: str, e: Exception):
+    global _last_error_log
+    now = time.monotonic()
+    if now - _last_error_log > 10:
+        _last_error_log = now
+        logger.warning(f"App chain state {action} failed, storing a keyframe: {e}")
+
+
+def _key(user_id: str) -> str:
+    return f"apps:chain:{user_id}"
+
+
+def _timestamp(at: datetime) -> float:
+    if at.tzinfo is None:
+        # SQLite drops the timezone; timestamps are stored in UTC
+        at = at.replace(tzinfo=timezone.utc)
+    return at.timestamp()
+
+
+def _parse_duration(value) -> Optional[int]:
+    """Seconds of an agent "HH:MM:SS" duration (hours may exceed 24), None if it is not one."""
+    if not isinstance(value, str):
+        return None
+    parts = value.split(":")
+    if len(parts) != 3 or not all(p.isdigit() for p in parts):
+        return None
+    h, m, s = (int(p) for p in parts)
+    return h * 3600 + m * 60 + s
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = max(0, int(seconds))
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _normalize(app: dict, at: float) -> Tuple[dict, bool]:
+    """(app as stored, is_active): the duration becomes a start time, focus is tracked separately."""
+    app = dict(app)
+    active = bool(app.pop("is_active", False))
+    seconds = _parse_duration(app.get("duration"))
+    if seconds is not None:
+        del app["duration"]
+        app["started"] = int(at - seconds)
+    return app, active
+
+
+def _changes(old: dict, new: dict) -> dict:
+    changed = {}
+    for field in old.keys() | new.keys():
+        before, after = old.get(field), new.get(field)
+        if before == after:
+            continue
+        if field == "started" and before is not None and after is not None and abs(before - after) <= STARTED_TOLERANCE:
+            continue
+        changed[field] = after
+    return changed
+
+
+class AppState:
+    """The windows of one snapshot, by slot, plus the chain position it was reached at."""
+
+    def __init__(self, keyframe_id: str, keyframe_at: float):
+        self.keyframe_id = keyframe_id
+        self.keyframe_at = keyframe_at
+        self.seq = 0
+        self.next_slot = 0
+        self.focus: Optional[int] = None
+        self.slots: Dict[int, dict] = {}
+
+    @property
+    def tag(self) -> str:
+        return f"{self.keyframe_id}:{self.seq}"
+
+    @classmethod
+    def from_keyframe(cls, keyframe_id: str, apps: List[dict], at: float) -> "AppState":
+        state = cls(keyframe_id, at)
+        for app in apps:
+            app, active = _normalize(app, at)
+            if active and state.focus is None:
+                state.focus = state.next_slot
+            state.slots[state.next_slot] = app
+            state.next_slot += 1
+        return state
+
+    def dumps(self) -> bytes:
+        return orjson.dumps({
+            "keyframe_id": self.keyframe_id, "keyframe_at": self.keyframe_at, "seq": self.seq,
+            "next_slot": self.next_slot, "focus": self.focus, "slots": {str(k): v for k, v in self.slots.items()},
+        })
+
+    @classmethod
+    def loads(cls, raw) -> "AppState":
+        data = orjson.loads(raw)
+        state = cls(data["keyframe_id"], data["keyframe_at"])
+        state.seq, state.next_slot, state.focus = data["seq"], data["next_slot"], data["focus"]
+        state.slots = {int(k): v for k, v in data["slots"].items()}
+        return state
+
+    def advance(self, apps: List[dict], at: float) -> list:
+        """Moves to the snapshot `apps` and returns the events that describe the step."""
+        incoming = [_normalize(app, at) for app in apps]
+        unmatched = dict(self.slots)
+        assigned: List[Optional[int]] = [None] * len(incoming)
+        # Same window first (process and title), then same process with a new title
+        for identity in (lambda a: (a.get("pid"), a.get("name"), a.get("title")),
+                         lambda a: (a.get("pid"), a.get("name"))):
+            candidates: Dict[tuple, List[int]] = {}
+            for slot, app in unmatched.items():
+                candidates.setdefault(identity(app), []).append(slot)
+            for i, (app, _) in enumerate(incoming):
+                if assigned[i] is None and candidates.get(identity(app)):
+                    slot = candidates[identity(app)].pop(0)
+                    assigned[i] = slot
+                    del unmatched[slot]
+
+        events = [["close", slot] for slot in sorted(unmatched)]
+        for slot in unmatched:
+            del self.slots[slot]
+        focus = None
+        for i, (app, active) in enumerate(incoming):
+            slot = assigned[i]
+            if slot is None:
+                slot = self.next_slot
+                self.next_slot += 1
+                self.slots[slot] = app
+                events.append(["open", slot, app])
+            else:
+                changed = _changes(self.slots[slot], app)
+                if changed:
+                    # Merged like apply() does, so a start time within the tolerance never drifts
+                    self.slots[slot] = {**self.slots[slot], **changed}
+                    events.append(["set", slot, changed])
+            if active and focus is None:
+                focus = slot
+        if focus != self.focus:
+            self.focus = focus
+            events.append(["focus", focus])
+        self.seq += 1
+        return events
+
+    def apply(self, events: list):
+        """Replays one delta. Tolerates gaps: events on unknown slots are skipped."""
+        for event in events:
+            op = event[0]
+            if op == "open":
+                self.slots[event[1]] = event[2]
+                self.next_slot = max(self.next_slot, event[1] + 1)
+            elif op == "close":
+                self.slots.pop(event[1], None)
+            elif op == "set":
+                if event[1] in self.slots:
+                    # Removed fields come back as None
+                    self.slots[event[1]] = {**self.slots[event[1]], **event[2]}
+            elif op == "focus":
+                self.focus = event[1]
+        self.seq += 1
+
+    def render(self, at: float) -> List[dict]:
+        """The app list as the agent sent it: active window first, then by name."""
+        apps = []
+        for slot, app in sorted(self.slots.items()):
+            out = {k: v for k, v in app.items() if k != "started"}
+            if app.get("started") is not None:
+                out["duration"] = _format_duration(at - app["started"])
+            out["is_active"] = slot == self.focus
+            apps.append(out)
+        apps.sort(key=lambda a: (not a["is_active"], (a.get("name") or "").lower()))
+        return apps
+
+
+def _store(redis, user_id: str, expected: Optional[str], state: AppState) -> bool:
+    try:
+        return bool(redis.register_script(STORE_LUA)(
+            keys=[_key(user_id)],
+            args=[expected or "", state.tag, state.dumps(), settings.APP_KEYFRAME_MAX_SECONDS]
+        ))
+    except Exception as e:
+        _log_error("write", e)
+        return False
+
+
+def encode(redis, user_id: str, command_id: Optional[str], apps: List[dict], created_at: datetime) -> Tuple[str, Any]:
+    """
+    Turns one uploaded snapshot into a new row, (ingest kind, AppLog or AppDelta),
+    and advances the user's chain. If the row then fails to commit, call reset().
+    """
+    at = _timestamp(created_at)
+    full_size = len(orjson.dumps(apps))
+    snapshot_bytes.inc(("uploaded",), full_size)
+
+    reason = "no_state"
+    try:
+        tag, raw = redis.hmget(_key(user_id), "tag", "state")
+    except Exception as e:
+        _log_error("read", e)
+        tag = raw = None
+    if raw is not None:
+        state = AppState.loads(raw)
+        if state.seq + 1 >= settings.APP_KEYFRAME_EVERY:
+            reason = "every"
+        elif at - state.keyframe_at >= settings.APP_KEYFRAME_MAX_SECONDS:
+            reason = "age"
+        else:
+            events = state.advance(apps, at)
+            size = len(orjson.dumps(events))
+            if size > full_size * settings.APP_DELTA_MAX_RATIO:
+                reason = "size"
+            elif not _store(redis, user_id, tag, state):
+                reason = "race"
+            else:
+                snapshots.inc(("delta", ""))
+                snapshot_bytes.inc(("stored",), size)
+                return "app_delta", AppDelta(
+                    id=str(uuid.uuid4()), user_id=user_id, command_id=command_id,
+                    keyframe_id=state.keyframe_id, seq=state.seq, events=events, created_at=created_at
+                )
+
+    keyframe = AppLog(id=str(uuid.uuid4()), user_id=user_id, command_id=command_id, apps=apps, created_at=created_at)
+    _store(redis, user_id, None, AppState.from_keyframe(keyframe.id, apps, at))
+    snapshots.inc(("keyframe", reason))
+    snapshot_bytes.inc(("stored",), full_size)
+    return "apps", keyframe
+
+
+def reset(redis, user_id: str):
+    """Forgets the chain (the next snapshot becomes a keyframe), e.g. after a failed commit."""
+    try:
+        redis.delete(_key(user_id))
+    except Exception as e:
+        _log_error("reset", e)
+
+
+# --- Reading ---
+def _replay(db: Session, wanted: Dict[str, set]) -> Dict[Tuple[str, int], Snapshot]:
+    """Snapshots at the given (keyframe id -> seqs) chain positions, one query per table."""
+    keyframes = {k.id: k for k in db.query(AppLog).filter(AppLog.id.in_(list(wanted)))}
+    deltas: Dict[str, list] = {}
+    if any(seqs - {0} for seqs in wanted.values()):
+        rows = (db.query(AppDelta)
+                .filter(AppDelta.keyframe_id.in_(list(wanted)))
+                .order_by(AppDelta.keyframe_id, AppDelta.seq)
+                .all())
+        for row in rows:
+            deltas.setdefault(row.keyframe_id, []).append(row)
+
+    result = {}
+    for keyframe_id, seqs in wanted.items():
+        keyframe = keyframes.get(keyframe_id)
+        if keyframe is None:
+            continue
+        at = _timestamp(keyframe.created_at)
+        state = AppState.from_keyframe(keyframe.id, keyframe.apps, at)
+        if 0 in seqs:
+            result[(keyframe_id, 0)] = Snapshot(state.render(at), keyframe.created_at)
+        last = max(seqs)
+        for delta in deltas.get(keyframe_id, []):
+            if delta.seq > last:
+                break
+            state.apply(delta.events)
+            if delta.seq in seqs:
+                result[(keyframe_id, delta.seq)] = Snapshot(state.render(_timestamp(delta.created_at)), delta.created_at)
+    return result
+
+
+def apps_at(db: Session, user_id: str, at: Optional[datetime] = None) -> Optional[Snapshot]:
+    """The newest snapshot taken at or before `at` (default: the latest one)."""
+    keyframe_query = db.query(AppLog.id, AppLog.created_at).filter(AppLog.user_id == user_id)
+    delta_query = db.query(AppDelta.keyframe_id, AppDelta.seq, AppDelta.created_at).filter(AppDelta.user_id == user_id)
+    if at is not None:
+        keyframe_query = keyframe_query.filter(AppLog.created_at <= at)
+        delta_query = delta_query.filter(AppDelta.created_at <= at)
+    keyframe = keyframe_query.order_by(AppLog.created_at.desc(), AppLog.id.desc()).first()
+    delta = delta_query.order_by(AppDelta.created_at.desc(), AppDelta.id.desc()).first()
+
+    if delta is not None and (keyframe is None or delta.created_at > keyframe.created_at):
+        snapshot = _replay(db, {delta.keyframe_id: {delta.seq}}).get((delta.keyframe_id, delta.seq))
+        if snapshot is not None:
+            return snapshot
+        # The chain's keyframe is missing (e.g. still queued for ingest): fall back to the newest keyframe
+    if keyframe is None:
+        return None
+    return _replay(db, {keyframe.id: {0}}).get((keyframe.id, 0))
+
+
+def history(db: Session, user_id: str, cursor: Optional[str], limit: int) -> Tuple[List[dict], Optional[str]]:
+    """Keyset-paginated snapshots of a user, newest first, keyframes and deltas alike."""
+    rows = union_all(
+        select(AppLog.id, AppLog.command_id, AppLog.created_at,
+               AppLog.id.label("keyframe_id"), literal(0).label("seq"))
+        .where(AppLog.user_id == user_id),
+        select(AppDelta.id, AppDelta.command_id, AppDelta.created_at, AppDelta.keyframe_id, AppDelta.seq)
+        .where(AppDelta.user_id == user_id),
+    ).subquery()
+    page, next_cursor = pagination.paginate(db.query(rows), rows.c.created_at, rows.c.id, cursor, limit)
+
+    wanted: Dict[str, set] = {}
+    for row in page:
+        wanted.setdefault(row.keyframe_id, set()).add(row.seq)
+    snapshots_by_position = _replay(db, wanted) if wanted else {}
+    items = []
+    for row in page:
+        snapshot = snapshots_by_position.get((row.keyframe_id, row.seq))
+        items.append({
+            "id": row.id, "command_id": row.command_id, "keyframe": row.seq == 0,
+            "apps": snapshot.apps if snapshot else None, "created_at": row.created_at,
+        })
+    return items, next_cursor
@@ -0,0 +1,301 @@
+"""
+Cold storage for old screenshots.
+
+Screenshots from whole UTC days older than ARCHIVE_AFTER_DAYS are packed, one
+file per user and day, into ARCHIVE_DIR/<user_id>/<day>-<archive id>.zst:
+
+    image frame | image frame | ... | index frame | trailer frame
+
+Every image is its own zstd frame, so one image is read back with a single
+seek, a read and a decompression. The index ({screenshot id: [offset, length,
+media type]}, JSON) and the trailer (the index offset) are zstd skippable
+frames, so the file stays a valid .zst and describes itself. The database only
+records which archive holds which screenshot (`archived_screenshots`).
+
+Once an archive is fsynced and committed, the rows give up their data URL (the
+url is left empty, as for queued screenshots, and responses link the signed image
+endpoint instead) and image files on the hot volume are deleted. Postgres reuses the freed TOAST space after
+autovacuum. Each user's newest screenshot always stays hot, since it backs the
+"latest screenshot" view.
+
+Reads (images.screenshot_bytes with a session) look the screenshot up in the
+archive's index, which is cached per worker, and keep the extracted image in
+Redis for ARCHIVE_CACHE_SECONDS.
+
+    cd "API Master"
+    python -m app.core.archive run          # e.g. nightly from cron
+
+Needs zstandard.
+"""
+import base64
+import logging
+import os
+import struct
+import uuid
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from sqlalchemy import insert, or_, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.models.data import ArchivedScreenshot, Screenshot, ScreenshotArchive
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Skippable frame: magic 0x184D2A5? and a 4-byte length, both little-endian
+SKIPPABLE_MAGIC = 0x184D2A5A
+TRAILER = struct.Struct("<IIQ")  # magic, 8, index offset
+
+archived = metrics.Counter("screenshots_archived_total", "Screenshots moved to cold storage.")
+archived_bytes = metrics.Counter("screenshot_archive_bytes_total", "Image bytes archived: as stored hot and packed.", ("form",))
+reads = metrics.Counter("screenshot_archive_reads_total", "Archived screenshot reads, by where they were served from.", ("source",))
+
+
+def _aware(at: datetime) -> datetime:
+    # SQLite drops the timezone; timestamps are stored in UTC
+    return at if at.tzinfo else at.replace(tzinfo=timezone.utc)
+
+
+def _skippable(data: bytes) -> bytes:
+    return struct.pack("<II", SKIPPABLE_MAGIC, len(data)) + data
+
+
+class ArchiveWriter:
+    """Packs one user-day of screenshots into a new archive file, image by image."""
+
+    def __init__(self, user_id: str, day: date):
+        self.id = str(uuid.uuid4())
+        self.user_id, self.day = user_id, day
+        directory = os.path.join(settings.ARCHIVE_DIR, user_id)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{day.isoformat()}-{self.id[:8]}.zst")
+        self._partial = f"{self.path}.partial"
+        self._file = open(self._partial, "wb")
+        self._compressor = zstandard.ZstdCompressor(level=settings.ARCHIVE_ZSTD_LEVEL)
+        self.index: Dict[str, list] = {}
+        self.hot_files: List[str] = []
+        self.offset = self.raw_bytes = 0
+
+    def add(self, screenshot_id: str, data: bytes, media_type: str, file_path: Optional[str]):
+        frame = self._compressor.compress(data)
+        self._file.write(frame)
+        self.index[screenshot_id] = [self.offset, len(frame), media_type]
+        self.offset += len(frame)
+        self.raw_bytes += len(data)
+        if file_path:
+            self.hot_files.append(file_path)
+
+    def finish(self):
+        """Writes the index and trailer and moves the file into place, durably."""
+        self._file.write(_skippable(orjson.dumps(self.index)))
+        self._file.write(TRAILER.pack(SKIPPABLE_MAGIC, 8, self.offset))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._partial, self.path)
+
+    def abort(self):
+        self._file.close()
+        for path in (self._partial, self.path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+@lru_cache(maxsize=settings.ARCHIVE_INDEX_CACHE)
+def read_index(path: str) -> Dict[str, list]:
+    """{screenshot id: [offset, length, media type]} of an archive file (archives never change)."""
+    with open(path, "rb") as archive:
+        archive.seek(-TRAILER.size, os.SEEK_END)
+        magic, size, index_offset = TRAILER.unpack(archive.read(TRAILER.size))
+        if magic != SKIPPABLE_MAGIC or size != 8:
+            raise ValueError(f"{path} has no archive trailer")
+        archive.seek(index_offset)
+        magic, size = struct.unpack("<II", archive.read(8))
+        if magic != SKIPPABLE_MAGIC:
+            raise ValueError(f"{path} has no archive index")
+        return orjson.loads(archive.read(size))
+
+
+def extract(path: str, screenshot_id: str) -> Optional[Tuple[bytes, str]]:
+    """(image bytes, media type) of one screenshot in an archive file, None if it is not in it."""
+    entry = read_index(path).get(screenshot_id)
+    if entry is None:
+        return None
+    offset, length, media_type = entry
+    with open(path, "rb") as archive:
+        archive.seek(offset)
+        frame = archive.read(length)
+    return zstandard.ZstdDecompressor().decompress(frame), media_type
+
+
+def fetch(db: Session, redis, screenshot_id: str) -> Optional[Tuple[bytes, str]]:
+    """The image of an archived screenshot, from the Redis cache or its archive; None if it is not archived."""
+    key = f"archived:{screenshot_id}"
+    if redis is not None:
+        try:
+            cached = redis.hmget(key, "data", "type")
+        except Exception as e:
+            logger.warning(f"Archive cache unavailable: {e}")
+            cached = (None, None)
+        if cached[0] is not None:
+            reads.inc(("cache",))
+            return base64.b64decode(cached[0]), cached[1]
+
+    row = (db.query(ScreenshotArchive.path)
+           .join(ArchivedScreenshot, ArchivedScreenshot.archive_id == ScreenshotArchive.id)
+           .filter(ArchivedScreenshot.screenshot_id == screenshot_id)
+           .first())
+    if row is None:
+        return None
+    if zstandard is None:
+        logger.warning("zstandard is not installed; archived screenshots cannot be read")
+        return None
+    try:
+        image = extract(row.path, screenshot_id)
+    except (OSError, ValueError, zstandard.ZstdError) as e:
+        logger.error(f"Could not read screenshot {screenshot_id} from {row.path}: {e}")
+        reads.inc(("missing",))
+        return None
+    if image is None:
+        reads.inc(("missing",))
+        return None
+    reads.inc(("archive",))
+    if redis is not None:
+        try:
+            pipe = redis.pipeline(transaction=False)
+            pipe.hset(key, mapping={"data": base64.b64encode(image[0]).decode(), "type": image[1]})
+            pipe.expire(key, settings.ARCHIVE_CACHE_SECONDS)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not cache archived screenshot {screenshot_id}: {e}")
+    return image
+
+
+# --- Packing ---
+def _commit(db: Session, writer: ArchiveWriter) -> bool:
+    """Records a finished archive and drops the hot copies of its images; False if it lost a race."""
+    ids = list(writer.index)
+    try:
+        db.add(ScreenshotArchive(id=writer.id, user_id=writer.user_id, day=writer.day, path=writer.path,
+                                 count=len(ids), raw_bytes=writer.raw_bytes, size=os.path.getsize(writer.path)))
+        db.flush()
+        db.execute(insert(ArchivedScreenshot.__table__),
+                   [{"screenshot_id": screenshot_id, "archive_id": writer.id} for screenshot_id in ids])
+        db.query(Screenshot).filter(Screenshot.id.in_(ids)).update(
+            {Screenshot.url: "", Screenshot.file_path: None}, synchronize_session=False
+        )
+        db.commit()
+    except IntegrityError as e:
+        # Another run archived some of these first
+        db.rollback()
+        writer.abort()
+        logger.warning(f"Discarded archive of {len(ids)} screenshots for {writer.user_id} on {writer.day}: {e}")
+        return False
+    for path in writer.hot_files:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    archived.inc(amount=len(ids))
+    archived_bytes.inc(("raw",), writer.raw_bytes)
+    archived_bytes.inc(("packed",), writer.offset)
+    logger.info(f"Archived {len(ids)} screenshots for {writer.user_id} on {writer.day} to {writer.path}")
+    return True
+
+
+def run(db: Session, now: Optional[datetime] = None) -> dict:
+    """Archives every whole UTC day older than ARCHIVE_AFTER_DAYS; returns what was packed."""
+    from app.core import images
+
+    if zstandard is None:
+        raise RuntimeError("Screenshot archival needs zstandard (pip install zstandard)")
+    today = (now or datetime.now(timezone.utc)).date()
+    cutoff = datetime.combine(today - timedelta(days=settings.ARCHIVE_AFTER_DAYS), time.min, tzinfo=timezone.utc)
+    candidates = (db.query(Screenshot.id, Screenshot.user_id, Screenshot.created_at, Screenshot.url,
+                           Screenshot.file_path)
+                  .filter(Screenshot.created_at < cutoff,
+                          or_(Screenshot.url.startswith("data:"), Screenshot.file_path.isnot(None)))
+                  .order_by(Screenshot.user_id, Screenshot.created_at, Screenshot.id))
+    stats = {"archives": 0, "screenshots": 0, "raw_bytes": 0, "packed_bytes": 0}
+    newest: Dict[str, Optional[str]] = {}
+    writer: Optional[ArchiveWriter] = None
+
+    def close():
+        writer.finish()
+        if _commit(db, writer):
+            stats["archives"] += 1
+            stats["screenshots"] += len(writer.index)
+            stats["raw_bytes"] += writer.raw_bytes
+            stats["packed_bytes"] += writer.offset
+
+    last = None
+    try:
+        while True:
+            # Short keyset reads rather than one long cursor: no transaction stays open for the whole run
+            query = candidates
+            if last is not None:
+                query = query.filter(tuple_(Screenshot.user_id, Screenshot.created_at, Screenshot.id) > last)
+            rows = query.limit(settings.ARCHIVE_BATCH_SIZE).all()
+            db.rollback()
+            if not rows:
+                break
+            last = (rows[-1].user_id, rows[-1].created_at, rows[-1].id)
+            for row in rows:
+                if row.user_id not in newest:
+                    latest = (db.query(Screenshot.id).filter(Screenshot.user_id == row.user_id)
+                              .order_by(Screenshot.created_at.desc(), Screenshot.id.desc()).first())
+                    newest[row.user_id] = latest.id if latest else None
+                    db.rollback()
+                if row.id == newest[row.user_id]:
+                    continue
+                day = _aware(row.created_at).date()
+                if writer is not None and (writer.user_id, writer.day) != (row.user_id, day):
+                    close()
+                    writer = None
+                image = images.screenshot_bytes(row)
+                if image is None:
+                    logger.warning(f"Screenshot {row.id} has no image to archive")
+                    continue
+                if writer is None:
+                    writer = ArchiveWriter(row.user_id, day)
+                writer.add(row.id, image[0], image[1], row.file_path)
+        if writer is not None:
+            close()
+            writer = None
+    finally:
+        if writer is not None:
+            writer.abort()
+    return stats
+
+
+def main():
+    import argparse
+    from app.core.database import SessionLocal
+    from app.core.logging_config import setup_logging, stop_logging
+
+    parser = argparse.ArgumentParser(description="Screenshot cold storage.")
+    parser.add_argument("command", choices=["run"])
+    parser.parse_args()
+    setup_logging()
+    db = SessionLocal()
+    try:
+        stats = run(db)
+        print(f"{stats['screenshots']} screenshots packed into {stats['archives']} archives "
+              f"({stats['raw_bytes']} -> {stats['packed_bytes']} bytes)")
+    finally:
+        db.close()
+        stop_logging()
+
+
+if __name__ == "__main__":
+    main()
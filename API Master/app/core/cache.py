@@ -0,0 +1,189 @@
+"""
+Read-through cache of the "latest" dashboard views (screenshot, apps, browser)
+per user, written through by the agent upload handlers.
+
+Values are the exact JSON response bodies, so a hit is served without touching
+Postgres or re-encoding anything. Screenshots larger than LATEST_CACHE_MAX_BYTES
+are cached as a reference (id) only and loaded by primary key, to keep
+multi-megabyte images out of Redis.
+
+Every read is counted as hit, hit_ref, miss or evicted. "evicted" means the newest row is
+younger than the TTL, so a write-through value should have been there: Redis
+dropped it under memory pressure (or it was written before this cache existed).
+
+Writes are compare-and-set on the row's created_at, kept next to the value: an
+upload or fill only replaces what is cached if its row is newer, so a slow
+request can never put an older view back for the rest of the TTL.
+"""
+import base64
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Optional, Tuple
+
+from redis.commands.core import Script
+
+from app.core import images, metrics
+from app.core.config import settings
+from app.core.responses import dumps
+
+logger = logging.getLogger(__name__)
+
+cache_reads = metrics.Counter("latest_cache_reads_total", "Latest-view cache lookups by result.", ("view", "result"))
+cache_writes = metrics.Counter("latest_cache_writes_total", "Latest-view cache writes by kind.", ("view", "kind"))
+
+_last_error_log = 0.0
+
+# KEYS: value key, the other form's key (body vs ref), created_at key.
+# ARGV: value, created_at (unix time), ttl. Returns 1 if written, 0 if a newer row is cached.
+PUT = Script(None, b"""
+local cached = tonumber(redis.call('GET', KEYS[3]))
+if cached and cached > tonumber(ARGV[2]) then return 0 end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+redis.call('DEL', KEYS[2])
+redis.call('SET', KEYS[3], ARGV[2], 'EX', ARGV[3])
+return 1
+""")
+
+
+def _key(view: str, user_id: str) -> str:
+    return f"latest:{view}:{user_id}"
+
+
+def _ref_key(view: str, user_id: str) -> str:
+    return f"latest:{view}:ref:{user_id}"
+
+
+def _at_key(view: str, user_id: str) -> str:
+    return f"latest:{view}:at:{user_id}"
+
+
+def _timestamp(created_at: Optional[datetime]) -> float:
+    if created_at is None:
+        # Empty views ("no data yet") lose to any cached row
+        return 0.0
+    if created_at.tzinfo is None:
+        # SQLite drops the timezone; timestamps are stored in UTC
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.timestamp()
+
+
+def _log_error(action: str, e: Exception):
+    global _last_error_log
+    now = time.monotonic()
+    if now - _last_error_log > 10:
+        _last_error_log = now
+        logger.warning(f"Latest-view cache {action} failed, falling back to the database: {e}")
+
+
+def get(redis, view: str, user_id: str) -> Tuple[Optional[str], Optional[str]]:
+    """Returns (cached JSON body, cached row id); both None on a miss or if Redis is down."""
+    try:
+        body, ref = redis.mget(_key(view, user_id), _ref_key(view, user_id))
+    except Exception as e:
+        _log_error("read", e)
+        return None, None
+    if body is not None:
+        cache_reads.inc((view, "hit"))
+    elif ref is not None:
+        cache_reads.inc((view, "hit_ref"))
+    return body, ref
+
+
+def put(redis, view: str, user_id: str, payload: dict, row_id: Optional[str] = None,
+        fill: bool = False) -> bytes:
+    """
+    Caches `payload` as the latest response for the user, unless a view of a newer
+    row (by payload["created_at"]) is already cached; returns the encoded body.
+    With `row_id`, payloads over LATEST_CACHE_MAX_BYTES are replaced by a reference.
+    `fill=True` marks read-through fills after a miss (only the metrics differ).
+    """
+    body = dumps(payload)
+    at = _timestamp(payload.get("created_at"))
+    keys = [_key(view, user_id), _ref_key(view, user_id), _at_key(view, user_id)]
+    value = body
+    kind = "fill" if fill else "body"
+    if row_id is not None and len(body) > settings.LATEST_CACHE_MAX_BYTES:
+        keys[:2] = keys[1::-1]
+        value = row_id
+        kind = "fill_ref" if fill else "ref"
+    try:
+        if PUT(keys=keys, args=[value, repr(at), settings.LATEST_CACHE_TTL_SECONDS], client=redis):
+            cache_writes.inc((view, kind))
+        else:
+            cache_writes.inc((view, "stale"))
+    except Exception as e:
+        _log_error("write", e)
+    return body
+
+
+def invalidate(redis, view: str, user_id: str):
+    """
+    Drops the cached view, for writes that may not be the newest row (e.g. backlog
+    batches). Its created_at stays, so a fill of an older row still loses.
+    """
+    try:
+        redis.delete(_key(view, user_id), _ref_key(view, user_id))
+    except Exception as e:
+        _log_error("invalidate", e)
+
+
+def record_miss(view: str, created_at: Optional[datetime]):
+    """Counts a miss, classifying it as an eviction if the newest row should still be cached."""
+    result = "miss"
+    if created_at is not None:
+        if created_at.tzinfo is None:
+            # SQLite drops the timezone; timestamps are stored in UTC
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        age = (datetime.now(timezone.utc) - created_at).total_seconds()
+        if age < settings.LATEST_CACHE_TTL_SECONDS:
+            result = "evicted"
+    cache_reads.inc((view, result))
+
+
+# --- Response bodies of the cached admin views, built from a row (shared by the
+# admin read path and the upload write-through so the two cannot drift apart) ---
+def screenshot_view(shot) -> dict:
+    image_data = None
+    if shot.url and shot.url.startswith("data:"):
+        image_data = shot.url
+    # Fallback for older screenshots on disk
+    elif shot.file_path and os.path.exists(shot.file_path):
+        try:
+            with open(shot.file_path, "rb") as image_file:
+                encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
+                image_data = f"data:image/png;base64,{encoded_string}"
+        except Exception as e:
+            logger.error(f"Error reading image file: {e}")
+    return {
+        "url": images.screenshot_url(shot),
+        "created_at": shot.created_at,
+        "image_data": image_data,
+        "is_auto": shot.command_id is None
+    }
+
+
+def apps_view(log) -> dict:
+    if log is None:
+        return {"apps": []}
+    return {"apps": log.apps, "created_at": log.created_at}
+
+
+def browser_view(log) -> dict:
+    if log is None:
+        return {"browser": "No Data", "youtube_open": False, "details": None}
+    # Ensure details is a dict if it was stored as a JSON string by some chance
+    details = log.details
+    if isinstance(details, str):
+        try:
+            details = json.loads(details)
+        except ValueError:
+            pass
+    return {
+        "browser": log.browser,
+        "youtube_open": log.youtube_open,
+        "details": details,
+        "created_at": log.created_at
+    }
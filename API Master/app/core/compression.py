@@ -0,0 +1,269 @@
+"""
+Content-Encoding in both directions.
+
+Responses are compressed with zstd or gzip, whichever the client prefers in
+Accept-Encoding (zstd wins ties), once they reach COMPRESSION_MIN_SIZE. Request
+bodies sent with `Content-Encoding: gzip|zstd` are decompressed before routing,
+so endpoints and `deps.msgspec_body` always see plain JSON. Decompressed bodies
+are capped by COMPRESSION_MAX_REQUEST_BYTES and COMPRESSION_MAX_RATIO to stop
+decompression bombs.
+
+zstd needs the `zstandard` package; without it only gzip is offered and zstd
+request bodies get 415.
+"""
+import logging
+import zlib
+from typing import List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+from app.core import metrics
+from app.core.config import settings
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+# Already-compressed or binary media is never worth another pass
+INCOMPRESSIBLE_PREFIXES = ("image/", "video/", "audio/", "application/zip", "application/gzip",
+                           "application/zstd", "application/octet-stream", "application/vnd.apache.parquet")
+
+RATIO_FLOOR = 1024 * 1024
+
+compression_bytes = metrics.Counter(
+    "compression_bytes_total",
+    "Bytes before (raw) and after (wire) content encoding.",
+    ("direction", "encoding", "form"),
+)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Picks an encoding from an Accept-Encoding header, honouring q-values (q=0 refuses)."""
+    best, best_q = None, 0.0
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                continue
+        candidates = SUPPORTED if name == "*" else (name,)
+        for encoding in candidates:
+            if encoding in SUPPORTED and (q > best_q or (q == best_q and best is not None
+                                                          and SUPPORTED.index(encoding) < SUPPORTED.index(best))):
+                best, best_q = encoding, q
+    return best
+
+
+def _compressor(encoding: str):
+    """Returns (compress(chunk) -> bytes, flush() -> bytes, finish() -> bytes) for a streaming body."""
+    if encoding == "zstd":
+        cobj = zstandard.ZstdCompressor(level=settings.COMPRESSION_ZSTD_LEVEL).compressobj()
+        return cobj.compress, lambda: cobj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), cobj.flush
+    cobj = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return cobj.compress, lambda: cobj.flush(zlib.Z_SYNC_FLUSH), cobj.flush
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=settings.COMPRESSION_ZSTD_LEVEL).compress(data)
+    cobj = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return cobj.compress(data) + cobj.flush()
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def decompress(data: bytes, encoding: str, limit: int) -> bytes:
+    """Decompresses at most `limit` bytes; raises BodyTooLarge beyond that and ValueError on corrupt input."""
+    if encoding == "gzip":
+        dobj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            out = dobj.decompress(data, limit + 1)
+        except zlib.error as e:
+            raise ValueError(str(e))
+        if len(out) > limit or dobj.unconsumed_tail:
+            raise BodyTooLarge()
+        if not dobj.eof:
+            raise ValueError("truncated gzip stream")
+        return out
+
+    try:
+        reader = zstandard.ZstdDecompressor().stream_reader(data)
+        chunks: List[bytes] = []
+        size = 0
+        while size <= limit:
+            chunk = reader.read(min(1024 * 1024, limit + 1 - size))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+    except zstandard.ZstdError as e:
+        raise ValueError(str(e))
+    if size > limit:
+        raise BodyTooLarge()
+    return b"".join(chunks)
+
+
+class CompressionMiddleware:
+    """Decodes compressed request bodies and encodes responses the client accepts."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        content_encoding = headers.get("content-encoding", "").strip().lower()
+        if content_encoding and content_encoding != "identity":
+            scope, receive = await self._decode_request(scope, receive, send, content_encoding)
+            if scope is None:
+                return
+
+        encoding = negotiate(headers.get("accept-encoding", ""))
+        if encoding is None or scope.get("method") == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _ResponseEncoder(send, encoding).send)
+
+    async def _decode_request(self, scope, receive, send, encoding: str):
+        if encoding not in SUPPORTED:
+            response = JSONResponse(status_code=415, content={"detail": f"Unsupported Content-Encoding: {encoding}"},
+                                    headers={"Accept-Encoding": ", ".join(SUPPORTED)})
+            await response(scope, receive, send)
+            return None, None
+
+        max_bytes = settings.COMPRESSION_MAX_REQUEST_BYTES
+        chunks, size = [], 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None, None
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > max_bytes:
+                await self._too_large(scope, receive, send)
+                return None, None
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+        compressed = b"".join(chunks)
+
+        limit = min(max_bytes, max(RATIO_FLOOR, len(compressed) * settings.COMPRESSION_MAX_RATIO))
+        try:
+            body = decompress(compressed, encoding, limit)
+        except BodyTooLarge:
+            logger.warning(f"Rejected {encoding} request body to {scope.get('path')}: "
+                           f"{len(compressed)} bytes expand beyond {limit}")
+            await self._too_large(scope, receive, send)
+            return None, None
+        except ValueError as e:
+            response = JSONResponse(status_code=400, content={"detail": f"Invalid {encoding} body: {e}"})
+            await response(scope, receive, send)
+            return None, None
+
+        compression_bytes.inc(("request", encoding, "wire"), len(compressed))
+        compression_bytes.inc(("request", encoding, "raw"), len(body))
+
+        scope = dict(scope, headers=list(scope["headers"]))
+        request_headers = MutableHeaders(scope=scope)
+        del request_headers["content-encoding"]
+        request_headers["content-length"] = str(len(body))
+
+        sent = False
+
+        async def receive_decoded():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return scope, receive_decoded
+
+    async def _too_large(self, scope, receive, send):
+        response = JSONResponse(status_code=413, content={"detail": "Request body too large"})
+        await response(scope, receive, send)
+
+
+class _ResponseEncoder:
+    """
+    Holds back http.response.start until the first body chunk shows whether the
+    response is worth compressing. Single-chunk bodies are compressed whole;
+    streamed bodies are compressed chunk by chunk with a flush after each one, so
+    NDJSON/CSV streams still reach the client incrementally.
+    """
+
+    def __init__(self, send, encoding: str):
+        self._send = send
+        self.encoding = encoding
+        self.start = None
+        self.active = False
+        self.passthrough = False
+        self.raw_size = 0
+        self.wire_size = 0
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            if ("content-encoding" in headers or message["status"] in (204, 304)
+                    or content_type.startswith(INCOMPRESSIBLE_PREFIXES)):
+                self.passthrough = True
+                await self._send(message)
+            return
+
+        if self.passthrough or message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start is not None:
+            start, self.start = self.start, None
+            headers = MutableHeaders(raw=start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            if not more_body and len(body) < settings.COMPRESSION_MIN_SIZE:
+                await self._send(start)
+                await self._send(message)
+                return
+            headers["Content-Encoding"] = self.encoding
+            if "content-length" in headers:
+                del headers["content-length"]
+            if not more_body:
+                data = compress(body, self.encoding)
+                headers["Content-Length"] = str(len(data))
+                await self._send(start)
+                self._count(len(body), len(data))
+                await self._send({"type": "http.response.body", "body": data, "more_body": False})
+                return
+            self.active = True
+            self._compress, self._flush, self._finish = _compressor(self.encoding)
+            await self._send(start)
+
+        if not self.active:
+            await self._send(message)
+            return
+
+        data = self._compress(body) + (self._flush() if more_body else self._finish())
+        self._count(len(body), len(data))
+        await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+    def _count(self, raw: int, wire: int):
+        compression_bytes.inc(("response", self.encoding, "raw"), raw)
+        compression_bytes.inc(("response", self.encoding, "wire"), wire)
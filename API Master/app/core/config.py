@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, Optional
 import os
 
 class Settings(BaseSettings):
@@ -25,6 +25,143 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 52560000  # 100 years
     REFRESH_TOKEN_EXPIRE_DAYS: int = 36500  # 100 years
 
+    # Logging
+    LOG_LEVEL: str = "INFO"
+    LOG_FILE: str = "backend.log"
+    LOG_FILE_MAX_BYTES: int = 50 * 1024 * 1024
+    LOG_FILE_BACKUP_COUNT: int = 5
+    LOG_JSON: bool = True
+    LOG_QUEUE_SIZE: int = 10000  # Records beyond this are dropped instead of blocking requests
+    # Fraction of INFO/DEBUG records kept per logger (children inherit); WARNING+ is always kept
+    LOG_SAMPLE_RATES: Dict[str, float] = {
+        "app.api.v1.endpoints.client.heartbeat": 0.01,
+    }
+
+    # Metrics
+    METRICS_PUBLISH_SECONDS: int = 10  # How often each worker pushes its metrics snapshot to Redis
+    METRICS_TOKEN: Optional[str] = None  # If set, /metrics requires "Authorization: Bearer <token>"
+
+    # Profiling
+    PROFILE_SECRET: Optional[str] = None  # Signs X-Debug-Profile tokens; defaults to SECRET_KEY
+    PROFILE_DIR: str = "profiles"
+    PROFILE_RING_SIZE: int = 20  # Oldest profiles are deleted beyond this
+    PROFILE_TOKEN_MAX_TTL_SECONDS: int = 3600
+
+    # Continuous stack sampler (per worker)
+    SAMPLER_AUTOSTART: bool = False
+    SAMPLER_HZ: float = 50.0
+    SAMPLER_MAX_CPU: float = 0.02  # Hard cap on the sampler's own CPU, as a fraction of one core
+    SAMPLER_MAX_STACKS: int = 20000  # Distinct stacks kept; further new stacks are counted as dropped
+
+    # Admission control for /client/* (token buckets in Redis)
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_CONTROL_RATE: float = 1.0  # Per-user tokens/s for heartbeats, command polls and ACKs
+    RATE_LIMIT_CONTROL_BURST: int = 10
+    RATE_LIMIT_BULK_RATE: float = 0.5  # Per-user tokens/s for uploads (a screenshot costs 4)
+    RATE_LIMIT_BULK_BURST: int = 20
+    # Fleet-wide tokens/s: 5000 agents polling every 5s and heartbeating every 10s take 1500/s,
+    # uploads about as much again; size it to what the DB pool can absorb
+    RATE_LIMIT_GLOBAL_RATE: float = 5000.0
+    RATE_LIMIT_GLOBAL_BURST: int = 15000  # A full fleet reconnecting at once
+    RATE_LIMIT_BULK_RESERVE: float = 0.3  # Fraction of the global bucket only control traffic may use
+    RATE_LIMIT_BULK_MAX_IN_FLIGHT: int = 32  # Concurrent uploads per worker
+
+    # Server-driven agent polling
+    POLL_HEARTBEAT_SECONDS: float = 10.0
+    POLL_COMMANDS_SECONDS: float = 5.0
+    POLL_MAX_MULTIPLIER: float = 4.0  # Slowest automatic backoff under load
+    POLL_MAX_HEARTBEAT_SECONDS: float = 60.0  # Must stay well below PRESENCE_GAP_SECONDS
+    POLL_MAX_COMMANDS_SECONDS: float = 60.0
+    POLL_JITTER: float = 0.2  # +/- fraction applied to every recommended interval
+    POLL_REFRESH_SECONDS: float = 5.0
+
+    # Compression
+    COMPRESSION_MIN_SIZE: int = 1024  # Responses smaller than this are sent as-is
+    COMPRESSION_GZIP_LEVEL: int = 5
+    COMPRESSION_ZSTD_LEVEL: int = 3
+    COMPRESSION_MAX_REQUEST_BYTES: int = 32 * 1024 * 1024  # Decompressed size cap for request bodies
+    COMPRESSION_MAX_RATIO: int = 200  # Decompressed/compressed cap, enforced beyond 1 MiB
+
+    # Latest-view cache (screenshot / apps / browser per user)
+    LATEST_CACHE_TTL_SECONDS: int = 24 * 3600
+    LATEST_CACHE_MAX_BYTES: int = 512 * 1024  # Larger screenshots are cached as a reference only
+
+    # Signed URLs (screenshot images referenced from JSON documents)
+    SIGNED_URL_TTL_SECONDS: int = 3600
+
+    # Per-user daily counters
+    DAILY_COUNTER_RETENTION_DAYS: int = 35  # Days a user-day hash is kept in Redis
+
+    # Pagination / gallery
+    PAGE_MAX_LIMIT: int = 200
+    THUMBNAIL_WIDTH: int = 320
+    THUMBNAIL_CACHE_SECONDS: int = 7 * 24 * 3600  # Thumbnails kept in Redis once generated
+
+    # Batch ingest
+    BATCH_MAX_RECORDS: int = 500
+    BATCH_MAX_BYTES: int = 32 * 1024 * 1024  # Body size cap, checked before the body is buffered
+    BATCH_MAX_SCREENSHOTS: int = 20  # Screenshot records per batch (each carries a full image)
+
+    # Delta-encoded app snapshots
+    APP_KEYFRAME_EVERY: int = 60  # Snapshots per keyframe chain (bounds the replay for "apps at T")
+    APP_KEYFRAME_MAX_SECONDS: int = 3600
+    APP_DELTA_MAX_RATIO: float = 0.5  # Deltas larger than this fraction of the full list become keyframes
+
+    # Icon registry
+    ICON_MAX_BYTES: int = 64 * 1024
+    ICON_BATCH_MAX: int = 500  # Hashes per has-icons check / icons per upload
+
+    # Title search (activity_titles)
+    TITLES_FLUSH_SECONDS: int = 5  # How often buffered titles are written
+    TITLES_BUFFER_MAX: int = 50_000  # Distinct titles buffered per worker before new ones are dropped
+    TITLES_TS_CONFIG: str = "simple"  # Postgres text search configuration (no stemming: titles mix languages)
+
+    # Hourly activity rollups (fed by a Redis Stream of app snapshots)
+    ROLLUP_STREAM: str = "rollups:snapshots"
+    ROLLUP_GROUP: str = "rollup-workers"
+    ROLLUP_STREAM_MAXLEN: int = 1_000_000  # Approximate cap while no worker is consuming
+    ROLLUP_WORKERS: int = 1  # Consumers per API process (0: this process only enqueues)
+    ROLLUP_BATCH_SIZE: int = 500
+    ROLLUP_BLOCK_MS: int = 1000  # Must stay below the async Redis socket timeout (2 s)
+    ROLLUP_RETRY_IDLE_MS: int = 30000  # Unacknowledged entries older than this are retried by any consumer
+    ROLLUP_MAX_GAP_SECONDS: int = 300  # A snapshot stands for at most this much time before it
+    ROLLUP_LEDGER_DAYS: int = 7  # How long applied snapshot ids are remembered for deduplication
+    ROLLUP_MAX_POINTS: int = 500  # Upper bound on points per chart series
+
+    # Parquet exports for offline analytics (python -m app.core.exports, GET /admin/exports)
+    EXPORT_DATABASE_URL: Optional[str] = None  # Read replica to export from; defaults to DATABASE_URL
+    EXPORT_DIR: str = "data/exports"  # Output of incremental runs, one directory per dataset
+    EXPORT_FETCH_ROWS: int = 2000  # Rows per server-side cursor fetch
+    EXPORT_ROW_GROUP_ROWS: int = 50000  # Rows buffered per Parquet row group; bounds the writer's memory
+    EXPORT_COMPRESSION: str = "zstd"
+    EXPORT_LAG_SECONDS: int = 900  # Incremental runs stop this far behind now (ingest backlog, unflushed presence)
+    EXPORT_MAX_CONCURRENT: int = 1  # Ad-hoc exports per API process; more get 429
+    EXPORT_STREAM_CHUNK_BYTES: int = 64 * 1024  # NDJSON/CSV history streams are sent in chunks of about this size
+
+    # Screenshot cold storage (python -m app.core.archive run)
+    ARCHIVE_DIR: str = "data/archive"  # Cold volume for packed screenshots, one file per user and UTC day
+    ARCHIVE_AFTER_DAYS: int = 30  # Whole UTC days older than this are archived
+    ARCHIVE_ZSTD_LEVEL: int = 9
+    ARCHIVE_BATCH_SIZE: int = 50  # Screenshots read per query while packing (images are large)
+    ARCHIVE_CACHE_SECONDS: int = 3600  # Images read back from an archive stay in Redis this long
+    ARCHIVE_INDEX_CACHE: int = 256  # Archive indexes kept in memory per worker
+
+    # Write-behind ingest (INGEST_MODE=stream queues uploads in a Redis Stream)
+    INGEST_MODE: str = "sync"  # "sync" commits per request; "stream" acknowledges after XADD
+    INGEST_STREAM: str = "ingest:uploads"
+    INGEST_GROUP: str = "ingest-writers"
+    INGEST_DEAD_LETTER_STREAM: str = "ingest:dead"
+    INGEST_WORKERS: int = 2  # Consumers per API process (0: this process only enqueues)
+    INGEST_BATCH_SIZE: int = 500  # Entries per XREADGROUP / COPY
+    INGEST_BLOCK_MS: int = 1000  # Must stay below the async Redis socket timeout (2 s)
+    INGEST_RETRY_IDLE_MS: int = 30000  # Pending entries older than this are retried by any consumer
+    INGEST_MAX_DELIVERIES: int = 5  # Deliveries before an entry is dead-lettered
+    INGEST_SCREENSHOT_DIR: str = "data/screenshots"  # Image files of queued screenshots (shared volume)
+
+    # Presence
+    PRESENCE_GAP_SECONDS: int = 90  # Heartbeat gap that closes a presence session
+    PRESENCE_SWEEP_SECONDS: int = 30  # How often idle sessions are flushed to the DB
+
     def resolve_database_url(self):
         if self.DATABASE_URL:
             return self.DATABASE_URL
@@ -0,0 +1,151 @@
+"""
+Per-user per-day activity counters kept in Redis, so dashboards never COUNT(*).
+
+One hash per user and UTC day, `daily:{user_id}:{YYYY-MM-DD}`, with a field per
+metric in METRICS. Ingest increments fields after its commit, unconditionally.
+A hash without the BUILT field (never read, expired, or evicted) only holds
+increments, so the next read rebuilds it from the database:
+
+    1. note the increments already in the hash (their rows are committed, so
+       the count below includes them)
+    2. count the day's rows in the database
+    3. add (count - noted increments) to every field, and mark the hash BUILT
+
+Increments that land during the rebuild are kept on top of the count, and
+concurrent rebuilds are harmless: the first to finish marks the hash, later ones
+just read it. A row is counted twice when it is committed before the count query
+that covers it but incremented after step 1: the count includes it and so does
+the increment kept on top. That window spans all of step 2's count queries, and
+in INGEST_MODE=stream also the consumer's gap between commit and increment, so
+a rebuilt count can run slightly high under load (never low).
+
+Screenshots count everything received that day, including auto-screenshots the
+upload handler later prunes. A rebuild can only count the rows still stored.
+"""
+import logging
+import time
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from typing import Dict, Optional
+
+from redis.commands.core import Script
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.models.data import AppDelta, AppLog, BrowserLog, Command, Screenshot
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("screenshots", "uploads", "commands_executed")
+BUILT = "_built"
+
+# KEYS[1]: day hash. ARGV: increment, expire-at unix time, then fields.
+INCR = Script(None, b"""
+for i = 3, #ARGV do redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[1]) end
+redis.call('EXPIREAT', KEYS[1], ARGV[2])
+return 1
+""")
+
+# KEYS[1]: day hash. ARGV: fields. Returns nil if the hash is built, else the fields' current increments.
+REBUILD_START = Script(None, b"""
+if redis.call('HEXISTS', KEYS[1], '_built') == 1 then return nil end
+local values = redis.call('HMGET', KEYS[1], unpack(ARGV))
+for i = 1, #values do values[i] = tonumber(values[i]) or 0 end
+return values
+""")
+
+# KEYS[1]: day hash. ARGV[1]: expire-at unix time, then field/(database count - noted increments) pairs.
+# Keeps a hash another worker built first; returns the stored fields either way.
+REBUILD_FINISH = Script(None, b"""
+if redis.call('HEXISTS', KEYS[1], '_built') == 0 then
+    for i = 2, #ARGV, 2 do redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1]) end
+    redis.call('HSET', KEYS[1], '_built', 1)
+    redis.call('EXPIREAT', KEYS[1], ARGV[1])
+end
+return redis.call('HGETALL', KEYS[1])
+""")
+
+rebuilds = metrics.Counter("daily_counter_rebuilds_total", "Day counters rebuilt from the database.")
+
+_last_error_log = 0.0
+
+
+def today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def _key(user_id: str, day: date) -> str:
+    return f"daily:{user_id}:{day.isoformat()}"
+
+
+def _expires_at(day: date) -> int:
+    end = datetime.combine(day + timedelta(days=1 + settings.DAILY_COUNTER_RETENTION_DAYS), dtime.min, tzinfo=timezone.utc)
+    return int(end.timestamp())
+
+
+def _log_error(action: str, e: Exception):
+    global _last_error_log
+    now = time.monotonic()
+    if now - _last_error_log > 10:
+        _last_error_log = now
+        logger.warning(f"Daily counter {action} failed: {e}")
+
+
+def incr(redis, user_id: str, *fields: str, amount: int = 1, day: Optional[date] = None):
+    """Counts `amount` events per field for `day` (default today). Call after the DB commit."""
+    try:
+        day = day or today()
+        INCR(keys=[_key(user_id, day)], args=[amount, _expires_at(day), *fields], client=redis)
+    except Exception as e:
+        _log_error("increment", e)
+
+
+def count_from_db(db: Session, user_id: str, day: date) -> Dict[str, int]:
+    start = datetime.combine(day, dtime.min, tzinfo=timezone.utc)
+    end = start + timedelta(days=1)
+
+    def count(model, column):
+        return (db.query(func.count(model.id))
+                .filter(model.user_id == user_id, column >= start, column < end)
+                .scalar())
+
+    screenshots = count(Screenshot, Screenshot.created_at)
+    return {
+        "screenshots": screenshots,
+        "uploads": (screenshots + count(AppLog, AppLog.created_at) + count(AppDelta, AppDelta.created_at)
+                    + count(BrowserLog, BrowserLog.created_at)),
+        "commands_executed": (db.query(func.count(Command.id))
+                              .filter(Command.user_id == user_id, Command.status == "EXECUTED",
+                                      Command.executed_at >= start, Command.executed_at < end)
+                              .scalar()),
+    }
+
+
+def get_day(redis, db: Session, user_id: str, day: Optional[date] = None) -> Dict[str, int]:
+    """All METRICS for one user and UTC day; rebuilt from the DB if the hash is not built."""
+    day = day or today()
+    if day < today() - timedelta(days=settings.DAILY_COUNTER_RETENTION_DAYS):
+        # Outside the retention window nothing is kept in Redis
+        return count_from_db(db, user_id, day)
+
+    key = _key(user_id, day)
+    try:
+        stored = redis.hgetall(key)
+        noted = None if BUILT in stored else REBUILD_START(keys=[key], args=list(METRICS), client=redis)
+    except Exception as e:
+        _log_error("read", e)
+        return count_from_db(db, user_id, day)
+    if noted is not None:
+        counts = count_from_db(db, user_id, day)
+        rebuilds.inc()
+        args = [_expires_at(day)]
+        for field, already in zip(METRICS, noted):
+            args += [field, counts[field] - int(already)]
+        try:
+            raw = REBUILD_FINISH(keys=[key], args=args, client=redis)
+            stored = dict(zip(raw[::2], raw[1::2]))
+        except Exception as e:
+            _log_error("rebuild", e)
+            return counts
+    return {field: int(stored.get(field, 0)) for field in METRICS}
@@ -1,18 +1,54 @@
-from sqlalchemy import create_engine
+import logging
+from sqlalchemy import JSON, create_engine, text
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
+metrics.instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# JSON documents, stored as JSONB on Postgres so they can be GIN-indexed and queried without reparsing
+JSONDocument = JSON().with_variant(postgresql.JSONB(), "postgresql")
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+def insert_ignore(table):
+    """INSERT ... ON CONFLICT (primary key) DO NOTHING for the running dialect (Postgres, or SQLite in development)."""
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    return dialect.insert(table).on_conflict_do_nothing(index_elements=[table.primary_key.columns[0].name])
+
+def migrate_json_columns(bind):
+    """
+    ALTERs columns declared as JSONDocument that still have the old `json` type to `jsonb`
+    (Postgres only; create_all never changes existing columns). Rewrites the table once.
+    """
+    if bind.dialect.name != "postgresql":
+        return
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for column in table.columns:
+                if not isinstance(column.type.dialect_impl(bind.dialect), postgresql.JSONB):
+                    continue
+                current = conn.execute(text(
+                    "SELECT data_type FROM information_schema.columns "
+                    "WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column"
+                ), {"table": table.name, "column": column.name}).scalar()
+                if current == "json":
+                    logger.info(f"Converting {table.name}.{column.name} to jsonb")
+                    conn.execute(text(
+                        f'ALTER TABLE "{table.name}" ALTER COLUMN "{column.name}" TYPE jsonb USING "{column.name}"::jsonb'
+                    ))
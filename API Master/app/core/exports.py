@@ -0,0 +1,528 @@
+"""
+Exports of activity data: columnar (Parquet) files for offline analytics, and
+one user's full history streamed as NDJSON or CSV (compliance requests).
+
+Analysts read these files instead of running ad-hoc SQL on the production
+database. Each dataset is flattened to one row per fact:
+
+- apps: one row per window of every app snapshot (keyframes and deltas replayed)
+- browser: one row per open tab of every browser snapshot
+- commands: one row per command, the payload as a JSON string
+- presence: one row per presence session, placed by its end
+
+Rows are read through a server-side cursor (`yield_per`, which streams
+results) and written EXPORT_ROW_GROUP_ROWS at a time as Parquet row groups,
+so memory stays bounded whatever the range. With EXPORT_DATABASE_URL set the
+reads go to that replica instead of the primary.
+
+Incremental runs export [watermark, now - EXPORT_LAG_SECONDS) of each dataset
+to a new file under EXPORT_DIR/<dataset>/ and advance its watermark in
+`export_watermarks`. Rows are placed by their own timestamp, so an offline
+backlog uploaded more than EXPORT_LAG_SECONDS after it was captured is missed
+by incremental runs; export that range again to pick it up.
+
+    cd "API Master"
+    python -m app.core.exports incremental          # e.g. from cron
+    python -m app.core.exports range --dataset apps --since 2026-01-01 --until 2026-02-01 --out apps.parquet
+
+Parquet needs pyarrow.
+
+History streams (GET /admin/users/{id}/export/{kind}) cover commands, app
+logs (rebuilt into full app lists), browser logs and screenshot metadata. They
+read through the same kind of cursor, ordered by the (user, created_at, id)
+indexes (app logs: keyframes that way, then the deltas of REPLAY_CHAINS chains
+at a time by (keyframe, seq)), and are sent as a chunked response: each chunk
+is only fetched and encoded once the previous one has been written to the
+client, so a slow download holds one export database connection but never
+more memory.
+"""
+import csv
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import orjson
+from sqlalchemy import create_engine, func, literal, select
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.app_deltas import AppState
+from app.core.config import settings
+from app.core.database import SessionLocal, insert_ignore
+from app.core.responses import dumps
+from app.core.search import normalize_domain
+from app.core.security import sign_path
+from app.models.data import AppDelta, AppLog, BrowserLog, Command, ExportWatermark, PresenceSession, Screenshot
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPE = "application/vnd.apache.parquet"
+FILE_RE = re.compile(r"^[a-z]+_\d{8}T\d{6}Z_\d{8}T\d{6}Z\.parquet$")
+REPLAY_CHAINS = 100  # Keyframe chains whose deltas are fetched together
+
+exported = metrics.Counter("export_rows_total", "Rows written to Parquet exports, by dataset.", ("dataset",))
+streamed = metrics.Counter("export_stream_bytes_total", "Bytes of user history streamed as NDJSON/CSV.", ("kind", "format"))
+
+# Ad-hoc exports running in this worker
+slots = threading.BoundedSemaphore(settings.EXPORT_MAX_CONCURRENT)
+
+
+def available() -> bool:
+    return pq is not None
+
+
+def _aware(at: datetime) -> datetime:
+    # SQLite drops the timezone; timestamps are stored in UTC
+    return at if at.tzinfo else at.replace(tzinfo=timezone.utc)
+
+
+def _int(value) -> Optional[int]:
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def _str(value) -> Optional[str]:
+    return value if isinstance(value, str) else None
+
+
+_export_engine = None
+_engine_lock = threading.Lock()
+
+
+def export_session() -> Session:
+    """A session on EXPORT_DATABASE_URL, or on the primary if no replica is configured."""
+    global _export_engine
+    if not settings.EXPORT_DATABASE_URL:
+        return SessionLocal()
+    with _engine_lock:
+        if _export_engine is None:
+            _export_engine = create_engine(settings.EXPORT_DATABASE_URL)
+            metrics.instrument_engine(_export_engine)
+    return Session(bind=_export_engine)
+
+
+def _stream(db: Session, stmt):
+    # yield_per implies stream_results: a named (server-side) cursor on Postgres
+    return db.execute(stmt.execution_options(yield_per=settings.EXPORT_FETCH_ROWS))
+
+
+def _window(stmt, time_column, user_column, since: datetime, until: datetime, user_id: Optional[str]):
+    # No ORDER BY: rows come back in storage order, which is close to time order, without a sort step first
+    stmt = stmt.where(time_column >= since, time_column < until)
+    if user_id:
+        stmt = stmt.where(user_column == user_id)
+    return stmt
+
+
+# --- Datasets ---
+def _replayed(db: Session, since: Optional[datetime], until: Optional[datetime], user_id: Optional[str]):
+    """(row, time, AppState) of every app snapshot in [since, until), chain by chain: a keyframe, then its deltas."""
+    keyframes = []
+    if since is not None:
+        # A chain never outlives APP_KEYFRAME_MAX_SECONDS, so every snapshot in range hangs off a keyframe taken after this
+        keyframes.append(AppLog.created_at >= since - timedelta(seconds=settings.APP_KEYFRAME_MAX_SECONDS))
+    if until is not None:
+        keyframes.append(AppLog.created_at < until)
+    stmt = select(AppLog.id.label("keyframe_id"), literal(0).label("seq"), AppLog.id.label("snapshot_id"),
+                  AppLog.user_id, AppLog.command_id, AppLog.created_at, AppLog.apps.label("body")).where(*keyframes)
+    if user_id:
+        # Oldest first, read along ix_app_logs_user_created_id
+        stmt = stmt.where(AppLog.user_id == user_id).order_by(AppLog.created_at, AppLog.id)
+    # Fleet-wide, chains are replayed independently of each other and come back in storage order
+
+    chains = iter(_stream(db, stmt))
+    while True:
+        batch = list(islice(chains, REPLAY_CHAINS))
+        if not batch:
+            return
+        # Only these chains' deltas, read along ix_app_deltas_keyframe_seq
+        deltas = (select(AppDelta.keyframe_id, AppDelta.seq, AppDelta.id.label("snapshot_id"), AppDelta.user_id,
+                         AppDelta.command_id, AppDelta.created_at, AppDelta.events.label("body"))
+                  .where(AppDelta.keyframe_id.in_([keyframe.keyframe_id for keyframe in batch]))
+                  .order_by(AppDelta.keyframe_id, AppDelta.seq))
+        if until is not None:
+            deltas = deltas.where(AppDelta.created_at < until)
+        by_chain: Dict[str, list] = {}
+        for delta in db.execute(deltas):
+            by_chain.setdefault(delta.keyframe_id, []).append(delta)
+
+        for keyframe in batch:
+            at = _aware(keyframe.created_at)
+            state = AppState.from_keyframe(keyframe.keyframe_id, keyframe.body or [], at.timestamp())
+            if since is None or at >= since:
+                yield keyframe, at, state
+            for delta in by_chain.get(keyframe.keyframe_id, ()):
+                at = _aware(delta.created_at)
+                state.apply(delta.body or [])
+                if since is None or at >= since:
+                    yield delta, at, state
+
+
+def _app_rows(db: Session, since: datetime, until: datetime, user_id: Optional[str]) -> Iterator[tuple]:
+    for row, at, state in _replayed(db, since, until, user_id):
+        for slot, app in sorted(state.slots.items()):
+            started = app.get("started")
+            running = max(0, int(at.timestamp() - started)) if isinstance(started, (int, float)) else None
+            yield (row.snapshot_id, row.user_id, at, _str(app.get("name")), _str(app.get("title")),
+                   _int(app.get("pid")), slot == state.focus, running)
+
+
+def _domain(url: Optional[str]) -> Optional[str]:
+    if not url:
+        return None
+    try:
+        return normalize_domain(url) or None
+    except ValueError:
+        return None
+
+
+def _browser_rows(db: Session, since: datetime, until: datetime, user_id: Optional[str]) -> Iterator[tuple]:
+    stmt = _window(
+        select(BrowserLog.id, BrowserLog.user_id, BrowserLog.created_at, BrowserLog.youtube_open, BrowserLog.details),
+        BrowserLog.created_at, BrowserLog.user_id, since, until, user_id
+    )
+    for row in _stream(db, stmt):
+        sessions = row.details.get("sessions") if isinstance(row.details, dict) else None
+        if not isinstance(sessions, dict):
+            continue
+        at = _aware(row.created_at)
+        for browser, tabs in sessions.items():
+            if browser == "icon_meta" or not isinstance(tabs, list):
+                continue
+            for tab in tabs:
+                if not isinstance(tab, dict):
+                    continue
+                url = _str(tab.get("url"))
+                yield (row.id, row.user_id, at, browser, _str(tab.get("title")), url, _domain(url),
+                       bool(row.youtube_open))
+
+
+def _command_rows(db: Session, since: datetime, until: datetime, user_id: Optional[str]) -> Iterator[tuple]:
+    stmt = _window(
+        select(Command.id, Command.user_id, Command.command, Command.status, Command.payload,
+               Command.created_at, Command.executed_at),
+        Command.created_at, Command.user_id, since, until, user_id
+    )
+    for row in _stream(db, stmt):
+        payload = orjson.dumps(row.payload).decode() if row.payload is not None else None
+        yield (row.id, row.user_id, row.command, row.status, payload, _aware(row.created_at),
+               _aware(row.executed_at) if row.executed_at else None)
+
+
+def _presence_rows(db: Session, since: datetime, until: datetime, user_id: Optional[str]) -> Iterator[tuple]:
+    # Sessions are stored once they close, so their end is what places them in a range
+    stmt = _window(
+        select(PresenceSession.id, PresenceSession.user_id, PresenceSession.device_id,
+               PresenceSession.started_at, PresenceSession.ended_at),
+        PresenceSession.ended_at, PresenceSession.user_id, since, until, user_id
+    )
+    for row in _stream(db, stmt):
+        started_at, ended_at = _aware(row.started_at), _aware(row.ended_at)
+        yield (row.id, row.user_id, row.device_id, started_at, ended_at, (ended_at - started_at).total_seconds())
+
+
+class Dataset(NamedTuple):
+    columns: Tuple[Tuple[str, str], ...]  # (name, type): string, int64, float64, bool or timestamp
+    time_column: Any  # What places a row in a range
+    rows: Callable[[Session, datetime, datetime, Optional[str]], Iterator[tuple]]
+
+
+DATASETS: Dict[str, Dataset] = {
+    "apps": Dataset(
+        (("snapshot_id", "string"), ("user_id", "string"), ("created_at", "timestamp"), ("app", "string"),
+         ("title", "string"), ("pid", "int64"), ("is_active", "bool"), ("running_seconds", "int64")),
+        AppLog.created_at, _app_rows,
+    ),
+    "browser": Dataset(
+        (("log_id", "string"), ("user_id", "string"), ("created_at", "timestamp"), ("browser", "string"),
+         ("title", "string"), ("url", "string"), ("domain", "string"), ("youtube_open", "bool")),
+        BrowserLog.created_at, _browser_rows,
+    ),
+    "commands": Dataset(
+        (("id", "string"), ("user_id", "string"), ("command", "string"), ("status", "string"),
+         ("payload", "string"), ("created_at", "timestamp"), ("executed_at", "timestamp")),
+        Command.created_at, _command_rows,
+    ),
+    "presence": Dataset(
+        (("id", "string"), ("user_id", "string"), ("device_id", "string"), ("started_at", "timestamp"),
+         ("ended_at", "timestamp"), ("seconds", "float64")),
+        PresenceSession.ended_at, _presence_rows,
+    ),
+}
+
+
+# --- Writing ---
+def _schema(dataset: Dataset):
+    types = {"string": pa.string(), "int64": pa.int64(), "float64": pa.float64(), "bool": pa.bool_(),
+             "timestamp": pa.timestamp("us", tz="UTC")}
+    return pa.schema([(name, types[kind]) for name, kind in dataset.columns])
+
+
+def write(name: str, rows: Iterator[tuple], path: str) -> int:
+    """Writes `rows` of a dataset to a Parquet file, one row group per EXPORT_ROW_GROUP_ROWS; returns the row count."""
+    if not available():
+        raise RuntimeError("Parquet exports need pyarrow (pip install pyarrow)")
+    schema = _schema(DATASETS[name])
+    written = 0
+    with pq.ParquetWriter(path, schema, compression=settings.EXPORT_COMPRESSION) as writer:
+        while True:
+            chunk = list(islice(rows, settings.EXPORT_ROW_GROUP_ROWS))
+            if not chunk:
+                break
+            arrays = [pa.array(column, type=field.type) for column, field in zip(zip(*chunk), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema), row_group_size=len(chunk))
+            written += len(chunk)
+            exported.inc((name,), len(chunk))
+    return written
+
+
+def export(name: str, since: datetime, until: datetime, path: str, user_id: Optional[str] = None) -> int:
+    """Writes the dataset's rows in [since, until) to `path` (replaced atomically); returns the row count."""
+    partial = f"{path}.partial"
+    db = export_session()
+    try:
+        rows = write(name, DATASETS[name].rows(db, since, until, user_id), partial)
+        os.replace(partial, path)
+        return rows
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        db.close()
+
+
+def export_temp(name: str, since: datetime, until: datetime, user_id: Optional[str] = None) -> Tuple[str, int]:
+    """export() into a new temporary file; (path, rows). The caller deletes the file."""
+    fd, path = tempfile.mkstemp(prefix=f"{name}_", suffix=".parquet")
+    os.close(fd)
+    try:
+        return path, export(name, since, until, path, user_id)
+    except BaseException:
+        os.remove(path)
+        raise
+
+
+# --- Incremental runs ---
+def _earliest(name: str) -> Optional[datetime]:
+    """Start of the UTC day of the dataset's oldest row, where a first run begins."""
+    db = export_session()
+    try:
+        earliest = db.query(func.min(DATASETS[name].time_column)).scalar()
+        return _aware(earliest).replace(hour=0, minute=0, second=0, microsecond=0) if earliest else None
+    finally:
+        db.close()
+
+
+def incremental(names: Optional[List[str]] = None, now: Optional[datetime] = None) -> List[dict]:
+    """
+    Exports what each dataset gained since its watermark to EXPORT_DIR/<dataset>/ and
+    advances the watermark. A dataset another run is still exporting is skipped.
+    """
+    until = (now or datetime.now(timezone.utc)) - timedelta(seconds=settings.EXPORT_LAG_SECONDS)
+    results = []
+    for name in names or list(DATASETS):
+        db = SessionLocal()
+        try:
+            db.execute(insert_ignore(ExportWatermark.__table__).values(dataset=name))
+            db.commit()
+            # The row stays locked until the watermark moves, so overlapping runs skip the dataset
+            mark = (db.query(ExportWatermark).filter(ExportWatermark.dataset == name)
+                    .with_for_update(skip_locked=True).first())
+            if mark is None:
+                logger.info(f"Skipping {name} export: another run holds it")
+                continue
+            since = _aware(mark.exported_until) if mark.exported_until else (_earliest(name) or until)
+            if since >= until:
+                db.rollback()
+                continue
+
+            directory = os.path.join(settings.EXPORT_DIR, name)
+            os.makedirs(directory, exist_ok=True)
+            filename = f"{name}_{since:%Y%m%dT%H%M%SZ}_{until:%Y%m%dT%H%M%SZ}.parquet"
+            rows = export(name, since, until, os.path.join(directory, filename))
+            if not rows:
+                os.remove(os.path.join(directory, filename))
+                filename = None
+            mark.exported_until = until
+            mark.last_file, mark.last_rows, mark.updated_at = filename, rows, datetime.now(timezone.utc)
+            db.commit()
+            logger.info(f"Exported {rows} {name} rows in [{since}, {until})")
+            results.append({"dataset": name, "since": since, "until": until, "rows": rows, "file": filename})
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    return results
+
+
+def files(name: str) -> List[dict]:
+    """Files incremental runs wrote for a dataset, newest first."""
+    directory = os.path.join(settings.EXPORT_DIR, name)
+    if not os.path.isdir(directory):
+        return []
+    found = []
+    for entry in os.scandir(directory):
+        if FILE_RE.match(entry.name):
+            stat = entry.stat()
+            found.append({"name": entry.name, "size": stat.st_size,
+                          "modified": datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)})
+    return sorted(found, key=lambda f: f["name"], reverse=True)
+
+
+def file_path(name: str, filename: str) -> Optional[str]:
+    """Path of an incremental export file, None if the names are not one."""
+    if name not in DATASETS or not FILE_RE.match(filename):
+        return None
+    path = os.path.join(settings.EXPORT_DIR, name, filename)
+    return path if os.path.isfile(path) else None
+
+
+# --- Per-user history streams (NDJSON / CSV) ---
+def _user_window(stmt, model, user_id: str, since: Optional[datetime], until: Optional[datetime]):
+    stmt = stmt.where(model.user_id == user_id)
+    if since is not None:
+        stmt = stmt.where(model.created_at >= since)
+    if until is not None:
+        stmt = stmt.where(model.created_at < until)
+    # Walks ix_<table>_user_created_id, so the cursor starts returning rows without a sort
+    return stmt.order_by(model.created_at, model.id)
+
+
+def _command_records(db: Session, user_id: str, since, until) -> Iterator[dict]:
+    stmt = _user_window(select(Command.id, Command.command, Command.status, Command.payload,
+                               Command.created_at, Command.executed_at), Command, user_id, since, until)
+    for row in _stream(db, stmt):
+        yield {"id": row.id, "command": row.command, "status": row.status, "payload": row.payload,
+               "created_at": _aware(row.created_at), "executed_at": _aware(row.executed_at) if row.executed_at else None}
+
+
+def _app_log_records(db: Session, user_id: str, since, until) -> Iterator[dict]:
+    for row, at, state in _replayed(db, since, until, user_id):
+        yield {"id": row.snapshot_id, "command_id": row.command_id, "keyframe": row.seq == 0,
+               "apps": state.render(at.timestamp()), "created_at": at}
+
+
+def _browser_log_records(db: Session, user_id: str, since, until) -> Iterator[dict]:
+    stmt = _user_window(select(BrowserLog.id, BrowserLog.command_id, BrowserLog.browser, BrowserLog.youtube_open,
+                               BrowserLog.details, BrowserLog.created_at), BrowserLog, user_id, since, until)
+    for row in _stream(db, stmt):
+        yield {"id": row.id, "command_id": row.command_id, "browser": row.browser, "youtube_open": row.youtube_open,
+               "details": row.details, "created_at": _aware(row.created_at)}
+
+
+def _screenshot_records(db: Session, user_id: str, since, until) -> Iterator[dict]:
+    # Metadata only: the image column is never read
+    stmt = _user_window(select(Screenshot.id, Screenshot.command_id, Screenshot.created_at),
+                        Screenshot, user_id, since, until)
+    base = f"{settings.API_V1_STR}/admin/screenshots"
+    for row in _stream(db, stmt):
+        yield {"id": row.id, "command_id": row.command_id, "is_auto": row.command_id is None,
+               "created_at": _aware(row.created_at), "image_url": sign_path(f"{base}/{row.id}/image")}
+
+
+class History(NamedTuple):
+    columns: Tuple[str, ...]  # CSV header; nested values become JSON strings
+    records: Callable[[Session, str, Optional[datetime], Optional[datetime]], Iterator[dict]]
+
+
+HISTORY: Dict[str, History] = {
+    "commands": History(("id", "command", "status", "payload", "created_at", "executed_at"), _command_records),
+    "app-logs": History(("id", "command_id", "keyframe", "apps", "created_at"), _app_log_records),
+    "browser-logs": History(("id", "command_id", "browser", "youtube_open", "details", "created_at"),
+                            _browser_log_records),
+    "screenshots": History(("id", "command_id", "is_auto", "created_at", "image_url"), _screenshot_records),
+}
+
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+def _csv_value(value):
+    if isinstance(value, (dict, list)):
+        return orjson.dumps(value).decode()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def history_stream(kind: str, user_id: str, fmt: str, since: Optional[datetime] = None,
+                   until: Optional[datetime] = None) -> Iterator[bytes]:
+    """
+    One user's history of one kind, oldest first, as NDJSON or CSV chunks of about
+    EXPORT_STREAM_CHUNK_BYTES. Rows come from a server-side cursor and are encoded as
+    they are fetched, so memory does not grow with the history. The next rows are
+    only fetched once the previous chunk has been sent.
+    """
+    history = HISTORY[kind]
+    db = export_session()
+    try:
+        buffer = io.StringIO() if fmt == "csv" else None
+        writer = csv.writer(buffer) if buffer is not None else None
+        chunk = bytearray()
+        if writer is not None:
+            writer.writerow(history.columns)
+        for record in history.records(db, user_id, since, until):
+            if writer is not None:
+                writer.writerow([_csv_value(record.get(column)) for column in history.columns])
+                chunk += buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+            else:
+                chunk += dumps(record)
+                chunk += b"\n"
+            if len(chunk) >= settings.EXPORT_STREAM_CHUNK_BYTES:
+                streamed.inc((kind, fmt), len(chunk))
+                yield bytes(chunk)
+                chunk.clear()
+        if writer is not None:
+            chunk += buffer.getvalue().encode()
+        if chunk:
+            streamed.inc((kind, fmt), len(chunk))
+            yield bytes(chunk)
+    finally:
+        db.close()
+
+
+def main():
+    import argparse
+    from datetime import date
+    from app.core.logging_config import setup_logging, stop_logging
+
+    parser = argparse.ArgumentParser(description="Parquet exports for offline analytics.")
+    parser.add_argument("command", choices=["incremental", "range"])
+    parser.add_argument("--dataset", choices=list(DATASETS), action="append",
+                        help="repeatable; incremental runs default to every dataset")
+    parser.add_argument("--since", type=date.fromisoformat, help="range: first UTC day")
+    parser.add_argument("--until", type=date.fromisoformat, help="range: UTC day after the last one")
+    parser.add_argument("--user-id", help="range: one user only")
+    parser.add_argument("--out", help="range: output file")
+    args = parser.parse_args()
+    if args.command == "range" and not (args.dataset and len(args.dataset) == 1 and args.since and args.until and args.out):
+        parser.error("range needs one --dataset, --since, --until and --out")
+    setup_logging()
+    try:
+        if args.command == "incremental":
+            for result in incremental(args.dataset):
+                print(f"{result['dataset']}: {result['rows']} rows -> {result['file'] or '(nothing new)'}")
+        else:
+            since, until = (datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc)
+                            for day in (args.since, args.until))
+            print(f"{export(args.dataset[0], since, until, args.out, args.user_id)} rows written to {args.out}")
+    finally:
+        stop_logging()
+
+
+if __name__ == "__main__":
+    main()
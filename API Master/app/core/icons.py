@@ -0,0 +1,139 @@
+"""
+Content-addressed icon registry.
+
+Each icon is stored once in `icons`, keyed by the SHA-256 of its bytes, and
+served by GET /icons/{hash} with immutable caching. App and browser snapshots
+reference it as "sha256:<hash>" wherever they used to embed a data URL.
+
+Current agents upload only icons the server reports missing and send the
+references themselves. Data URLs still arriving from older agents are interned
+on upload, so storage no longer grows with them either. Only raster MEDIA_TYPES
+are registered; other data URLs stay inline.
+"""
+import base64
+import binascii
+import hashlib
+import logging
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import insert_ignore
+from app.models.data import Icon
+
+logger = logging.getLogger(__name__)
+
+REF_PREFIX = "sha256:"
+HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+KNOWN_MAX = 100_000
+# Raster formats only: an SVG can carry script, and icons are served from the API's origin
+MEDIA_TYPES = frozenset({"image/png", "image/x-icon", "image/jpeg", "image/gif", "image/webp"})
+
+interned = metrics.Counter("icons_interned_total", "Inline icon data URLs replaced by registry references.", ("result",))
+
+# Hashes this worker has seen in the registry; rows are never deleted, so it never goes stale
+_known: Set[str] = set()
+_known_lock = threading.Lock()
+
+
+def ref(icon_hash: str) -> str:
+    return f"{REF_PREFIX}{icon_hash}"
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def parse_data_url(value) -> Optional[Tuple[bytes, str]]:
+    """(bytes, media type) of a base64 data URL of an accepted icon type (MEDIA_TYPES), None for anything else."""
+    if not isinstance(value, str) or not value.startswith("data:image/"):
+        return None
+    header, _, encoded = value.partition(",")
+    if not header.endswith(";base64") or header[5:].split(";")[0] not in MEDIA_TYPES:
+        return None
+    try:
+        data = base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return data, header[5:].split(";")[0]
+
+
+def _remember(hashes: Iterable[str]):
+    with _known_lock:
+        if len(_known) > KNOWN_MAX:
+            _known.clear()
+        _known.update(hashes)
+
+
+def missing(db: Session, hashes: Iterable[str]) -> List[str]:
+    """The given hashes that are not in the registry yet, in order."""
+    hashes = list(dict.fromkeys(hashes))
+    unknown = [h for h in hashes if h not in _known]
+    if not unknown:
+        return []
+    found = {row.hash for row in db.query(Icon.hash).filter(Icon.hash.in_(unknown))}
+    _remember(found)
+    return [h for h in unknown if h not in found]
+
+
+def store(db: Session, icons: Dict[str, Tuple[bytes, str]]):
+    """Adds {hash: (bytes, media type)} to the registry (existing ones are left alone) and commits."""
+    if not icons:
+        return
+    for icon_hash, (data, media_type) in icons.items():
+        db.execute(insert_ignore(Icon.__table__).values(hash=icon_hash, media_type=media_type, data=data))
+    db.commit()
+    _remember(icons)
+
+
+def _intern(db: Session, values: Dict[str, None]) -> Dict[str, str]:
+    """Maps each inline data URL in `values` to its reference, registering new icons."""
+    parsed = {}
+    for value in values:
+        icon = parse_data_url(value)
+        if icon is not None and len(icon[0]) <= settings.ICON_MAX_BYTES:
+            parsed[value] = (digest(icon[0]), icon)
+    if not parsed:
+        return {}
+    new = set(missing(db, [icon_hash for icon_hash, _ in parsed.values()]))
+    store(db, {icon_hash: icon for icon_hash, icon in parsed.values() if icon_hash in new})
+    interned.inc(("new",), len(new))
+    interned.inc(("known",), len(parsed) - len(new))
+    return {value: ref(icon_hash) for value, (icon_hash, _) in parsed.items()}
+
+
+def intern_apps(db: Session, apps: List[dict]):
+    """Replaces inline `icon` data URLs of an app list (in place) with registry references."""
+    refs = _intern(db, dict.fromkeys(app.get("icon") for app in apps if app.get("icon")))
+    for app in apps:
+        if app.get("icon") in refs:
+            app["icon"] = refs[app["icon"]]
+
+
+def intern_browser(db: Session, details: Optional[dict]):
+    """Same for browser details: the per-browser `icon_meta` and every tab's `icon`."""
+    if not isinstance(details, dict):
+        return
+    sessions = details.get("sessions")
+    if not isinstance(sessions, dict):
+        return
+    # {browser name: [tab, ...], "icon_meta": {browser name: icon}} as sent by Client/browser.py
+    tabs = [tab for session in sessions.values() if isinstance(session, list)
+            for tab in session if isinstance(tab, dict)]
+    icon_meta = sessions.get("icon_meta") if isinstance(sessions.get("icon_meta"), dict) else {}
+
+    values = dict.fromkeys(v for v in icon_meta.values() if isinstance(v, str))
+    values.update(dict.fromkeys(tab["icon"] for tab in tabs if isinstance(tab.get("icon"), str)))
+    refs = _intern(db, values)
+    if not refs:
+        return
+    for name, value in icon_meta.items():
+        if isinstance(value, str) and value in refs:
+            icon_meta[name] = refs[value]
+    for tab in tabs:
+        if isinstance(tab.get("icon"), str) and tab["icon"] in refs:
+            tab["icon"] = refs[tab["icon"]]
@@ -0,0 +1,70 @@
+"""
+Screenshot image bytes and thumbnails.
+
+Thumbnails need Pillow; without it the full image is served in their place.
+"""
+import base64
+import io
+import logging
+import os
+from typing import Optional, Tuple
+
+from app.core.config import settings
+from app.core.security import sign_path
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+_warned_no_pillow = False
+
+
+def screenshot_bytes(shot, db=None, redis=None) -> Optional[Tuple[bytes, str]]:
+    """
+    (image bytes, media type) of a Screenshot row, or None if the image is gone.
+    Given a session, screenshots moved to cold storage are read back from their archive.
+    """
+    if shot.url and shot.url.startswith("data:"):
+        header, _, encoded = shot.url.partition(",")
+        return base64.b64decode(encoded), header[5:].split(";")[0] or "image/png"
+    # Fallback for older screenshots on disk
+    if shot.file_path and os.path.exists(shot.file_path):
+        with open(shot.file_path, "rb") as image_file:
+            return image_file.read(), "image/png"
+    if db is not None:
+        from app.core import archive
+        return archive.fetch(db, redis, shot.id)
+    return None
+
+
+def screenshot_url(shot) -> str:
+    """
+    The URL the admin panel loads a screenshot from: its stored URL, or for rows
+    that store none (image queued on disk or archived) a signed image endpoint link.
+    """
+    path = f"{settings.API_V1_STR}/admin/screenshots/{shot.id}/image"
+    # Rows queued by older versions stored the unsigned path itself
+    if shot.url and shot.url != path:
+        return shot.url
+    return sign_path(path)
+
+
+def thumbnail(content: bytes, media_type: str) -> Tuple[bytes, str]:
+    """A THUMBNAIL_WIDTH-wide JPEG of the image (or the image itself if Pillow is missing)."""
+    global _warned_no_pillow
+    if Image is None:
+        if not _warned_no_pillow:
+            _warned_no_pillow = True
+            logger.warning("Pillow is not installed; serving full screenshots as thumbnails")
+        return content, media_type
+
+    with Image.open(io.BytesIO(content)) as image:
+        width = settings.THUMBNAIL_WIDTH
+        if image.width > width:
+            image = image.resize((width, max(1, image.height * width // image.width)), Image.BILINEAR)
+        out = io.BytesIO()
+        image.convert("RGB").save(out, format="JPEG", quality=70, optimize=True)
+    return out.getvalue(), "image/jpeg"
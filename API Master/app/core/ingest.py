@@ -0,0 +1,436 @@
+"""
+Write-behind ingest. With INGEST_MODE=stream, agent uploads (apps, browser and
+screenshot metadata) are appended to a Redis Stream and acknowledged right away.
+
+Consumers in the INGEST_GROUP consumer group (INGEST_WORKERS tasks per API
+process, or a dedicated `python -m app.core.ingest`) read batches with
+XREADGROUP and write each table with one COPY (a multi-row INSERT on other
+databases). Entries are XACKed and deleted only after the commit, so the stream
+length is exactly the backlog not yet in the database.
+
+A failed batch is retried row by row with ON CONFLICT DO NOTHING: rows that
+already landed (a consumer died between commit and XACK) are skipped, and one
+bad row no longer holds back the others. Rows that still fail stay pending and
+are reclaimed by any consumer after INGEST_RETRY_IDLE_MS; after
+INGEST_MAX_DELIVERIES deliveries they move to INGEST_DEAD_LETTER_STREAM. While
+the database is unreachable, consumers hold on to their batch and back off
+instead, so an outage never dead-letters anything.
+
+Row ids and created_at are assigned at enqueue time, so responses and the
+latest-view cache look the same as in sync mode. Daily counters are incremented
+by the consumer after its commit (see app.core.counters for why). Screenshot
+images are written to INGEST_SCREENSHOT_DIR; only the row goes through Redis.
+"""
+import asyncio
+import base64
+import io
+import logging
+import os
+import time
+from collections import Counter as Tally
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import orjson
+from redis.exceptions import ResponseError
+from sqlalchemy import JSON, insert
+from sqlalchemy.exc import OperationalError
+
+from app.core import counters, metrics
+from app.core.config import settings
+from app.core.database import SessionLocal, engine, insert_ignore
+from app.core.redis import get_redis
+from app.models.data import AppDelta, AppLog, BrowserLog, Screenshot
+
+logger = logging.getLogger(__name__)
+
+# In write order: app deltas reference their keyframe (an "apps" row)
+TABLES = {"apps": AppLog.__table__, "app_delta": AppDelta.__table__, "browser": BrowserLog.__table__,
+          "screenshot": Screenshot.__table__}
+# Daily counter fields each queued row adds to
+COUNTED = {"apps": ("uploads",), "app_delta": ("uploads",), "browser": ("uploads",),
+           "screenshot": ("screenshots", "uploads")}
+AUTO_SCREENSHOTS_KEPT = 10
+MAX_BACKOFF_SECONDS = 30
+
+# An entry is a (stream entry id, kind, row) triple
+Entry = Tuple[bytes, str, dict]
+
+enqueued = metrics.Counter("ingest_enqueued_total", "Upload rows appended to the ingest stream.", ("kind",))
+rows_written = metrics.Counter("ingest_rows_written_total", "Queued rows written to the database.", ("kind", "method"))
+flush_latency = metrics.Histogram("ingest_flush_duration_seconds", "Time to write one batch from the ingest stream.")
+failures = metrics.Counter("ingest_failures_total", "Ingest failures by stage.", ("stage",))
+dead_letters = metrics.Counter("ingest_dead_letters_total", "Entries moved to the dead-letter stream.", ("reason",))
+
+_last_error_log = 0.0
+
+
+def _log_error(action: str, e: Exception):
+    global _last_error_log
+    now = time.monotonic()
+    if now - _last_error_log > 10:
+        _last_error_log = now
+        logger.warning(f"Ingest stream {action} failed: {e}")
+
+
+def enabled() -> bool:
+    return settings.INGEST_MODE == "stream"
+
+
+# --- Producer side (upload handlers) ---
+def store_image(shot, image_base64: str):
+    """Writes a queued screenshot's image to INGEST_SCREENSHOT_DIR and points the row at it."""
+    os.makedirs(settings.INGEST_SCREENSHOT_DIR, exist_ok=True)
+    path = os.path.join(settings.INGEST_SCREENSHOT_DIR, f"{shot.id}.png")
+    with open(path, "wb") as image_file:
+        image_file.write(base64.b64decode(image_base64))
+    shot.file_path = path
+    # No stored URL: responses link the image endpoint with a fresh signature (images.screenshot_url)
+    shot.url = ""
+
+
+def submit(redis, kind: str, obj) -> bool:
+    """
+    Queues a new (not yet added) model instance, with its id and created_at already set.
+    False in sync mode or if Redis refused it: the caller then writes it itself.
+    """
+    if not enabled():
+        return False
+    row = {column.name: getattr(obj, column.name) for column in TABLES[kind].columns}
+    try:
+        redis.xadd(settings.INGEST_STREAM, {"kind": kind, "row": orjson.dumps(row)})
+    except Exception as e:
+        _log_error("append", e)
+        return False
+    enqueued.inc((kind,))
+    return True
+
+
+# --- Database side (runs in a worker thread) ---
+def _decode(fields: dict) -> Tuple[str, dict]:
+    kind = fields[b"kind"].decode()
+    if kind not in TABLES:
+        raise ValueError(f"Unknown kind {kind!r}")
+    row = orjson.loads(fields[b"row"])
+    row["created_at"] = datetime.fromisoformat(row["created_at"])
+    return kind, row
+
+
+def _copy_value(value, is_json: bool) -> str:
+    """One field in COPY's text format."""
+    if value is None:
+        return "\\N"
+    if is_json:
+        value = orjson.dumps(value).decode()
+    elif isinstance(value, bool):
+        return "t" if value else "f"
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _copy(db, table, rows: List[dict]):
+    """COPY ... FROM STDIN on Postgres, a multi-row INSERT elsewhere (e.g. SQLite in development)."""
+    if engine.dialect.name != "postgresql":
+        db.execute(insert(table), rows)
+        return
+    columns = list(rows[0])
+    is_json = [isinstance(table.c[column].type, JSON) for column in columns]
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(row[c], j) for c, j in zip(columns, is_json)))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN", buffer)
+    finally:
+        cursor.close()
+
+
+def _prune_auto_screenshots(db, user_ids):
+    """Same retention as the sync upload path: the last AUTO_SCREENSHOTS_KEPT auto-screenshots per user."""
+    for user_id in user_ids:
+        old = (db.query(Screenshot.id, Screenshot.file_path)
+               .filter(Screenshot.user_id == user_id, Screenshot.command_id == None)
+               .order_by(Screenshot.created_at.desc())
+               .offset(AUTO_SCREENSHOTS_KEPT)
+               .all())
+        if not old:
+            continue
+        db.query(Screenshot).filter(Screenshot.id.in_([r.id for r in old])).delete(synchronize_session=False)
+        db.commit()
+        for r in old:
+            if r.file_path:
+                try:
+                    os.remove(r.file_path)
+                except OSError:
+                    pass
+
+
+def write_batch(entries: List[Entry]) -> Tuple[List[bytes], List[bytes]]:
+    """
+    Writes the rows and returns (entry ids to acknowledge, entry ids that failed).
+    Raises OperationalError if the database is unreachable.
+    """
+    db = SessionLocal()
+    try:
+        by_kind: Dict[str, List[dict]] = {kind: [] for kind in TABLES}
+        for _, kind, row in entries:
+            by_kind[kind].append(row)
+        by_kind = {kind: rows for kind, rows in by_kind.items() if rows}
+        try:
+            for kind, rows in by_kind.items():
+                _copy(db, TABLES[kind], rows)
+            db.commit()
+            for kind, rows in by_kind.items():
+                rows_written.inc((kind, "batch"), len(rows))
+            written, done, failed = entries, [entry_id for entry_id, _, _ in entries], []
+        except OperationalError:
+            db.rollback()
+            raise
+        except Exception as e:
+            db.rollback()
+            failures.inc(("batch",))
+            logger.warning(f"Ingest batch of {len(entries)} rows failed, retrying row by row: {e}")
+            written, done, failed = [], [], []
+            for entry in entries:
+                entry_id, kind, row = entry
+                try:
+                    result = db.execute(insert_ignore(TABLES[kind]).values(**row))
+                    db.commit()
+                except OperationalError:
+                    db.rollback()
+                    raise
+                except Exception as e:
+                    db.rollback()
+                    failed.append(entry_id)
+                    logger.warning(f"Ingest row {entry_id!r} ({kind}) failed: {e}")
+                    continue
+                done.append(entry_id)
+                if result.rowcount:  # 0: written before, by a delivery that was never acknowledged
+                    written.append(entry)
+                    rows_written.inc((kind, "row"))
+
+        per_day = Tally()
+        auto_screenshot_users = set()
+        for _, kind, row in written:
+            for field in COUNTED[kind]:
+                per_day[(row["user_id"], row["created_at"].date(), field)] += 1
+            if kind == "screenshot" and row["command_id"] is None:
+                auto_screenshot_users.add(row["user_id"])
+        redis = get_redis()
+        for (user_id, day, field), amount in per_day.items():
+            counters.incr(redis, user_id, field, amount=amount, day=day)
+        try:
+            _prune_auto_screenshots(db, auto_screenshot_users)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Failed to prune auto-screenshots after ingest: {e}")
+        return done, failed
+    finally:
+        db.close()
+
+
+# --- Consumers ---
+async def _ensure_group(redis):
+    try:
+        await redis.xgroup_create(settings.INGEST_STREAM, settings.INGEST_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def _remove(redis, entry_ids: List[bytes]):
+    pipe = redis.pipeline(transaction=False)
+    pipe.xack(settings.INGEST_STREAM, settings.INGEST_GROUP, *entry_ids)
+    pipe.xdel(settings.INGEST_STREAM, *entry_ids)
+    await pipe.execute()
+
+
+async def _dead_letter(redis, entries: List[Tuple[bytes, Optional[dict]]], reason: str):
+    pipe = redis.pipeline(transaction=False)
+    for entry_id, fields in entries:
+        pipe.xadd(settings.INGEST_DEAD_LETTER_STREAM, {**(fields or {}), b"entry_id": entry_id, b"reason": reason})
+    await pipe.execute()
+    await _remove(redis, [entry_id for entry_id, _ in entries])
+    dead_letters.inc((reason,), len(entries))
+    logger.error(f"Moved {len(entries)} ingest entries to {settings.INGEST_DEAD_LETTER_STREAM} ({reason})")
+
+
+async def _reclaim(redis, consumer: str) -> list:
+    """Claims entries left pending by failed writes or dead consumers; dead-letters exhausted ones."""
+    idle = settings.INGEST_RETRY_IDLE_MS
+    pending = await redis.xpending_range(settings.INGEST_STREAM, settings.INGEST_GROUP, min="-", max="+",
+                                         count=settings.INGEST_BATCH_SIZE, idle=idle)
+    exhausted = [p["message_id"] for p in pending if p["times_delivered"] >= settings.INGEST_MAX_DELIVERIES]
+    retry = [p["message_id"] for p in pending if p["times_delivered"] < settings.INGEST_MAX_DELIVERIES]
+    if exhausted:
+        claimed = await redis.xclaim(settings.INGEST_STREAM, settings.INGEST_GROUP, consumer, idle, exhausted)
+        await _dead_letter(redis, claimed, "max_deliveries")
+    if not retry:
+        return []
+    claimed = await redis.xclaim(settings.INGEST_STREAM, settings.INGEST_GROUP, consumer, idle, retry)
+    # Entries deleted in the meantime come back without fields
+    return [(entry_id, fields) for entry_id, fields in claimed if fields]
+
+
+async def _process(redis, entries: list):
+    batch: List[Entry] = []
+    malformed = []
+    for entry_id, fields in entries:
+        try:
+            kind, row = _decode(fields)
+        except Exception:
+            malformed.append((entry_id, fields))
+            continue
+        batch.append((entry_id, kind, row))
+    if malformed:
+        await _dead_letter(redis, malformed, "malformed")
+    if not batch:
+        return
+
+    delay = 1
+    while True:
+        start = time.perf_counter()
+        try:
+            done, failed = await asyncio.to_thread(write_batch, batch)
+            break
+        except OperationalError as e:
+            # Keep the batch and wait for the database: reclaiming would burn delivery attempts
+            failures.inc(("database",))
+            logger.error(f"Database unavailable for ingest, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_BACKOFF_SECONDS)
+    flush_latency.observe(time.perf_counter() - start)
+    if done:
+        await _remove(redis, done)
+    if failed:
+        failures.inc(("row",), len(failed))
+
+
+async def _consume(redis, consumer: str):
+    """One consumer: pending retries first, then new entries, one batch at a time."""
+    last_reclaim = 0.0
+    while not _stopping.is_set():
+        try:
+            entries = []
+            if time.monotonic() - last_reclaim > settings.INGEST_RETRY_IDLE_MS / 1000:
+                entries = await _reclaim(redis, consumer)
+                if len(entries) < settings.INGEST_BATCH_SIZE:
+                    last_reclaim = time.monotonic()
+            if not entries:
+                response = await redis.xreadgroup(settings.INGEST_GROUP, consumer, {settings.INGEST_STREAM: ">"},
+                                                  count=settings.INGEST_BATCH_SIZE, block=settings.INGEST_BLOCK_MS)
+                entries = response[0][1] if response else []
+            if entries:
+                await _process(redis, entries)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if "NOGROUP" in str(e):
+                # Stream or group deleted (e.g. FLUSHDB): recreate and carry on
+                await _ensure_group(redis)
+                continue
+            failures.inc(("consumer",))
+            logger.error(f"Ingest consumer {consumer} error: {e}")
+            await asyncio.sleep(1)
+
+
+async def stream_metrics(redis) -> Dict[str, dict]:
+    """
+    Backlog gauges in metrics snapshot form, read once per scrape: they describe the
+    shared stream, so per-worker gauges would be multiplied when snapshots are merged.
+    """
+    if not enabled():
+        return {}
+    try:
+        pipe = redis.pipeline(transaction=False)
+        pipe.xlen(settings.INGEST_STREAM)
+        pipe.xpending(settings.INGEST_STREAM, settings.INGEST_GROUP)
+        pipe.xrange(settings.INGEST_STREAM, count=1)
+        pipe.xlen(settings.INGEST_DEAD_LETTER_STREAM)
+        length, pending, oldest, dead = await pipe.execute()
+    except Exception as e:
+        _log_error("stats", e)
+        return {}
+    lag = 0.0
+    if oldest:
+        # Stream ids start with the append time in milliseconds
+        lag = max(0.0, time.time() - int(oldest[0][0].split(b"-")[0]) / 1000)
+
+    def gauge(help: str, value: float) -> dict:
+        return {"type": "gauge", "help": help, "labelnames": [], "samples": [[[], value]]}
+
+    return {
+        "ingest_stream_length": gauge("Queued uploads not yet written to the database.", length),
+        "ingest_stream_pending": gauge("Queued uploads delivered to a consumer and not yet acknowledged.",
+                                       pending["pending"]),
+        "ingest_lag_seconds": gauge("Age of the oldest queued upload not yet written.", lag),
+        "ingest_dead_letter_length": gauge("Entries in the dead-letter stream.", dead),
+    }
+
+
+consumer_tasks: List[asyncio.Task] = []
+_stopping = asyncio.Event()
+
+
+def start_ingest_consumers(redis, workers: Optional[int] = None):
+    if not enabled():
+        return
+    _stopping.clear()
+    workers = settings.INGEST_WORKERS if workers is None else workers
+
+    async def run(consumer: str):
+        await _ensure_group(redis)
+        await _consume(redis, consumer)
+
+    for n in range(workers):
+        consumer_tasks.append(asyncio.create_task(run(f"{metrics.WORKER_ID}:{n}")))
+
+
+async def stop_ingest_consumers():
+    """Lets consumers finish their current batch, then cancels whatever is still running."""
+    if not consumer_tasks:
+        return
+    _stopping.set()
+    _, running = await asyncio.wait(consumer_tasks, timeout=settings.INGEST_BLOCK_MS / 1000 + 5)
+    # A batch cancelled mid-write is redelivered and its already-committed rows skipped
+    for task in running:
+        task.cancel()
+    await asyncio.gather(*consumer_tasks, return_exceptions=True)
+    consumer_tasks.clear()
+
+
+def main():
+    """Dedicated consumer process, for deployments that run the API with INGEST_WORKERS=0."""
+    from app.core.logging_config import setup_logging, stop_logging
+    from app.core.redis import get_async_redis
+
+    setup_logging()
+    if not enabled():
+        logger.error("INGEST_MODE is not 'stream'; there is nothing to consume")
+        stop_logging()
+        return
+
+    async def run():
+        redis = get_async_redis()
+        start_ingest_consumers(redis, workers=max(1, settings.INGEST_WORKERS))
+        metrics.start_metrics_publisher(redis)
+        try:
+            await asyncio.gather(*consumer_tasks)
+        finally:
+            metrics.stop_metrics_publisher()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_logging()
+
+
+if __name__ == "__main__":
+    main()
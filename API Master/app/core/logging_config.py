@@ -0,0 +1,147 @@
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional
+
+from app.core import metrics
+from app.core.config import settings
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and is emitted as a field
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+dropped = metrics.Counter("log_records_dropped_total", "Log records dropped because the log queue was full.")
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, plus any `extra=` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        elif record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the records of high-frequency loggers.
+    Rates are looked up by logger name, falling back to parent loggers
+    ("a.b.c" -> "a.b" -> "a"). WARNING and above are never dropped.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._cache: Dict[str, Optional[float]] = {}
+
+    def _rate_for(self, name: str) -> Optional[float]:
+        if name not in self._cache:
+            rate, probe = None, name
+            while probe:
+                if probe in self.rates:
+                    rate = self.rates[probe]
+                    break
+                probe = probe.rpartition(".")[0]
+            self._cache[name] = rate
+        return self._cache[name]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate_for(record.name)
+        return rate is None or random.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks the caller: when the queue is full the record
+    is dropped and counted in log_records_dropped_total. Records keep their
+    structure (no pre-formatting) so the listener-side JSON formatter still
+    sees `extra=` fields.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve args and tracebacks here: they may reference objects that change
+        # (or can't be pickled) by the time the listener thread formats the record.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped.inc()
+
+
+listener: Optional[QueueListener] = None
+
+
+def setup_logging():
+    """
+    Routes every log record through a bounded in-memory queue. Formatting and
+    file/stdout I/O happen on the QueueListener's thread, never on the event
+    loop or request threads.
+    """
+    global listener
+    if listener:
+        return
+
+    formatter = JSONFormatter() if settings.LOG_JSON else logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    file_handler = RotatingFileHandler(
+        settings.LOG_FILE,
+        maxBytes=settings.LOG_FILE_MAX_BYTES,
+        backupCount=settings.LOG_FILE_BACKUP_COUNT
+    )
+    stream_handler = logging.StreamHandler(sys.stdout)
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATES))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(settings.LOG_LEVEL)
+
+    # Uvicorn installs its own synchronous stream handlers; send its records through the queue too
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uv_logger = logging.getLogger(name)
+        uv_logger.handlers.clear()
+        uv_logger.propagate = True
+
+    listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+
+
+def stop_logging():
+    """Flushes the queue and joins the listener thread."""
+    global listener
+    if listener:
+        listener.stop()
+        listener = None
@@ -0,0 +1,293 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Updates are lock-free: every thread increments its own shard (a plain dict),
+and shards are only summed when /metrics is scraped. Each worker periodically
+publishes its snapshot to Redis so a scrape of any worker returns the totals
+of the whole fleet of workers.
+"""
+import abc
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+REDIS_KEY_PREFIX = "metrics:worker:"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+REGISTRY: List["_Metric"] = []
+
+
+class _Metric(abc.ABC):
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()  # Only taken the first time a thread touches this metric
+        REGISTRY.append(self)
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    @abc.abstractmethod
+    def _collect(self) -> Dict[tuple, object]:
+        """This metric's values, summed over the shards, keyed by label values."""
+
+    def snapshot(self) -> dict:
+        samples = [[list(labels), value] for labels, value in self._collect().items()]
+        return {"type": self.type, "help": self.help, "labelnames": list(self.labelnames), "samples": samples}
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _collect(self):
+        total: Dict[tuple, float] = {}
+        for shard in list(self._shards):
+            for labels, value in dict(shard).items():
+                total[labels] = total.get(labels, 0) + value
+        return total
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: tuple = ()):
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            # Per-bucket counts (last one is +Inf), then sum, then count
+            state = shard[labels] = [0] * (len(self.buckets) + 3)
+        state[bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def _collect(self):
+        total: Dict[tuple, list] = {}
+        for shard in list(self._shards):
+            for labels, state in dict(shard).items():
+                acc = total.setdefault(labels, [0] * len(state))
+                for i, v in enumerate(list(state)):
+                    acc[i] += v
+        return total
+
+    def snapshot(self):
+        snap = super().snapshot()
+        snap["buckets"] = list(self.buckets)
+        return snap
+
+
+class Gauge(_Metric):
+    """Gauge read from a callback at scrape time (no updates on the hot path)."""
+    type = "gauge"
+
+    def __init__(self, name, help, fn: Callable[[], float]):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def _collect(self):
+        try:
+            return {(): float(self.fn())}
+        except Exception as e:
+            logger.error(f"Gauge {self.name} callback failed: {e}")
+            return {}
+
+
+# --- Application metrics ---
+http_requests = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+http_latency = Histogram("http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"))
+db_queries = Histogram("db_queries_per_request", "DB queries issued per HTTP request.", ("route",), COUNT_BUCKETS)
+db_time = Histogram("db_time_per_request_seconds", "Time spent in DB queries per HTTP request.", ("route",))
+db_query_latency = Histogram("db_query_duration_seconds", "Latency of individual DB queries.")
+redis_latency = Histogram("redis_command_duration_seconds", "Latency of Redis commands.", ("command",))
+redis_errors = Counter("redis_command_errors_total", "Failed Redis commands.", ("command",))
+upload_bytes = Counter("upload_bytes_total", "Bytes received in agent upload bodies.", ("schema",))
+uploads = Counter("uploads_total", "Agent upload bodies received.", ("schema",))
+
+# [query_count, query_seconds] of the HTTP request being served. The list is shared
+# by reference, so queries run in threadpool workers are still accounted to it.
+request_db_stats: ContextVar[Optional[list]] = ContextVar("request_db_stats", default=None)
+
+
+def instrument_engine(engine):
+    """Times every cursor execution on `engine` and accounts it to the current request."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        db_query_latency.observe(elapsed)
+        stats = request_db_stats.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("query_start") if context.connection else None
+        if starts:
+            starts.pop()
+
+
+def instrument_redis(client):
+    """Wraps `execute_command` of a (sync) redis client instance with timing."""
+    execute = client.execute_command
+
+    def timed(*args, **options):
+        command = str(args[0]).upper() if args else "UNKNOWN"
+        start = time.perf_counter()
+        try:
+            return execute(*args, **options)
+        except Exception:
+            redis_errors.inc((command,))
+            raise
+        finally:
+            redis_latency.observe(time.perf_counter() - start, (command,))
+
+    client.execute_command = timed
+    return client
+
+
+def instrument_async_redis(client):
+    """Same as instrument_redis for redis.asyncio clients."""
+    execute = client.execute_command
+
+    async def timed(*args, **options):
+        command = str(args[0]).upper() if args else "UNKNOWN"
+        start = time.perf_counter()
+        try:
+            return await execute(*args, **options)
+        except Exception:
+            redis_errors.inc((command,))
+            raise
+        finally:
+            redis_latency.observe(time.perf_counter() - start, (command,))
+
+    client.execute_command = timed
+    return client
+
+
+# --- Exposition ---
+def snapshot() -> Dict[str, dict]:
+    return {m.name: m.snapshot() for m in REGISTRY}
+
+
+def merge(snapshots: List[Dict[str, dict]]) -> Dict[str, dict]:
+    """Sums the samples of several worker snapshots, metric by metric and label set by label set."""
+    merged: Dict[str, dict] = {}
+    for snap in snapshots:
+        for name, metric in snap.items():
+            target = merged.setdefault(name, {**metric, "samples": []})
+            index = {tuple(labels): value for labels, value in target["samples"]}
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                if key not in index:
+                    index[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    index[key] = [a + b for a, b in zip(index[key], value)]
+                else:
+                    index[key] = index[key] + value
+            target["samples"] = [[list(k), v] for k, v in index.items()]
+    return merged
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render(snap: Dict[str, dict]) -> str:
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, metric in sorted(snap.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        names = metric["labelnames"]
+        for labels, value in metric["samples"]:
+            if metric["type"] == "histogram":
+                cumulative = 0
+                for bound, count in zip(metric["buckets"] + ["+Inf"], value[:-2]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(names, labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(names, labels)} {value[-2]}")
+                lines.append(f"{name}_count{_labels(names, labels)} {value[-1]}")
+            else:
+                lines.append(f"{name}{_labels(names, labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+async def collect_all(redis) -> Dict[str, dict]:
+    """This worker's live metrics merged with the last snapshot published by every other worker."""
+    snapshots = [snapshot()]
+    try:
+        keys = [k async for k in redis.scan_iter(match=f"{REDIS_KEY_PREFIX}*", count=100)]
+        own_key = f"{REDIS_KEY_PREFIX}{WORKER_ID}".encode()
+        keys = [k for k in keys if k != own_key]
+        if keys:
+            for raw in await redis.mget(keys):
+                if raw:
+                    snapshots.append(json.loads(raw))
+    except Exception as e:
+        logger.warning(f"Could not read other workers' metrics from Redis, serving local only: {e}")
+    return merge(snapshots)
+
+
+async def _metrics_publisher(redis):
+    interval = settings.METRICS_PUBLISH_SECONDS
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await redis.set(f"{REDIS_KEY_PREFIX}{WORKER_ID}", json.dumps(snapshot()), ex=interval * 3)
+        except Exception as e:
+            logger.warning(f"Failed to publish worker metrics: {e}")
+
+publisher_task = None
+
+def start_metrics_publisher(redis):
+    global publisher_task
+    publisher_task = asyncio.create_task(_metrics_publisher(redis))
+
+def stop_metrics_publisher():
+    if publisher_task:
+        publisher_task.cancel()
@@ -0,0 +1,53 @@
+"""
+Keyset pagination on (created_at, id), newest first.
+
+Each page continues strictly after the last row of the previous one, so the
+database seeks straight to it through the (..., created_at, id) index: page 500
+costs the same as page 1, and rows inserted meanwhile never shift a page.
+Cursors are opaque to clients (base64url JSON) and come back in X-Next-Cursor;
+the header is absent on the last page.
+"""
+import base64
+import binascii
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+import orjson
+from fastapi import HTTPException, Response
+from sqlalchemy import tuple_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, row_id: str) -> str:
+    raw = orjson.dumps([created_at.isoformat(), row_id])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = orjson.loads(raw)
+        return datetime.fromisoformat(created_at), str(row_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def paginate(query, created_at_column, id_column, cursor: Optional[str], limit: int) -> Tuple[List[Any], Optional[str]]:
+    """
+    Applies the keyset filter and order to `query` and returns (rows, next cursor).
+    Rows must expose `created_at` and `id` (ORM objects or labelled columns).
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(created_at_column, id_column) < tuple_(created_at, row_id))
+    rows = query.order_by(created_at_column.desc(), id_column.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
@@ -0,0 +1,89 @@
+"""
+Server-recommended agent polling intervals.
+
+Agents heartbeat every POLL_HEARTBEAT_SECONDS and poll commands every
+POLL_COMMANDS_SECONDS by default. Both are stretched by a fleet-wide multiplier
+derived from the admission-control global bucket (the emptier it is, the slower
+agents poll) or set by an admin override, and every answer is jittered so that
+agents which restarted together drift apart instead of staying in lockstep.
+"""
+import logging
+import random
+import threading
+import time
+from typing import Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+OVERRIDE_KEY = "polling:override"
+
+
+class PollingAdvisor:
+    def __init__(self):
+        self._multiplier = 1.0
+        self._source = "default"
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def _compute(self, redis) -> Tuple[float, str]:
+        pipe = redis.pipeline()
+        pipe.get(OVERRIDE_KEY)
+        pipe.hmget("ratelimit:global", "tokens", "ts")
+        pipe.time()
+        override, (tokens, ts), (seconds, micros) = pipe.execute()
+
+        load_multiplier = 1.0
+        if tokens is not None:
+            # The stored level is as of the bucket's last admission; refill it up to now like TOKEN_BUCKET_LUA
+            elapsed = max(0.0, seconds + micros / 1e6 - float(ts or 0))
+            level = min(settings.RATE_LIMIT_GLOBAL_BURST, float(tokens) + elapsed * settings.RATE_LIMIT_GLOBAL_RATE)
+            utilization = 1 - level / settings.RATE_LIMIT_GLOBAL_BURST
+            # No slowdown below 50% utilization, then linear up to the max multiplier when the bucket is empty
+            pressure = min(1.0, max(0.0, (utilization - 0.5) / 0.5))
+            load_multiplier = 1 + (settings.POLL_MAX_MULTIPLIER - 1) * pressure
+        if override is not None and float(override) > load_multiplier:
+            return float(override), "override"
+        return load_multiplier, "load" if load_multiplier > 1 else "default"
+
+    def multiplier(self, redis) -> Tuple[float, str]:
+        """Fleet-wide multiplier, refreshed from Redis at most every POLL_REFRESH_SECONDS per worker."""
+        now = time.monotonic()
+        if now - self._refreshed_at > settings.POLL_REFRESH_SECONDS:
+            with self._lock:
+                if now - self._refreshed_at > settings.POLL_REFRESH_SECONDS:
+                    try:
+                        self._multiplier, self._source = self._compute(redis)
+                    except Exception as e:
+                        logger.warning(f"Could not refresh polling multiplier, keeping {self._multiplier}: {e}")
+                    self._refreshed_at = now
+        return self._multiplier, self._source
+
+    def _jittered(self, base: float, multiplier: float, ceiling: float) -> float:
+        interval = min(base * multiplier, ceiling)
+        jitter = random.uniform(-settings.POLL_JITTER, settings.POLL_JITTER)
+        return round(max(1.0, interval * (1 + jitter)), 2)
+
+    def heartbeat_interval(self, redis) -> float:
+        multiplier, _ = self.multiplier(redis)
+        return self._jittered(settings.POLL_HEARTBEAT_SECONDS, multiplier, settings.POLL_MAX_HEARTBEAT_SECONDS)
+
+    def command_interval(self, redis) -> float:
+        multiplier, _ = self.multiplier(redis)
+        return self._jittered(settings.POLL_COMMANDS_SECONDS, multiplier, settings.POLL_MAX_COMMANDS_SECONDS)
+
+    def set_override(self, redis, multiplier: Optional[float], ttl_seconds: int):
+        if multiplier is None:
+            redis.delete(OVERRIDE_KEY)
+        else:
+            redis.set(OVERRIDE_KEY, multiplier, ex=ttl_seconds)
+        self._refreshed_at = 0.0
+
+
+polling_advisor = PollingAdvisor()
+
+
+def online_ttl(heartbeat_interval: float) -> int:
+    """TTL of `online:{user_id}` that survives one late heartbeat at the recommended interval."""
+    return max(30, int(heartbeat_interval * 2) + 10)
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.data import PresenceSession
+
+logger = logging.getLogger(__name__)
+
+# (user_id, device_id) -> [started_at, last_seen]
+SessionKey = Tuple[str, Optional[str]]
+Interval = Tuple[str, Optional[str], datetime, datetime]
+
+
+class PresenceTracker:
+    """
+    Keeps the open presence session of every agent heartbeating into THIS worker.
+
+    Heartbeats only extend the in-memory interval. A session is written to
+    `presence_sessions` once, when the agent has been silent for longer than
+    PRESENCE_GAP_SECONDS (detected either by the next heartbeat or by the sweeper).
+    """
+
+    def __init__(self, gap_seconds: int):
+        self.gap = timedelta(seconds=gap_seconds)
+        self._open: Dict[SessionKey, List[datetime]] = {}
+        self._lock = threading.Lock()
+
+    def touch(self, user_id: str, device_id: Optional[str], now: Optional[datetime] = None) -> List[Interval]:
+        """Records a heartbeat. Returns the session it closed, if the gap was exceeded."""
+        now = now or datetime.now(timezone.utc)
+        key = (user_id, device_id)
+        closed = []
+        with self._lock:
+            current = self._open.get(key)
+            if current and now - current[1] <= self.gap:
+                current[1] = now
+            else:
+                if current:
+                    closed.append((user_id, device_id, current[0], current[1]))
+                self._open[key] = [now, now]
+        return closed
+
+    def expire(self, now: Optional[datetime] = None) -> List[Interval]:
+        """Closes every session whose last heartbeat is older than the gap."""
+        now = now or datetime.now(timezone.utc)
+        closed = []
+        with self._lock:
+            for key, (started_at, last_seen) in list(self._open.items()):
+                if now - last_seen > self.gap:
+                    closed.append((key[0], key[1], started_at, last_seen))
+                    del self._open[key]
+        return closed
+
+    def drain(self) -> List[Interval]:
+        """Closes all open sessions (used on shutdown)."""
+        with self._lock:
+            closed = [(k[0], k[1], v[0], v[1]) for k, v in self._open.items()]
+            self._open.clear()
+        return closed
+
+
+presence_tracker = PresenceTracker(settings.PRESENCE_GAP_SECONDS)
+
+
+def save_sessions(db, intervals: List[Interval]):
+    """Persists closed intervals. Zero-length sessions (a single heartbeat) are kept as-is."""
+    if not intervals:
+        return
+    db.add_all([
+        PresenceSession(user_id=user_id, device_id=device_id, started_at=started_at, ended_at=ended_at)
+        for user_id, device_id, started_at, ended_at in intervals
+    ])
+    db.commit()
+
+
+def _flush(intervals: List[Interval]):
+    db = SessionLocal()
+    try:
+        save_sessions(db, intervals)
+    except Exception as e:
+        logger.error(f"Failed to flush {len(intervals)} presence sessions: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+
+async def _presence_sweeper():
+    """Background task that flushes sessions of agents that stopped heartbeating."""
+    while True:
+        await asyncio.sleep(settings.PRESENCE_SWEEP_SECONDS)
+        closed = presence_tracker.expire()
+        if closed:
+            await asyncio.to_thread(_flush, closed)
+
+sweeper_task = None
+
+def start_presence_sweeper():
+    global sweeper_task
+    sweeper_task = asyncio.create_task(_presence_sweeper())
+
+async def stop_presence_sweeper():
+    if sweeper_task:
+        sweeper_task.cancel()
+    # Persist whatever is still open so a restart doesn't lose the current sessions
+    closed = presence_tracker.drain()
+    if closed:
+        await asyncio.to_thread(_flush, closed)
@@ -0,0 +1,335 @@
+"""
+On-demand profiling of individual requests.
+
+A superuser mints a short-lived signed token (POST /debug/profile-token) and sends
+it back as the `X-Debug-Profile` header. Only those requests run under cProfile;
+the resulting stats are written to a bounded ring of files in PROFILE_DIR and can
+be downloaded from /debug/profiles/{profile_id}.
+
+StackSampler is the always-available counterpart: a low-overhead statistical
+profiler of the whole worker, controlled from /debug/sampler.
+"""
+import contextvars
+import cProfile
+import functools
+import hashlib
+import hmac
+import inspect
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import List, Optional
+
+from fastapi.routing import APIRoute
+from jose import jwt, JWTError
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-debug-profile"
+
+
+# --- Signed header ---
+def _signature(user_id: str, expires: int) -> str:
+    key = (settings.PROFILE_SECRET or settings.SECRET_KEY).encode()
+    return hmac.new(key, f"{user_id}.{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+def create_profile_token(user_id: str, ttl_seconds: int) -> str:
+    expires = int(time.time()) + ttl_seconds
+    return f"{user_id}.{expires}.{_signature(user_id, expires)}"
+
+
+def verify_profile_token(token: str, authorization: Optional[str]) -> Optional[str]:
+    """
+    Returns the user id if `token` is a valid, unexpired profile token AND the
+    request is authenticated (Bearer JWT) as the same user who minted it.
+    """
+    try:
+        user_id, expires, signature = token.rsplit(".", 2)
+        expires = int(expires)
+    except ValueError:
+        return None
+    if expires < time.time() or not hmac.compare_digest(signature, _signature(user_id, expires)):
+        return None
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+    try:
+        payload = jwt.decode(authorization[7:], settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        return None
+    return user_id if payload.get("sub") == user_id else None
+
+
+# --- Profile collection ---
+class ProfileSession:
+    """Collects the cProfile runs (event loop + threadpool) belonging to one request."""
+
+    def __init__(self):
+        self.profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def run_sync(self, fn, *args, **kwargs):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            with self._lock:
+                self.profiles.append(profile)
+
+
+active_session: contextvars.ContextVar[Optional[ProfileSession]] = contextvars.ContextVar(
+    "active_profile_session", default=None
+)
+
+
+class ProfiledRoute(APIRoute):
+    """
+    Route class that lets the profiler follow sync endpoints into the threadpool.
+    cProfile only sees the thread it was enabled in, so the endpoint is wrapped to
+    enable a per-call profiler there. Outside of a profiled request the wrapper
+    costs one ContextVar lookup.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        call = self.dependant.call
+        if call and not inspect.iscoroutinefunction(call) and not inspect.isgeneratorfunction(call):
+            @functools.wraps(call)
+            def profiled_call(*a, **kw):
+                session = active_session.get()
+                if session is None:
+                    return call(*a, **kw)
+                return session.run_sync(call, *a, **kw)
+            self.dependant.call = profiled_call
+
+
+# --- On-disk ring ---
+def _profile_path(profile_id: str) -> str:
+    return os.path.join(settings.PROFILE_DIR, f"{profile_id}.prof")
+
+
+def save_profile(profile_id: str, stats: pstats.Stats):
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    stats.dump_stats(_profile_path(profile_id))
+    # Keep only the newest PROFILE_RING_SIZE files
+    files = sorted(
+        (os.path.join(settings.PROFILE_DIR, f) for f in os.listdir(settings.PROFILE_DIR) if f.endswith(".prof")),
+        key=os.path.getmtime,
+        reverse=True
+    )
+    for old in files[settings.PROFILE_RING_SIZE:]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+
+
+def list_profiles() -> List[dict]:
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return []
+    profiles = []
+    for name in os.listdir(settings.PROFILE_DIR):
+        if name.endswith(".prof"):
+            path = os.path.join(settings.PROFILE_DIR, name)
+            profiles.append({"id": name[:-5], "size": os.path.getsize(path), "created_at": os.path.getmtime(path)})
+    return sorted(profiles, key=lambda p: p["created_at"], reverse=True)
+
+
+def get_profile_path(profile_id: str) -> Optional[str]:
+    try:
+        profile_id = uuid.UUID(profile_id).hex  # Also rejects anything path-like
+    except ValueError:
+        return None
+    path = _profile_path(profile_id)
+    return path if os.path.exists(path) else None
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests carrying a valid `X-Debug-Profile` header. Requests without
+    the header go straight through. Only one request per worker is profiled at a
+    time (cProfile hooks are per thread and the event loop thread is shared).
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._busy = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = authorization = None
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                token = value.decode("latin-1")
+            elif name == b"authorization":
+                authorization = value.decode("latin-1")
+        if token is None:
+            await self.app(scope, receive, send)
+            return
+
+        user_id = verify_profile_token(token, authorization)
+        if user_id is None or self._busy:
+            status = b"busy" if user_id else b"denied"
+
+            async def send_status(message):
+                if message["type"] == "http.response.start":
+                    message.setdefault("headers", []).append((b"x-profile-status", status))
+                await send(message)
+
+            await self.app(scope, receive, send_status)
+            return
+
+        profile_id = uuid.uuid4().hex
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((b"x-profile-id", profile_id.encode()))
+            await send(message)
+
+        self._busy = True
+        session = ProfileSession()
+        ctx_token = active_session.set(session)
+        loop_profile = cProfile.Profile()
+        loop_profile.enable()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            loop_profile.disable()
+            active_session.reset(ctx_token)
+            self._busy = False
+            stats = pstats.Stats(loop_profile)
+            for profile in session.profiles:
+                stats.add(profile)
+            try:
+                save_profile(profile_id, stats)
+                logger.info(f"Profiled {scope.get('method')} {scope.get('path')} for {user_id}: {profile_id}")
+            except Exception as e:
+                logger.error(f"Failed to save profile {profile_id}: {e}")
+
+
+# --- Continuous sampling profiler ---
+class StackSampler:
+    """
+    Background thread that periodically snapshots every thread's stack with
+    sys._current_frames() and counts them as collapsed stacks
+    ("thread;outer;...;inner count"), the input format of flamegraph.pl and speedscope.
+
+    The sampling interval stretches automatically so that the sampler's own CPU
+    time never exceeds `max_cpu` (a fraction of one core), whatever the requested rate.
+    """
+
+    def __init__(self):
+        self.stacks: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._labels = {}
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.hz = 0.0
+        self.max_cpu = 0.0
+        self.samples = 0
+        self.dropped_stacks = 0
+        self.cpu_seconds = 0.0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, hz: float, max_cpu: float, duration: Optional[float] = None, max_stacks: int = 20000):
+        if self.running:
+            return False
+        with self._lock:
+            self.stacks.clear()
+        self._reset_stats()
+        self.hz, self.max_cpu, self.max_stacks = hz, max_cpu, max_stacks
+        self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(duration,), name="stack-sampler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _run(self, duration: Optional[float]):
+        own_ident = threading.get_ident()
+        interval = 1.0 / self.hz
+        deadline = time.monotonic() + duration if duration else None
+        delay = interval
+        while not self._stop.wait(delay):
+            if deadline and time.monotonic() >= deadline:
+                break
+            cpu_start = time.thread_time()
+            names = {t.ident: t.name.replace(";", ":") for t in threading.enumerate()}
+            collected = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                collected.append(";".join(reversed(stack)))
+            with self._lock:
+                for key in collected:
+                    if key in self.stacks or len(self.stacks) < self.max_stacks:
+                        self.stacks[key] += 1
+                    else:
+                        self.dropped_stacks += 1
+            cost = time.thread_time() - cpu_start
+            self.cpu_seconds += cost
+            self.samples += 1
+            # Stay within the CPU budget: a sample costing `cost` must be followed by cost/max_cpu of rest
+            delay = max(interval, cost / self.max_cpu - cost)
+        self.stopped_at = time.time()
+
+    def status(self) -> dict:
+        end = self.stopped_at if self.stopped_at and not self.running else time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        return {
+            "running": self.running,
+            "requested_hz": self.hz,
+            "effective_hz": round(self.samples / elapsed, 2) if elapsed else 0.0,
+            "max_cpu": self.max_cpu,
+            "cpu_fraction": round(self.cpu_seconds / elapsed, 4) if elapsed else 0.0,
+            "samples": self.samples,
+            "distinct_stacks": len(self.stacks),
+            "dropped_stacks": self.dropped_stacks,
+            "started_at": self.started_at,
+        }
+
+    def collapsed(self, reset: bool = False) -> str:
+        with self._lock:
+            lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+            if reset:
+                self.stacks.clear()
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+stack_sampler = StackSampler()
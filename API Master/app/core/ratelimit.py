@@ -0,0 +1,178 @@
+"""
+Admission control for agent endpoints: token buckets kept in Redis and updated by
+one atomic Lua script, so every worker enforces the same limits.
+
+Each request checks two buckets at once: its user's bucket for the traffic class
+and the global bucket shared by all agents. Bulk uploads may only take global
+tokens while more than RATE_LIMIT_BULK_RESERVE of the bucket remains, which keeps
+that headroom for heartbeats and command polls when the fleet reconnects at once.
+"""
+import logging
+import math
+import time
+from typing import Dict, Optional, Tuple
+
+from jose import jwt, JWTError
+from starlette.responses import JSONResponse
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.redis import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+# KEYS: bucket keys. ARGV: rate, capacity, cost, reserve for each key, in order.
+# Returns {index of the first bucket that refused (0 = admitted), wait in ms}.
+TOKEN_BUCKET_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local levels = {}
+local blocked = 0
+local wait = 0
+for i = 1, #KEYS do
+    local base = (i - 1) * 4
+    local rate = tonumber(ARGV[base + 1])
+    local capacity = tonumber(ARGV[base + 2])
+    local cost = tonumber(ARGV[base + 3])
+    local reserve = tonumber(ARGV[base + 4])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local level = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    level = math.min(capacity, level + math.max(0, now - ts) * rate)
+    levels[i] = level
+    if level - cost < reserve then
+        local need = (cost + reserve - level) / rate
+        if need > wait then wait = need end
+        if blocked == 0 then blocked = i end
+    end
+end
+if blocked == 0 then
+    for i = 1, #KEYS do
+        local base = (i - 1) * 4
+        local rate = tonumber(ARGV[base + 1])
+        local capacity = tonumber(ARGV[base + 2])
+        redis.call('HSET', KEYS[i], 'tokens', levels[i] - tonumber(ARGV[base + 3]), 'ts', tostring(now))
+        redis.call('EXPIRE', KEYS[i], math.ceil(capacity / rate) + 60)
+    end
+end
+return {blocked, math.ceil(wait * 1000)}
+"""
+
+# Route (relative to API_V1_STR) -> (traffic class, token cost)
+ROUTE_CLASSES: Dict[str, Tuple[str, int]] = {
+    "/client/heartbeat": ("control", 1),
+    "/client/commands": ("control", 1),
+    "/client/command/ack": ("control", 1),
+    "/client/notification/reply": ("control", 1),
+    "/client/screenshot/upload": ("bulk", 4),
+    "/client/apps/upload": ("bulk", 1),
+    "/client/browser/upload": ("bulk", 1),
+    "/client/batch": ("bulk", 8),
+    "/client/icons/missing": ("control", 1),
+    "/client/icons": ("bulk", 1),
+}
+
+rejections = metrics.Counter("ratelimit_rejections_total", "Requests refused by admission control.", ("class", "reason"))
+
+
+def _user_limits(traffic_class: str) -> Tuple[float, int]:
+    if traffic_class == "bulk":
+        return settings.RATE_LIMIT_BULK_RATE, settings.RATE_LIMIT_BULK_BURST
+    return settings.RATE_LIMIT_CONTROL_RATE, settings.RATE_LIMIT_CONTROL_BURST
+
+
+def _subject(scope) -> str:
+    """The JWT subject if a bearer token is present (signature checked, no DB hit), else the client IP."""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            token = value.decode("latin-1")
+            if token.startswith("Bearer "):
+                try:
+                    payload = jwt.decode(token[7:], settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+                    if payload.get("sub"):
+                        return f"user:{payload['sub']}"
+                except JWTError:
+                    pass
+            break
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+def _reject(status_code: int, retry_after_ms: int, detail: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": detail},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after_ms / 1000)))}
+    )
+
+
+class AdmissionControlMiddleware:
+    """
+    Applies ROUTE_CLASSES limits before the request reaches auth or the DB.
+    Per-user overuse gets 429, global overload (or too many bulk uploads in flight
+    on this worker) gets 503; both carry Retry-After. If Redis is unreachable the
+    request is admitted: rate limiting must never take the API down with it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._script = None
+        self._bulk_in_flight = 0
+        self._last_error_log = 0.0
+        self._prefix = settings.API_V1_STR
+
+    async def _check(self, subject: str, traffic_class: str, cost: int) -> Optional[JSONResponse]:
+        if self._script is None:
+            self._script = get_async_redis().register_script(TOKEN_BUCKET_LUA)
+        user_rate, user_burst = _user_limits(traffic_class)
+        global_burst = settings.RATE_LIMIT_GLOBAL_BURST
+        reserve = global_burst * settings.RATE_LIMIT_BULK_RESERVE if traffic_class == "bulk" else 0
+        try:
+            blocked, wait_ms = await self._script(
+                keys=[f"ratelimit:{traffic_class}:{subject}", "ratelimit:global"],
+                args=[user_rate, user_burst, cost, 0,
+                      settings.RATE_LIMIT_GLOBAL_RATE, global_burst, cost, reserve]
+            )
+        except Exception as e:
+            now = time.monotonic()
+            if now - self._last_error_log > 10:
+                self._last_error_log = now
+                logger.warning(f"Rate limiter unavailable, admitting requests: {e}")
+            return None
+        if blocked == 1:
+            rejections.inc((traffic_class, "user"))
+            return _reject(429, int(wait_ms), "Rate limit exceeded")
+        if blocked == 2:
+            rejections.inc((traffic_class, "global"))
+            return _reject(503, int(wait_ms), "Server busy, retry later")
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.RATE_LIMIT_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        path = scope.get("path", "")
+        route = ROUTE_CLASSES.get(path[len(self._prefix):]) if path.startswith(self._prefix) else None
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        traffic_class, cost = route
+        if traffic_class == "bulk" and self._bulk_in_flight >= settings.RATE_LIMIT_BULK_MAX_IN_FLIGHT:
+            rejections.inc((traffic_class, "in_flight"))
+            await _reject(503, 1000, "Server busy, retry later")(scope, receive, send)
+            return
+
+        rejection = await self._check(_subject(scope), traffic_class, cost)
+        if rejection is not None:
+            await rejection(scope, receive, send)
+            return
+
+        if traffic_class != "bulk":
+            await self.app(scope, receive, send)
+            return
+        self._bulk_in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._bulk_in_flight -= 1
@@ -2,6 +2,7 @@ import os
 import redis
 import redis.asyncio as async_redis
 from app.core.config import settings
+from app.core import metrics
 
 REDIS_URL = os.getenv("REDIS_URL", f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/{settings.REDIS_DB}")
 
@@ -19,6 +20,9 @@ async_redis_client = async_redis.from_url(
     socket_connect_timeout=2
 )
 
+metrics.instrument_redis(redis_client)
+metrics.instrument_async_redis(async_redis_client)
+
 def get_redis():
     """Provides a thread-safe Redis client."""
     return redis_client
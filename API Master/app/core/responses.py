@@ -0,0 +1,28 @@
+from typing import Any
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+
+def _default(obj: Any) -> Any:
+    # orjson natively handles datetime, date, UUID, dataclasses, etc.
+    # Anything else (ORM objects, Decimal, sets...) goes through FastAPI's encoder.
+    return jsonable_encoder(obj)
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    Default response class of the app.
+
+    Endpoints with large payloads should return an ORJSONResponse directly:
+    FastAPI then skips `jsonable_encoder` entirely, which is where most of the
+    CPU goes for deeply nested dicts (app lists, browser sessions).
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
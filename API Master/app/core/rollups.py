@@ -0,0 +1,515 @@
+"""
+Hourly activity rollups behind the dashboard charts.
+
+Every app snapshot upload appends a compact event (snapshot id, user, time,
+[app name, in foreground] pairs) to ROLLUP_STREAM. Workers in ROLLUP_GROUP turn
+each event into increments of two tables:
+
+- app_usage_hourly: per user, UTC hour and app, seconds running / in the foreground
+- activity_hourly: per user and UTC hour, seconds covered by snapshots
+
+A snapshot stands for the time since the user's previous one, at most
+ROLLUP_MAX_GAP_SECONDS (the agent only reports what is open at that moment),
+split across hour boundaries. The previous snapshot's time is kept in
+rollup_cursors; a backlog arriving out of order is measured against its own
+predecessors.
+
+Applying is idempotent: the snapshot id goes into rollup_applied in the same
+transaction as the increments, so an event delivered twice (a worker died
+between commit and XACK) is skipped. Entries are XACKed and deleted after the
+commit; entries left pending are reclaimed after ROLLUP_RETRY_IDLE_MS.
+
+Snapshots stored before rollups existed (or while Redis was unreachable) can be
+applied from history with
+
+    cd "API Master"
+    python -m app.core.rollups backfill --since 2026-01-01
+
+The ledger only remembers ROLLUP_LEDGER_DAYS of applied ids, so a backfill cannot
+tell whether an older snapshot was already rolled up from its id. It applies
+snapshots older than the user's first rolled-up one (first_at in rollup_cursors,
+so never applied) and those within the ledger window, and skips the rest.
+"""
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import orjson
+from redis.exceptions import ResponseError
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import SessionLocal, engine, insert_ignore
+from app.models.data import ActivityHourly, AppUsageHourly, RollupApplied, RollupCursor
+
+logger = logging.getLogger(__name__)
+
+HOUR = 3600
+# Chart bucket sizes, smallest first; the first one that fits ROLLUP_MAX_POINTS is used
+STEPS = (HOUR, 3 * HOUR, 6 * HOUR, 12 * HOUR, 24 * HOUR, 7 * 24 * HOUR)
+MAX_BACKOFF_SECONDS = 30
+PRUNE_EVERY_SECONDS = 3600
+
+submitted = metrics.Counter("rollup_events_submitted_total", "App snapshots appended to the rollup stream.",
+                            ("result",))
+applied = metrics.Counter("rollup_events_applied_total", "Rollup events processed by workers, by result.",
+                          ("result",))
+batch_latency = metrics.Histogram("rollup_batch_duration_seconds", "Time to apply one batch of rollup events.")
+
+_last_error_log = 0.0
+
+
+class Event(NamedTuple):
+    snapshot_id: str
+    user_id: str
+    at: datetime
+    apps: List[Tuple[str, bool]]
+
+
+def _log_error(action: str, e: Exception):
+    global _last_error_log
+    now = time.monotonic()
+    if now - _last_error_log > 10:
+        _last_error_log = now
+        logger.warning(f"Rollup stream {action} failed: {e}")
+
+
+def _aware(at: datetime) -> datetime:
+    # SQLite drops the timezone; timestamps are stored in UTC
+    return at if at.tzinfo else at.replace(tzinfo=timezone.utc)
+
+
+def _floor_hour(at: datetime) -> datetime:
+    return at.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+# --- Producer side (upload handlers) ---
+def compact(apps: List[dict]) -> List[Tuple[str, bool]]:
+    """[name, in foreground] per app in a snapshot; several windows of one app count once."""
+    found: Dict[str, bool] = {}
+    for app in apps:
+        if isinstance(app, dict) and isinstance(app.get("name"), str) and app["name"]:
+            found[app["name"]] = found.get(app["name"], False) or bool(app.get("is_active"))
+    return list(found.items())
+
+
+def submit(redis, snapshot_id: str, user_id: str, apps: List[dict], at: datetime) -> bool:
+    """Queues a stored app snapshot for the rollups. Fails open: a lost event only leaves a gap in the charts."""
+    try:
+        redis.xadd(settings.ROLLUP_STREAM, {
+            "id": snapshot_id, "user_id": user_id, "at": _aware(at).timestamp(), "apps": orjson.dumps(compact(apps))
+        }, maxlen=settings.ROLLUP_STREAM_MAXLEN, approximate=True)
+    except Exception as e:
+        _log_error("append", e)
+        submitted.inc(("failed",))
+        return False
+    submitted.inc(("queued",))
+    return True
+
+
+# --- Database side (runs in a worker thread) ---
+def _decode(fields: dict) -> Event:
+    return Event(
+        fields[b"id"].decode(), fields[b"user_id"].decode(),
+        datetime.fromtimestamp(float(fields[b"at"]), tz=timezone.utc),
+        [(str(name), bool(active)) for name, active in orjson.loads(fields[b"apps"])]
+    )
+
+
+def _hours(start: datetime, end: datetime) -> Iterable[Tuple[datetime, float]]:
+    """(UTC hour, seconds) pieces of the interval (start, end]."""
+    hour = _floor_hour(start)
+    while hour < end:
+        next_hour = hour + timedelta(hours=1)
+        seconds = (min(end, next_hour) - max(start, hour)).total_seconds()
+        if seconds > 0:
+            yield hour, seconds
+        hour = next_hour
+
+
+def contributions(events: List[Event], cursors: Dict[str, datetime]):
+    """
+    The increments a set of new events makes, given each user's cursor.
+    Returns ({(user, hour, app): [seconds, active seconds]}, {(user, hour): [seconds, snapshots]}, new cursors).
+    """
+    usage: Dict[Tuple[str, datetime, str], List[float]] = {}
+    activity: Dict[Tuple[str, datetime], list] = {}
+    last = dict(cursors)
+    previous: Dict[str, datetime] = {}
+    max_gap = timedelta(seconds=settings.ROLLUP_MAX_GAP_SECONDS)
+    for event in sorted(events, key=lambda e: (e.user_id, e.at)):
+        before = [t for t in (previous.get(event.user_id), cursors.get(event.user_id)) if t is not None and t < event.at]
+        start = max(max(before), event.at - max_gap) if before else event.at
+        previous[event.user_id] = event.at
+        if event.user_id not in last or last[event.user_id] < event.at:
+            last[event.user_id] = event.at
+
+        bucket = activity.setdefault((event.user_id, _floor_hour(event.at)), [0.0, 0])
+        bucket[1] += 1
+        for hour, seconds in _hours(start, event.at):
+            activity.setdefault((event.user_id, hour), [0.0, 0])[0] += seconds
+            for name, active in event.apps:
+                totals = usage.setdefault((event.user_id, hour, name), [0.0, 0.0])
+                totals[0] += seconds
+                if active:
+                    totals[1] += seconds
+    return usage, activity, last
+
+
+def _upsert(db: Session, table, rows: List[dict], keys: List[str], combine: dict):
+    if not rows:
+        return
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(table).values(rows)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=keys, set_={column: fn(table.c[column], stmt.excluded[column]) for column, fn in combine.items()}
+    ))
+
+
+def apply(db: Session, events: List[Event]) -> int:
+    """Rolls up the events not applied before, in one transaction; returns how many were new."""
+    events = list({event.snapshot_id: event for event in events}.values())
+    if not events:
+        return 0
+    now = datetime.now(timezone.utc)
+    new = set(db.execute(
+        insert_ignore(RollupApplied.__table__)
+        .values([{"snapshot_id": e.snapshot_id, "applied_at": now} for e in events])
+        .returning(RollupApplied.snapshot_id)
+    ).scalars())
+    events = [e for e in events if e.snapshot_id in new]
+    if not events:
+        db.commit()
+        return 0
+
+    users = sorted({e.user_id for e in events})
+    # Locked in a fixed order: concurrent workers serialize per user instead of deadlocking
+    cursors = {row.user_id: _aware(row.last_at) for row in
+               db.query(RollupCursor).filter(RollupCursor.user_id.in_(users))
+               .order_by(RollupCursor.user_id).with_for_update()}
+    usage, activity, last = contributions(events, cursors)
+
+    first: Dict[str, datetime] = {}
+    for event in events:
+        if event.user_id not in first or event.at < first[event.user_id]:
+            first[event.user_id] = event.at
+
+    postgres = engine.dialect.name == "postgresql"
+    greatest = func.greatest if postgres else func.max
+    least = func.least if postgres else func.min
+    add = lambda old, new: old + new
+    _upsert(db, AppUsageHourly.__table__, [
+        {"user_id": user_id, "hour": hour, "app": app, "seconds": seconds, "active_seconds": active}
+        for (user_id, hour, app), (seconds, active) in sorted(usage.items())
+    ], ["user_id", "hour", "app"], {"seconds": add, "active_seconds": add})
+    _upsert(db, ActivityHourly.__table__, [
+        {"user_id": user_id, "hour": hour, "seconds": seconds, "snapshots": snapshots}
+        for (user_id, hour), (seconds, snapshots) in sorted(activity.items())
+    ], ["user_id", "hour"], {"seconds": add, "snapshots": add})
+    _upsert(db, RollupCursor.__table__, [
+        {"user_id": user_id, "last_at": last[user_id], "first_at": first[user_id]} for user_id in users
+    ], ["user_id"], {"last_at": greatest, "first_at": least})
+    db.commit()
+    return len(events)
+
+
+def _apply_batch(events: List[Event]) -> Tuple[int, int]:
+    """(new, failed): the whole batch in one transaction, or event by event if that fails."""
+    db = SessionLocal()
+    try:
+        try:
+            return apply(db, events), 0
+        except OperationalError:
+            db.rollback()
+            raise
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Rollup batch of {len(events)} events failed, retrying one by one: {e}")
+        new = failed = 0
+        for event in events:
+            try:
+                new += apply(db, [event])
+            except OperationalError:
+                db.rollback()
+                raise
+            except Exception as e:
+                db.rollback()
+                failed += 1
+                logger.warning(f"Rollup event for snapshot {event.snapshot_id} failed: {e}")
+        return new, failed
+    finally:
+        db.close()
+
+
+def _prune_ledger():
+    db = SessionLocal()
+    try:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=settings.ROLLUP_LEDGER_DAYS)
+        db.query(RollupApplied).filter(RollupApplied.applied_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to prune the rollup ledger: {e}")
+    finally:
+        db.close()
+
+
+# --- Consumers ---
+async def _ensure_group(redis):
+    try:
+        await redis.xgroup_create(settings.ROLLUP_STREAM, settings.ROLLUP_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def _process(redis, entries: list):
+    events = []
+    for entry_id, fields in entries:
+        try:
+            events.append(_decode(fields))
+        except Exception:
+            applied.inc(("malformed",))
+            logger.error(f"Dropping malformed rollup entry {entry_id!r}")
+    delay = 1
+    while events:
+        start = time.perf_counter()
+        try:
+            new, failed = await asyncio.to_thread(_apply_batch, events)
+            break
+        except OperationalError as e:
+            # Keep the batch and wait for the database
+            logger.error(f"Database unavailable for rollups, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_BACKOFF_SECONDS)
+    if events:
+        batch_latency.observe(time.perf_counter() - start)
+        applied.inc(("new",), new)
+        applied.inc(("duplicate",), len(events) - new - failed)
+        if failed:
+            applied.inc(("failed",), failed)
+    entry_ids = [entry_id for entry_id, _ in entries]
+    pipe = redis.pipeline(transaction=False)
+    pipe.xack(settings.ROLLUP_STREAM, settings.ROLLUP_GROUP, *entry_ids)
+    pipe.xdel(settings.ROLLUP_STREAM, *entry_ids)
+    await pipe.execute()
+
+
+async def _consume(redis, consumer: str):
+    """One consumer: entries left pending by others first, then new ones."""
+    last_reclaim = last_prune = 0.0
+    while not _stopping.is_set():
+        try:
+            entries = []
+            if time.monotonic() - last_reclaim > settings.ROLLUP_RETRY_IDLE_MS / 1000:
+                _, claimed, *_ = await redis.xautoclaim(settings.ROLLUP_STREAM, settings.ROLLUP_GROUP, consumer,
+                                                        settings.ROLLUP_RETRY_IDLE_MS, "0-0",
+                                                        count=settings.ROLLUP_BATCH_SIZE)
+                # Entries deleted in the meantime come back without fields
+                entries = [(entry_id, fields) for entry_id, fields in claimed if fields]
+                if len(entries) < settings.ROLLUP_BATCH_SIZE:
+                    last_reclaim = time.monotonic()
+            if not entries:
+                response = await redis.xreadgroup(settings.ROLLUP_GROUP, consumer, {settings.ROLLUP_STREAM: ">"},
+                                                  count=settings.ROLLUP_BATCH_SIZE, block=settings.ROLLUP_BLOCK_MS)
+                entries = response[0][1] if response else []
+            if entries:
+                await _process(redis, entries)
+            if time.monotonic() - last_prune > PRUNE_EVERY_SECONDS:
+                last_prune = time.monotonic()
+                await asyncio.to_thread(_prune_ledger)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if "NOGROUP" in str(e):
+                await _ensure_group(redis)
+                continue
+            logger.error(f"Rollup consumer {consumer} error: {e}")
+            await asyncio.sleep(1)
+
+
+worker_tasks: List[asyncio.Task] = []
+_stopping = asyncio.Event()
+
+
+def start_rollup_workers(redis, workers: Optional[int] = None):
+    _stopping.clear()
+    workers = settings.ROLLUP_WORKERS if workers is None else workers
+
+    async def run(consumer: str):
+        await _ensure_group(redis)
+        await _consume(redis, consumer)
+
+    for n in range(workers):
+        worker_tasks.append(asyncio.create_task(run(f"{metrics.WORKER_ID}:{n}")))
+
+
+async def stop_rollup_workers():
+    """Lets workers finish their current batch, then cancels whatever is still running."""
+    if not worker_tasks:
+        return
+    _stopping.set()
+    _, running = await asyncio.wait(worker_tasks, timeout=settings.ROLLUP_BLOCK_MS / 1000 + 5)
+    for task in running:
+        task.cancel()
+    await asyncio.gather(*worker_tasks, return_exceptions=True)
+    worker_tasks.clear()
+
+
+# --- Reads (chart data) ---
+def _filtered(query, model, start: datetime, end: datetime, user_id: Optional[str]):
+    query = query.filter(model.hour >= _floor_hour(start), model.hour < end)
+    if user_id:
+        query = query.filter(model.user_id == user_id)
+    return query
+
+
+def _hours_value(seconds: float) -> float:
+    return round(seconds / HOUR, 2)
+
+
+def breakdown(db: Session, start: datetime, end: datetime, user_id: Optional[str] = None, top: int = 8) -> dict:
+    """Hours per app in [start, end), largest first, apps beyond `top` summed as "Others"."""
+    seconds = func.sum(AppUsageHourly.seconds)
+    rows = _filtered(
+        db.query(AppUsageHourly.app, seconds.label("seconds"), func.sum(AppUsageHourly.active_seconds).label("active")),
+        AppUsageHourly, start, end, user_id
+    ).group_by(AppUsageHourly.app).order_by(seconds.desc()).all()
+    shown, rest = rows[:top], rows[top:]
+    labels = [r.app for r in shown]
+    running = [r.seconds for r in shown]
+    active = [r.active for r in shown]
+    if rest:
+        labels.append("Others")
+        running.append(sum(r.seconds for r in rest))
+        active.append(sum(r.active for r in rest))
+    return {
+        "labels": labels,
+        "datasets": [
+            {"label": "Hours running", "data": [_hours_value(s) for s in running]},
+            {"label": "Hours in foreground", "data": [_hours_value(s) for s in active]},
+        ],
+    }
+
+
+def step_for(start: datetime, end: datetime, points: int) -> int:
+    span = (end - start).total_seconds()
+    for step in STEPS:
+        if span / step <= points:
+            return step
+    return math.ceil(span / points / STEPS[-1]) * STEPS[-1]
+
+
+def series(db: Session, start: datetime, end: datetime, user_id: Optional[str] = None, app: Optional[str] = None,
+           points: int = 200) -> dict:
+    """
+    Hours per bucket over [start, end), zero-filled: time covered by snapshots and time
+    with some app in the foreground, or one app's running / foreground time. Buckets are
+    the smallest of STEPS giving at most `points` of them, aligned to the UTC hour (day
+    for steps of a day or more).
+    """
+    step = step_for(start, end, points)
+    origin = _floor_hour(start)
+    if step >= 24 * HOUR:
+        origin = origin.replace(hour=0)
+    count = max(1, math.ceil((end - origin).total_seconds() / step))
+
+    if app:
+        rows = _filtered(
+            db.query(AppUsageHourly.hour, func.sum(AppUsageHourly.seconds), func.sum(AppUsageHourly.active_seconds))
+            .filter(AppUsageHourly.app == app), AppUsageHourly, start, end, user_id
+        ).group_by(AppUsageHourly.hour).all()
+        labels = (f"{app} running", f"{app} in foreground")
+    else:
+        covered = dict(_filtered(db.query(ActivityHourly.hour, func.sum(ActivityHourly.seconds)),
+                                 ActivityHourly, start, end, user_id).group_by(ActivityHourly.hour).all())
+        active = dict(_filtered(db.query(AppUsageHourly.hour, func.sum(AppUsageHourly.active_seconds)),
+                                AppUsageHourly, start, end, user_id).group_by(AppUsageHourly.hour).all())
+        rows = [(hour, seconds, active.get(hour, 0.0)) for hour, seconds in covered.items()]
+        labels = ("Tracked", "In foreground")
+
+    first, second = [0.0] * count, [0.0] * count
+    for hour, a, b in rows:
+        index = int((_aware(hour) - origin).total_seconds() // step)
+        if 0 <= index < count:
+            first[index] += a or 0.0
+            second[index] += b or 0.0
+    return {
+        "step_seconds": step,
+        "labels": [origin + timedelta(seconds=step * i) for i in range(count)],
+        "datasets": [
+            {"label": labels[0], "data": [_hours_value(s) for s in first]},
+            {"label": labels[1], "data": [_hours_value(s) for s in second]},
+        ],
+    }
+
+
+# --- Backfill ---
+def backfill(db: Session, since: Optional[datetime] = None) -> int:
+    """
+    Applies stored app history (oldest first per user); snapshots already applied are
+    skipped. History between a user's first rolled-up snapshot and the ledger window
+    is left alone, since the ledger no longer says which of it was applied.
+    """
+    from app.core import app_deltas
+    from app.models.user import User
+
+    # A day short of the ledger: entries at its edge may be pruned while this runs
+    ledger_from = datetime.now(timezone.utc) - timedelta(days=settings.ROLLUP_LEDGER_DAYS - 1)
+    first_at = {row.user_id: _aware(row.first_at) for row in db.query(RollupCursor.user_id, RollupCursor.first_at)}
+    db.rollback()
+    total = 0
+    for (user_id,) in db.query(User.id).all():
+        snapshots, skipped, cursor = [], 0, None
+        while True:
+            page, cursor = app_deltas.history(db, user_id, cursor, 200)
+            fresh = [s for s in page if since is None or _aware(s["created_at"]) >= since]
+            for s in fresh:
+                at = _aware(s["created_at"])
+                if s["apps"] is None:
+                    continue
+                if user_id in first_at and first_at[user_id] <= at < ledger_from:
+                    skipped += 1
+                else:
+                    snapshots.append(s)
+            if not cursor or len(fresh) < len(page):
+                break
+        snapshots.reverse()
+        for i in range(0, len(snapshots), settings.ROLLUP_BATCH_SIZE):
+            total += apply(db, [Event(s["id"], user_id, _aware(s["created_at"]), compact(s["apps"]))
+                                for s in snapshots[i:i + settings.ROLLUP_BATCH_SIZE]])
+        logger.info(f"Rolled up {len(snapshots)} snapshots for user {user_id}")
+        if skipped:
+            logger.warning(f"Skipped {skipped} snapshots of user {user_id} from {first_at[user_id]} "
+                           f"to {ledger_from}: rolled up before, outside the ledger window")
+    return total
+
+
+def main():
+    import argparse
+    from datetime import date
+    from app.core.logging_config import setup_logging, stop_logging
+
+    parser = argparse.ArgumentParser(description="Activity rollup maintenance.")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--since", type=date.fromisoformat, help="only apply history from this UTC day on")
+    args = parser.parse_args()
+    setup_logging()
+    since = datetime.combine(args.since, datetime.min.time(), tzinfo=timezone.utc) if args.since else None
+    db = SessionLocal()
+    try:
+        print(f"{backfill(db, since)} snapshots rolled up")
+    finally:
+        db.close()
+        stop_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Schema changes that are too slow or too disruptive for worker startup.
+
+Startup only runs create_all, which creates missing tables along with their
+indexes but never adds an index declared later to an existing table. Those are
+built by a one-off command, run once per deploy that declares new indexes:
+
+    cd "API Master"
+    python -m app.core.schema indexes
+
+On Postgres every index is built with CREATE INDEX CONCURRENTLY, so uploads keep
+writing to the table meanwhile. A build that fails or is interrupted leaves an
+INVALID index behind; the next run drops and rebuilds it. The GIN indexes need
+the JSONB columns, so run `python -m app.core.search migrate` first.
+"""
+import logging
+from typing import Dict, List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from app.core.database import Base
+
+logger = logging.getLogger(__name__)
+
+
+def _invalid_indexes(conn) -> set:
+    return set(conn.execute(text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE NOT i.indisvalid AND pg_table_is_visible(c.oid)"
+    )).scalars())
+
+
+def create_indexes(bind: Engine) -> Dict[str, List[str]]:
+    """Builds declared indexes missing on existing tables; returns {"created": [...], "failed": [...]}."""
+    import app.models.data  # noqa: F401 - register tables
+    import app.models.user  # noqa: F401
+
+    postgres = bind.dialect.name == "postgresql"
+    inspector = inspect(bind)
+    result = {"created": [], "failed": []}
+    # CONCURRENTLY cannot run inside a transaction block
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        invalid = _invalid_indexes(conn) if postgres else set()
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue  # create_all creates it with its indexes
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda ix: ix.name):
+                if index.name in existing and index.name not in invalid:
+                    continue
+                if index._ddl_if is not None and index._ddl_if.dialect not in (None, bind.dialect.name):
+                    continue  # Declared for another database (ddl_if)
+                try:
+                    if index.name in invalid:
+                        logger.info(f"Dropping invalid index {index.name}")
+                        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+                    logger.info(f"Creating index {index.name} on {table.name}")
+                    if postgres:
+                        index.dialect_options["postgresql"]["concurrently"] = True
+                    try:
+                        index.create(bind=conn)
+                    finally:
+                        if postgres:
+                            index.dialect_options["postgresql"]["concurrently"] = False
+                    result["created"].append(index.name)
+                except Exception as e:
+                    logger.error(f"Could not create index {index.name}: {e}")
+                    result["failed"].append(index.name)
+    return result
+
+
+def main():
+    import argparse
+    from app.core.database import engine
+    from app.core.logging_config import setup_logging, stop_logging
+
+    parser = argparse.ArgumentParser(description="Schema maintenance.")
+    parser.add_argument("command", choices=["indexes"])
+    parser.parse_args()
+    setup_logging()
+    try:
+        result = create_indexes(engine)
+        print(f"{len(result['created'])} indexes created, {len(result['failed'])} failed"
+              + (f": {', '.join(result['failed'])}" if result["failed"] else ""))
+        if result["failed"]:
+            raise SystemExit(1)
+    finally:
+        stop_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Indexed search over app, browser and command history.
+
+On Postgres the JSON columns are JSONB with jsonb_path_ops GIN indexes, and
+every filter here is a containment (@>) query those indexes answer directly:
+
+- app name (exe): `app_logs.apps @> [{"name": ...}]` on keyframes, and
+  `app_deltas.events @> [[{"name": ...}]]` on deltas that open the app
+- domain: `browser_logs.details -> 'domains' @> [...]`; the domains of every
+  tab URL are extracted into details["domains"] at upload
+- command payload: `commands.payload @> {...}`
+
+SQLite (development) has no JSONB; the same filters fall back to a substring
+match on the serialized JSON, without an index.
+
+Databases created before the JSONB columns are converted, and rows uploaded
+before details["domains"] existed are filled in, by one-off commands:
+
+    cd "API Master"
+    python -m app.core.search migrate       # ALTER ... TYPE jsonb: rewrites and locks each table
+    python -m app.core.schema indexes       # then the GIN indexes, concurrently
+    python -m app.core.search backfill
+"""
+import ipaddress
+import logging
+from datetime import datetime
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+import orjson
+from sqlalchemy import String, cast, func, literal, select, union_all
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+from app.core.database import engine, migrate_json_columns
+from app.models.data import AppDelta, AppLog, BrowserLog, Command
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH = 500
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def domains(details: Optional[dict]) -> List[str]:
+    """Host names of every tab URL plus their parent domains ("m.youtube.com" -> also "youtube.com")."""
+    if not isinstance(details, dict) or not isinstance(details.get("sessions"), dict):
+        return []
+    found = set()
+    for name, tabs in details["sessions"].items():
+        if name == "icon_meta" or not isinstance(tabs, list):
+            continue
+        for tab in tabs:
+            url = tab.get("url") if isinstance(tab, dict) else None
+            if not isinstance(url, str) or not url:
+                continue
+            # The agent reads URLs from the address bar, often without a scheme
+            try:
+                host = urlsplit(url if "://" in url else f"http://{url}").hostname
+            except ValueError:
+                continue
+            if not host:
+                continue
+            host = host.lower()
+            found.add(host)
+            if not _is_ip(host):
+                labels = host.split(".")
+                found.update(".".join(labels[i:]) for i in range(1, len(labels) - 1))
+    return sorted(found)
+
+
+def annotate_browser(details: Optional[dict]):
+    """Adds the indexed `domains` list to browser details (in place) before they are stored."""
+    if isinstance(details, dict):
+        details["domains"] = domains(details)
+
+
+def _contains(column, value):
+    """`column @> value`, GIN-indexable on Postgres."""
+    if engine.dialect.name == "postgresql":
+        return column.op("@>")(cast(literal(orjson.dumps(value).decode()), postgresql.JSONB))
+    # Coarse: the innermost scalar anywhere in the document
+    while isinstance(value, (list, dict)):
+        value = next(iter(value.values() if isinstance(value, dict) else value))
+    return cast(column, String).contains(orjson.dumps(value).decode())
+
+
+def normalize_domain(domain: str) -> str:
+    domain = domain.strip().lower()
+    host = urlsplit(domain if "://" in domain else f"http://{domain}").hostname or ""
+    return host[4:] if host.startswith("www.") else host
+
+
+def domain_filter(domain: str):
+    return _contains(BrowserLog.details["domains"], [normalize_domain(domain)])
+
+
+def app_filters(app: str):
+    """(keyframe filter, delta filter) for snapshots where the app is running or opens."""
+    return _contains(AppLog.apps, [{"name": app}]), _contains(AppDelta.events, [[{"name": app}]])
+
+
+def payload_filter(payload: dict):
+    return _contains(Command.payload, payload)
+
+
+def _window(query, created_at, user_id: Optional[str], since: Optional[datetime], until: Optional[datetime]):
+    if user_id:
+        query = query.where(query.selected_columns.user_id == user_id)
+    if since:
+        query = query.where(created_at >= since)
+    if until:
+        query = query.where(created_at < until)
+    return query
+
+
+def activity(db: Session, domain: Optional[str] = None, app: Optional[str] = None, user_id: Optional[str] = None,
+             since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[dict]:
+    """
+    Per user: how many snapshots matched and the first/last of them, most recent first.
+    For apps a delta only matches where the app opens, so last_seen is the last
+    keyframe or opening that contained it rather than the moment it closed.
+    """
+    parts = []
+    if domain:
+        parts.append(_window(
+            select(BrowserLog.user_id, BrowserLog.created_at).where(domain_filter(domain)),
+            BrowserLog.created_at, user_id, since, until
+        ))
+    if app:
+        keyframes, deltas = app_filters(app)
+        parts.append(_window(
+            select(AppLog.user_id, AppLog.created_at).where(keyframes), AppLog.created_at, user_id, since, until
+        ))
+        parts.append(_window(
+            select(AppDelta.user_id, AppDelta.created_at).where(deltas), AppDelta.created_at, user_id, since, until
+        ))
+    hits = union_all(*parts).subquery() if len(parts) > 1 else parts[0].subquery()
+    last_seen = func.max(hits.c.created_at)
+    rows = db.execute(
+        select(hits.c.user_id, func.count().label("snapshots"), func.min(hits.c.created_at).label("first_seen"),
+               last_seen.label("last_seen"))
+        .group_by(hits.c.user_id)
+        .order_by(last_seen.desc())
+    ).all()
+    return [{"user_id": r.user_id, "snapshots": r.snapshots, "first_seen": r.first_seen, "last_seen": r.last_seen}
+            for r in rows]
+
+
+def commands_query(db: Session, payload: Optional[dict], command: Optional[str], user_id: Optional[str]):
+    query = db.query(Command.id, Command.user_id, Command.command, Command.payload, Command.status, Command.created_at)
+    if payload:
+        query = query.filter(payload_filter(payload))
+    if command:
+        query = query.filter(Command.command == command)
+    if user_id:
+        query = query.filter(Command.user_id == user_id)
+    return query
+
+
+def backfill(db: Session, batch: int = BACKFILL_BATCH) -> int:
+    """Fills in details["domains"] on browser logs stored before it existed; returns the rows updated."""
+    updated = 0
+    last_id = ""
+    while True:
+        rows = (db.query(BrowserLog).filter(BrowserLog.id > last_id)
+                .order_by(BrowserLog.id).limit(batch).all())
+        if not rows:
+            return updated
+        for row in rows:
+            if isinstance(row.details, dict) and "domains" not in row.details:
+                row.details = {**row.details, "domains": domains(row.details)}
+                updated += 1
+        last_id = rows[-1].id
+        db.commit()
+        logger.info(f"Backfilled domains up to {last_id} ({updated} rows)")
+
+
+def main():
+    import argparse
+    from app.core.database import SessionLocal
+    from app.core.logging_config import setup_logging, stop_logging
+
+    parser = argparse.ArgumentParser(description="Search index maintenance.")
+    parser.add_argument("command", choices=["migrate", "backfill"])
+    args = parser.parse_args()
+    setup_logging()
+    if args.command == "migrate":
+        try:
+            migrate_json_columns(engine)
+            print("JSON columns are jsonb")
+        finally:
+            stop_logging()
+        return
+    db = SessionLocal()
+    try:
+        print(f"{backfill(db)} browser logs updated")
+    finally:
+        db.close()
+        stop_logging()
+
+
+if __name__ == "__main__":
+    main()
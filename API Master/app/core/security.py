@@ -1,5 +1,8 @@
 from datetime import datetime, timedelta
 from typing import Any, Union
+import hashlib
+import hmac
+import time
 from jose import jwt
 from passlib.context import CryptContext
 from app.core.config import settings
@@ -31,3 +34,19 @@ def create_refresh_token(subject: Union[str, Any], expires_delta: timedelta = No
     to_encode = {"sub": str(subject), "exp": expire, "type": "refresh"}
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
+
+def _path_signature(path: str, expires: int) -> str:
+    return hmac.new(settings.SECRET_KEY.encode(), f"{path}:{expires}".encode(), hashlib.sha256).hexdigest()[:32]
+
+def sign_path(path: str) -> str:
+    """
+    Appends an expiring signature to `path`, for URLs loaded without an
+    Authorization header (e.g. <img src>). The expiry is rounded up to the next
+    SIGNED_URL_TTL_SECONDS window so the URL stays stable for browser caching.
+    """
+    ttl = settings.SIGNED_URL_TTL_SECONDS
+    expires = (int(time.time()) // ttl + 2) * ttl
+    return f"{path}?exp={expires}&sig={_path_signature(path, expires)}"
+
+def verify_signed_path(path: str, expires: int, signature: str) -> bool:
+    return expires >= time.time() and hmac.compare_digest(signature, _path_signature(path, expires))
@@ -0,0 +1,298 @@
+"""
+Full-text search over window and tab titles.
+
+Upload handlers hand the titles of each app and browser snapshot to this
+worker's TitleBuffer, which merges repeats in memory: a title that stays open
+all day is one entry per user and day, however many snapshots carry it. The
+flusher task upserts the buffer into `activity_titles` every
+TITLES_FLUSH_SECONDS, off the request path, extending first_seen/last_seen and
+adding to `seen`.
+
+On Postgres each row carries `tsv = to_tsvector(TITLES_TS_CONFIG, title)` under a
+GIN index and searches use websearch_to_tsquery ("invoice", "invoice -draft",
+'"quarterly report"'). SQLite (development) matches every word as a substring.
+
+Titles still buffered when a worker dies are lost (the snapshots themselves are
+not); history already stored can be indexed with
+
+    cd "API Master"
+    python -m app.core.titles rebuild --since 2026-01-01
+"""
+import asyncio
+import hashlib
+import html
+import logging
+import re
+import threading
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import orjson
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import SessionLocal, engine
+from app.core.search import normalize_domain
+from app.models.data import ActivityTitle
+
+logger = logging.getLogger(__name__)
+
+UPSERT_BATCH = 1000
+
+buffered = metrics.Counter("titles_buffered_total", "Titles handed to the title index, by result.", ("result",))
+flushed = metrics.Counter("titles_flushed_total", "Title rows upserted into activity_titles.")
+
+# (user_id, day, source, context, title)
+TitleKey = Tuple[str, date, str, Optional[str], str]
+
+
+def _row_id(key: TitleKey) -> str:
+    user_id, day, source, context, title = key
+    return hashlib.sha1(orjson.dumps([user_id, day.isoformat(), source, context, title])).hexdigest()
+
+
+def app_titles(apps: List[dict]) -> Iterable[Tuple[str, Optional[str], str]]:
+    """(source, context, title) of every window in an app snapshot."""
+    for app in apps:
+        if isinstance(app, dict) and isinstance(app.get("title"), str) and app["title"].strip():
+            yield "app", app.get("name"), app["title"].strip()
+
+
+def tab_titles(details: Optional[dict]) -> Iterable[Tuple[str, Optional[str], str]]:
+    """(source, context, title) of every tab in browser details; the context is the tab's domain."""
+    sessions = details.get("sessions") if isinstance(details, dict) else None
+    if not isinstance(sessions, dict):
+        return
+    for name, tabs in sessions.items():
+        if name == "icon_meta" or not isinstance(tabs, list):
+            continue
+        for tab in tabs:
+            if not isinstance(tab, dict) or not isinstance(tab.get("title"), str) or not tab["title"].strip():
+                continue
+            url = tab.get("url")
+            context = None
+            if isinstance(url, str) and url:
+                try:
+                    context = normalize_domain(url) or None
+                except ValueError:
+                    pass
+            yield "tab", context or name, tab["title"].strip()
+
+
+class TitleBuffer:
+    """Titles seen by THIS worker since the last flush, merged per user, day and title."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        # key -> [first_seen, last_seen, seen]
+        self._entries: Dict[TitleKey, list] = {}
+        self._lock = threading.Lock()
+
+    def add(self, user_id: str, titles: Iterable[Tuple[str, Optional[str], str]], at: datetime):
+        day = at.astimezone(timezone.utc).date() if at.tzinfo else at.date()
+        added = merged = dropped = 0
+        with self._lock:
+            for source, context, title in titles:
+                key = (user_id, day, source, context, title)
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry[0] = min(entry[0], at)
+                    entry[1] = max(entry[1], at)
+                    entry[2] += 1
+                    merged += 1
+                elif len(self._entries) < self.max_entries:
+                    self._entries[key] = [at, at, 1]
+                    added += 1
+                else:
+                    dropped += 1
+        buffered.inc(("new",), added)
+        buffered.inc(("merged",), merged)
+        if dropped:
+            buffered.inc(("dropped",), dropped)
+
+    def drain(self) -> Dict[TitleKey, list]:
+        with self._lock:
+            entries, self._entries = self._entries, {}
+        return entries
+
+
+title_buffer = TitleBuffer(settings.TITLES_BUFFER_MAX)
+
+
+def record_apps(user_id: str, apps: List[dict], at: datetime):
+    title_buffer.add(user_id, app_titles(apps), at)
+
+
+def record_browser(user_id: str, details: Optional[dict], at: datetime):
+    title_buffer.add(user_id, tab_titles(details), at)
+
+
+def _upsert(db: Session, entries: Dict[TitleKey, list]):
+    postgres = engine.dialect.name == "postgresql"
+    dialect = postgresql if postgres else sqlite
+    least, greatest = (func.least, func.greatest) if postgres else (func.min, func.max)
+    table = ActivityTitle.__table__
+    # Same order in every worker, so concurrent flushes cannot deadlock on each other's rows
+    items = sorted(((_row_id(key), key, entry) for key, entry in entries.items()), key=lambda item: item[0])
+    for i in range(0, len(items), UPSERT_BATCH):
+        rows = []
+        for row_id, (user_id, day, source, context, title), (first_seen, last_seen, seen) in items[i:i + UPSERT_BATCH]:
+            row = {"id": row_id, "user_id": user_id, "day": day, "source": source, "context": context,
+                   "title": title, "first_seen": first_seen, "last_seen": last_seen, "seen": seen}
+            if postgres:
+                row["tsv"] = func.to_tsvector(settings.TITLES_TS_CONFIG, title)
+            rows.append(row)
+        stmt = dialect.insert(table).values(rows)
+        db.execute(stmt.on_conflict_do_update(index_elements=["id"], set_={
+            "first_seen": least(table.c.first_seen, stmt.excluded.first_seen),
+            "last_seen": greatest(table.c.last_seen, stmt.excluded.last_seen),
+            "seen": table.c.seen + stmt.excluded.seen,
+        }))
+    db.commit()
+    flushed.inc(amount=len(items))
+
+
+def _flush(entries: Dict[TitleKey, list]):
+    db = SessionLocal()
+    try:
+        _upsert(db, entries)
+    except Exception as e:
+        logger.error(f"Failed to flush {len(entries)} titles: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+
+async def _title_flusher():
+    """Background task that writes buffered titles."""
+    while True:
+        await asyncio.sleep(settings.TITLES_FLUSH_SECONDS)
+        entries = title_buffer.drain()
+        if entries:
+            await asyncio.to_thread(_flush, entries)
+
+flusher_task = None
+
+def start_title_flusher():
+    global flusher_task
+    flusher_task = asyncio.create_task(_title_flusher())
+
+async def stop_title_flusher():
+    if flusher_task:
+        flusher_task.cancel()
+    entries = title_buffer.drain()
+    if entries:
+        await asyncio.to_thread(_flush, entries)
+
+
+# --- Search ---
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def terms(query: str) -> List[str]:
+    """Words to highlight: everything in the query except negated words and OR."""
+    words = []
+    for token in re.findall(r'-?"[^"]*"|\S+', query):
+        if token.startswith("-") or token.lower() == "or":
+            continue
+        words.extend(w.lower() for w in _TERM_RE.findall(token))
+    return list(dict.fromkeys(words))
+
+
+def highlight(title: str, words: List[str]) -> str:
+    """The title as HTML with matching words wrapped in <mark> (everything else escaped)."""
+    if not words:
+        return html.escape(title)
+    # Letters and digits only count as word characters: "invoice_2026.pdf" still marks "invoice"
+    pattern = re.compile(r"(?<![^\W_])(" + "|".join(re.escape(w) for w in words) + r")(?![^\W_])", re.IGNORECASE)
+    parts, last = [], 0
+    for match in pattern.finditer(title):
+        parts.append(html.escape(title[last:match.start()]))
+        parts.append(f"<mark>{html.escape(match.group(0))}</mark>")
+        last = match.end()
+    parts.append(html.escape(title[last:]))
+    return "".join(parts)
+
+
+def search_query(db: Session, query: str, user_id: Optional[str] = None, source: Optional[str] = None,
+                 since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Titles matching `query` that were open at some point in [since, until); page with (last_seen, id)."""
+    q = db.query(ActivityTitle.id, ActivityTitle.user_id, ActivityTitle.day, ActivityTitle.source,
+                 ActivityTitle.context, ActivityTitle.title, ActivityTitle.first_seen,
+                 ActivityTitle.last_seen.label("created_at"), ActivityTitle.seen)
+    if engine.dialect.name == "postgresql":
+        q = q.filter(ActivityTitle.tsv.op("@@")(func.websearch_to_tsquery(settings.TITLES_TS_CONFIG, query)))
+    else:
+        words = terms(query) or [query]
+        q = q.filter(*[func.lower(ActivityTitle.title).contains(w) for w in words])
+    if user_id:
+        q = q.filter(ActivityTitle.user_id == user_id)
+    if source:
+        q = q.filter(ActivityTitle.source == source)
+    if since:
+        q = q.filter(ActivityTitle.last_seen >= since, ActivityTitle.day >= since.date())
+    if until:
+        q = q.filter(ActivityTitle.first_seen < until, ActivityTitle.day <= until.date())
+    return q
+
+
+def _aware(at: datetime) -> datetime:
+    # SQLite drops the timezone; timestamps are stored in UTC
+    return at if at.tzinfo else at.replace(tzinfo=timezone.utc)
+
+
+def rebuild(db: Session, since: Optional[datetime] = None) -> int:
+    """
+    Indexes the titles of stored app and browser history; returns the rows written.
+    Re-running over a range already indexed adds its snapshots to `seen` again.
+    """
+    from app.core import app_deltas
+    from app.models.data import BrowserLog
+    from app.models.user import User
+
+    buffer = TitleBuffer(max_entries=10 ** 9)
+    written = 0
+    for (user_id,) in db.query(User.id).all():
+        cursor = None
+        while True:
+            snapshots, cursor = app_deltas.history(db, user_id, cursor, 200)
+            fresh = [s for s in snapshots if since is None or _aware(s["created_at"]) >= since]
+            for snapshot in fresh:
+                buffer.add(user_id, app_titles(snapshot["apps"] or []), _aware(snapshot["created_at"]))
+            if not cursor or len(fresh) < len(snapshots):
+                break
+        logs = db.query(BrowserLog.details, BrowserLog.created_at).filter(BrowserLog.user_id == user_id)
+        if since is not None:
+            logs = logs.filter(BrowserLog.created_at >= since)
+        for details, created_at in logs.yield_per(500):
+            buffer.add(user_id, tab_titles(details), _aware(created_at))
+        entries = buffer.drain()
+        _upsert(db, entries)
+        written += len(entries)
+        logger.info(f"Indexed {len(entries)} titles for user {user_id}")
+    return written
+
+
+def main():
+    import argparse
+    from app.core.logging_config import setup_logging, stop_logging
+
+    parser = argparse.ArgumentParser(description="Title index maintenance.")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--since", type=date.fromisoformat, help="only index history from this UTC day on")
+    args = parser.parse_args()
+    setup_logging()
+    since = datetime.combine(args.since, datetime.min.time(), tzinfo=timezone.utc) if args.since else None
+    db = SessionLocal()
+    try:
+        print(f"{rebuild(db, since)} title rows written")
+    finally:
+        db.close()
+        stop_logging()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,25 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.api.api import api_router
 from app.core.database import engine, Base
 from app.api.v1.endpoints import websocket
+from app.core import ingest, metrics, presence, rollups, titles
+from app.core.redis import get_async_redis
+from app.core.responses import ORJSONResponse
+from app.core.logging_config import setup_logging, stop_logging
 import logging
-import sys
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("backend.log"),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# Configure logging (queue-based: file/stdout writes happen on a background thread)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Create DB tables
 try:
     Base.metadata.create_all(bind=engine)
+    # Column type changes and indexes declared later on existing tables are one-off commands:
+    # `python -m app.core.search migrate`, then `python -m app.core.schema indexes`
     logger.info("Database tables created successfully.")
 except Exception as e:
     logger.error(f"Failed to connect to the database: {e}")
@@ -33,7 +32,8 @@ except Exception as e:
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    default_response_class=ORJSONResponse
 )
 
 # Set all CORS enabled origins
@@ -46,9 +46,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Readable by the admin panel's fetch() calls
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
-from app.middleware import LoggingMiddleware
-app.add_middleware(LoggingMiddleware)
+from app.core.compression import CompressionMiddleware
+app.add_middleware(CompressionMiddleware)
+from app.core.ratelimit import AdmissionControlMiddleware
+app.add_middleware(AdmissionControlMiddleware)
+from app.core.profiling import ProfilingMiddleware, stack_sampler
+app.add_middleware(ProfilingMiddleware)
+# Added last so it is outermost: 429/503 admission rejections are counted too
+from app.middleware import MetricsMiddleware
+app.add_middleware(MetricsMiddleware)
 
 # Ensure static dir exists
 os.makedirs("static/screenshots", exist_ok=True)
@@ -75,6 +84,15 @@ def read_root():
     #    logger.info(f"ROUTE: {route.path} (Name: {route.name})")
     return {"message": "Welcome to Windows Monitoring System API"}
 
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics(request: Request):
+    """Prometheus scrape endpoint, aggregated across all workers."""
+    if settings.METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {settings.METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    snapshot = await metrics.collect_all(get_async_redis())
+    snapshot.update(await ingest.stream_metrics(get_async_redis()))
+    return PlainTextResponse(metrics.render(snapshot), media_type="text/plain; version=0.0.4")
+
 # Diagnostic: Log all routes on startup
 @app.on_event("startup")
 async def startup_event():
@@ -84,10 +102,24 @@ async def startup_event():
             logger.info(f"Registered Route: {route.path}")
     logger.info("--------------------------")
     websocket.start_webrtc_listener()
+    presence.start_presence_sweeper()
+    titles.start_title_flusher()
+    metrics.start_metrics_publisher(get_async_redis())
+    ingest.start_ingest_consumers(get_async_redis())
+    rollups.start_rollup_workers(get_async_redis())
+    if settings.SAMPLER_AUTOSTART:
+        stack_sampler.start(settings.SAMPLER_HZ, settings.SAMPLER_MAX_CPU, max_stacks=settings.SAMPLER_MAX_STACKS)
 
 @app.on_event("shutdown")
 async def shutdown_event():
     websocket.stop_webrtc_listener()
+    await presence.stop_presence_sweeper()
+    await titles.stop_title_flusher()
+    await ingest.stop_ingest_consumers()
+    await rollups.stop_rollup_workers()
+    metrics.stop_metrics_publisher()
+    stack_sampler.stop()
+    stop_logging()
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,12 +1,17 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi import Request
-import logging
-import json
+import time
+from app.core import metrics
+from app.core.config import settings
+from app.core.ratelimit import ROUTE_CLASSES
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger("API")
 
-class LoggingMiddleware:
+class MetricsMiddleware:
+    """
+    Records per-route request counts and latency, plus the number of DB queries
+    and DB time spent on behalf of each request.
+    Routes are labelled by their template (e.g. /api/v1/admin/apps/{user_id}),
+    never by raw path, to keep label cardinality bounded.
+    """
+
     def __init__(self, app):
         self.app = app
 
@@ -15,9 +20,31 @@ class LoggingMiddleware:
             await self.app(scope, receive, send)
             return
 
-        # Simple logging for HTTP only
-        method = scope.get("method", "UNKNOWN")
-        path = scope.get("path", "UNKNOWN")
-        logger.info(f"REQ: {method} {path}")
+        status_code = 500
+        db_stats = [0, 0.0]
+        token = metrics.request_db_stats.set(db_stats)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
 
-        await self.app(scope, receive, send)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.request_db_stats.reset(token)
+            route = scope.get("route")
+            route_path = getattr(route, "path", None)
+            if route_path is None:
+                path = scope.get("path", "")
+                # Refused by admission control before routing: its routes are fixed paths, so still bounded
+                limited = path.startswith(settings.API_V1_STR) and path[len(settings.API_V1_STR):] in ROUTE_CLASSES
+                route_path = path if limited else "unmatched"
+            method = scope.get("method", "UNKNOWN")
+            metrics.http_requests.inc((method, route_path, str(status_code)))
+            metrics.http_latency.observe(elapsed, (method, route_path))
+            metrics.db_queries.observe(db_stats[0], (route_path,))
+            metrics.db_time.observe(db_stats[1], (route_path,))
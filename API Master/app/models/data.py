@@ -1,16 +1,23 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, JSON, Text
+from sqlalchemy import BigInteger, Column, Integer, Float, String, Boolean, Date, DateTime, ForeignKey, Text, Index, LargeBinary
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import uuid
-from app.core.database import Base
+from app.core.database import Base, JSONDocument
 
 class Command(Base):
     __tablename__ = "commands"
+    __table_args__ = (
+        # Latest-row lookups and keyset pagination per user
+        Index("ix_commands_user_created_id", "user_id", "created_at", "id"),
+        # Containment search (see app.core.search)
+        Index("ix_commands_payload", "payload", postgresql_using="gin", postgresql_ops={"payload": "jsonb_path_ops"}).ddl_if(dialect="postgresql"),
+    )
 
     id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
     user_id = Column(String, ForeignKey("users.id"), nullable=False)
     command = Column(String, nullable=False) # TAKE_SCREENSHOT, etc.
-    payload = Column(JSON, nullable=True)
+    payload = Column(JSONDocument, nullable=True)
     status = Column(String, default="PENDING") # PENDING, SENT, EXECUTED, FAILED
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     executed_at = Column(DateTime(timezone=True), nullable=True)
@@ -20,6 +27,10 @@ class Command(Base):
 
 class Screenshot(Base):
     __tablename__ = "screenshots"
+    __table_args__ = (
+        # Latest-row lookups and keyset pagination per user
+        Index("ix_screenshots_user_created_id", "user_id", "created_at", "id"),
+    )
 
     id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
     user_id = Column(String, ForeignKey("users.id"), nullable=False)
@@ -33,24 +44,191 @@ class Screenshot(Base):
 
 class AppLog(Base):
     __tablename__ = "app_logs"
+    __table_args__ = (
+        # Latest-row lookups and keyset pagination per user
+        Index("ix_app_logs_user_created_id", "user_id", "created_at", "id"),
+        # Containment search (see app.core.search)
+        Index("ix_app_logs_apps", "apps", postgresql_using="gin", postgresql_ops={"apps": "jsonb_path_ops"}).ddl_if(dialect="postgresql"),
+    )
 
     id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
     user_id = Column(String, ForeignKey("users.id"), nullable=False)
     command_id = Column(String, ForeignKey("commands.id"), nullable=True)
-    apps = Column(JSON, nullable=False) # List of running apps
+    apps = Column(JSONDocument, nullable=False) # List of running apps
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     owner = relationship("User", back_populates="app_logs")
 
+class AppDelta(Base):
+    """An app snapshot stored as events against the previous one (see app.core.app_deltas)."""
+    __tablename__ = "app_deltas"
+    __table_args__ = (
+        # Latest-row lookups and keyset pagination per user
+        Index("ix_app_deltas_user_created_id", "user_id", "created_at", "id"),
+        # Replaying a keyframe chain in order
+        Index("ix_app_deltas_keyframe_seq", "keyframe_id", "seq"),
+        # Containment search (see app.core.search)
+        Index("ix_app_deltas_events", "events", postgresql_using="gin", postgresql_ops={"events": "jsonb_path_ops"}).ddl_if(dialect="postgresql"),
+    )
+
+    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    command_id = Column(String, ForeignKey("commands.id"), nullable=True)
+    keyframe_id = Column(String, ForeignKey("app_logs.id"), nullable=False) # Full snapshot the chain starts from
+    seq = Column(Integer, nullable=False) # 1-based position in the chain
+    events = Column(JSONDocument, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    owner = relationship("User", back_populates="app_deltas")
+
 class BrowserLog(Base):
     __tablename__ = "browser_logs"
+    __table_args__ = (
+        # Latest-row lookups and keyset pagination per user
+        Index("ix_browser_logs_user_created_id", "user_id", "created_at", "id"),
+    )
 
     id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
     user_id = Column(String, ForeignKey("users.id"), nullable=False)
     command_id = Column(String, ForeignKey("commands.id"), nullable=True)
     browser = Column(String, nullable=True)
     youtube_open = Column(Boolean, default=False)
-    details = Column(JSON, nullable=True)
+    details = Column(JSONDocument, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     owner = relationship("User", back_populates="browser_logs")
+
+# Domain search: details["domains"] is filled in at upload (see app.core.search)
+Index(
+    "ix_browser_logs_domains", BrowserLog.details["domains"].label("domains"),
+    postgresql_using="gin", postgresql_ops={"domains": "jsonb_path_ops"}
+).ddl_if(dialect="postgresql")
+
+class PresenceSession(Base):
+    __tablename__ = "presence_sessions"
+    __table_args__ = (
+        Index("ix_presence_sessions_user_started", "user_id", "started_at"),
+    )
+
+    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    device_id = Column(String, nullable=True) # Hardware UUID reported by the agent
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    ended_at = Column(DateTime(timezone=True), nullable=False)
+
+    owner = relationship("User", back_populates="presence_sessions")
+
+class Icon(Base):
+    """App/browser icon stored once, keyed by the SHA-256 of its bytes (see app.core.icons)."""
+    __tablename__ = "icons"
+
+    hash = Column(String(64), primary_key=True)
+    media_type = Column(String, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ActivityTitle(Base):
+    """A window or tab title one user had open on one UTC day (see app.core.titles)."""
+    __tablename__ = "activity_titles"
+    __table_args__ = (
+        Index("ix_activity_titles_user_day", "user_id", "day"),
+        Index("ix_activity_titles_last_seen_id", "last_seen", "id"),
+        # Full-text search
+        Index("ix_activity_titles_tsv", "tsv", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
+
+    id = Column(String(40), primary_key=True) # SHA-1 of (user, day, source, context, title)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    source = Column(String, nullable=False) # app, tab
+    context = Column(String, nullable=True) # Exe name for apps, domain (or browser) for tabs
+    title = Column(Text, nullable=False)
+    first_seen = Column(DateTime(timezone=True), nullable=False)
+    last_seen = Column(DateTime(timezone=True), nullable=False)
+    seen = Column(Integer, nullable=False, default=1) # Snapshots it appeared in
+    tsv = Column(Text().with_variant(TSVECTOR(), "postgresql"), nullable=True) # to_tsvector(title), Postgres only
+
+# --- Hourly activity rollups (see app.core.rollups) ---
+class AppUsageHourly(Base):
+    """Seconds an app was running (and in the foreground) for one user in one UTC hour."""
+    __tablename__ = "app_usage_hourly"
+    __table_args__ = (
+        # Breakdowns across all users
+        Index("ix_app_usage_hourly_hour", "hour"),
+    )
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    hour = Column(DateTime(timezone=True), primary_key=True)
+    app = Column(String, primary_key=True) # Exe name
+    seconds = Column(Float, nullable=False, default=0)
+    active_seconds = Column(Float, nullable=False, default=0)
+
+class ActivityHourly(Base):
+    """Seconds covered by app snapshots for one user in one UTC hour, and how many there were."""
+    __tablename__ = "activity_hourly"
+    __table_args__ = (
+        Index("ix_activity_hourly_hour", "hour"),
+    )
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    hour = Column(DateTime(timezone=True), primary_key=True)
+    seconds = Column(Float, nullable=False, default=0)
+    snapshots = Column(Integer, nullable=False, default=0)
+
+class RollupCursor(Base):
+    """
+    Time of the newest snapshot rolled up per user (the start of the next snapshot's
+    interval), and of the oldest: no snapshot before first_at has been rolled up.
+    """
+    __tablename__ = "rollup_cursors"
+
+    user_id = Column(String, ForeignKey("users.id"), primary_key=True)
+    last_at = Column(DateTime(timezone=True), nullable=False)
+    first_at = Column(DateTime(timezone=True), nullable=False)
+
+class RollupApplied(Base):
+    """Snapshots already rolled up, so a redelivered stream entry is not counted twice."""
+    __tablename__ = "rollup_applied"
+    __table_args__ = (
+        Index("ix_rollup_applied_applied_at", "applied_at"),
+    )
+
+    snapshot_id = Column(String, primary_key=True)
+    applied_at = Column(DateTime(timezone=True), nullable=False)
+
+class ExportWatermark(Base):
+    """How far incremental Parquet exports of a dataset have got (see app.core.exports)."""
+    __tablename__ = "export_watermarks"
+
+    dataset = Column(String, primary_key=True) # apps, browser, commands, presence
+    exported_until = Column(DateTime(timezone=True), nullable=True) # Exclusive; None before the first run
+    last_file = Column(String, nullable=True)
+    last_rows = Column(Integer, nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+
+# --- Screenshot cold storage (see app.core.archive) ---
+class ScreenshotArchive(Base):
+    """One packed file of a user's screenshots from one UTC day."""
+    __tablename__ = "screenshot_archives"
+    __table_args__ = (
+        Index("ix_screenshot_archives_user_day", "user_id", "day"),
+    )
+
+    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    path = Column(String, nullable=False)
+    count = Column(Integer, nullable=False)
+    raw_bytes = Column(BigInteger, nullable=False) # Image bytes packed
+    size = Column(BigInteger, nullable=False) # Archive file size
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ArchivedScreenshot(Base):
+    """Which archive holds a screenshot's image; its offset is in the archive's own index."""
+    __tablename__ = "archived_screenshots"
+    __table_args__ = (
+        Index("ix_archived_screenshots_archive_id", "archive_id"),
+    )
+
+    screenshot_id = Column(String, primary_key=True) # No FK: retention may still delete the screenshot row
+    archive_id = Column(String, ForeignKey("screenshot_archives.id"), nullable=False)
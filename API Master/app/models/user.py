@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Enum, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import uuid
@@ -6,6 +6,10 @@ from app.core.database import Base
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Keyset pagination order
+        Index("ix_users_created_id", "created_at", "id"),
+    )
 
     id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
     email = Column(String, unique=True, index=True, nullable=False)
@@ -19,7 +23,9 @@ class User(Base):
     commands = relationship("Command", back_populates="owner", cascade="all, delete-orphan")
     screenshots = relationship("Screenshot", back_populates="owner", cascade="all, delete-orphan")
     app_logs = relationship("AppLog", back_populates="owner", cascade="all, delete-orphan")
+    app_deltas = relationship("AppDelta", back_populates="owner", cascade="all, delete-orphan")
     browser_logs = relationship("BrowserLog", back_populates="owner", cascade="all, delete-orphan")
+    presence_sessions = relationship("PresenceSession", back_populates="owner", cascade="all, delete-orphan")
 
 class Device(Base):
     __tablename__ = "devices"
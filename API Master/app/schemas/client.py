@@ -1,13 +1,22 @@
-from typing import Optional, List, Dict, Any
-from pydantic import BaseModel
-from datetime import datetime
+from typing import Optional, List, Dict, Any, Union
+from pydantic import BaseModel, Field
+import msgspec
+from datetime import date, datetime
 
 # Heartbeat
 class HeartbeatRequest(BaseModel):
     status: str
+    device_id: Optional[str] = None
 
 class HeartbeatResponse(BaseModel):
     success: bool
+    # Recommended seconds until the next heartbeat / command poll
+    heartbeat_interval: Optional[float] = None
+    poll_interval: Optional[float] = None
+
+class PollingOverride(BaseModel):
+    multiplier: Optional[float] = Field(None, ge=1, le=20)  # None clears the override
+    ttl_seconds: int = Field(3600, gt=0, le=7 * 24 * 3600)
 
 # Command
 class CommandCreate(BaseModel):
@@ -33,8 +42,11 @@ class CommandSchema(BaseModel):
         from_attributes = True
 
 # Data Uploads
-class ScreenshotUpload(BaseModel):
-    command_id: Optional[str]
+# Agent upload bodies are decoded with msgspec (see deps.msgspec_body) rather than
+# pydantic: they are the largest request bodies we receive and decoding them
+# straight into Structs is several times cheaper.
+class ScreenshotUpload(msgspec.Struct, kw_only=True):
+    command_id: Optional[str] = None
     image_base64: str
     is_auto: Optional[bool] = False
 
@@ -42,24 +54,63 @@ class ScreenshotResponse(BaseModel):
     success: bool
     screenshot_url: str
 
-class AppInfo(BaseModel):
+class AppInfo(msgspec.Struct, kw_only=True):
     name: str
     pid: int
     title: Optional[str] = None
     exe_path: Optional[str] = None
     icon: Optional[str] = None
     duration: Optional[str] = None
+    is_active: bool = False
+
+class AppLogUpload(msgspec.Struct, kw_only=True):
+    command_id: Optional[str] = None
+    apps: List[AppInfo]
+
+class BrowserLogUpload(msgspec.Struct, kw_only=True):
+    command_id: Optional[str] = None
+    browser: str
+    youtube_open: bool
+    details: Optional[Dict[str, Any]] = None
 
-class AppLogUpload(BaseModel):
-    command_id: Optional[str]
+# Batch upload: one body with mixed records, discriminated by "type".
+# captured_at lets agents replay an offline backlog with the original times.
+class BatchAppSnapshot(msgspec.Struct, kw_only=True, tag_field="type", tag="apps"):
+    command_id: Optional[str] = None
+    captured_at: Optional[datetime] = None
     apps: List[AppInfo]
 
-class BrowserLogUpload(BaseModel):
-    command_id: Optional[str]
+class BatchBrowserSnapshot(msgspec.Struct, kw_only=True, tag_field="type", tag="browser"):
+    command_id: Optional[str] = None
+    captured_at: Optional[datetime] = None
     browser: str
     youtube_open: bool
     details: Optional[Dict[str, Any]] = None
 
+class BatchScreenshot(msgspec.Struct, kw_only=True, tag_field="type", tag="screenshot"):
+    command_id: Optional[str] = None
+    captured_at: Optional[datetime] = None
+    image_base64: str
+
+class BatchCommandAck(msgspec.Struct, kw_only=True, tag_field="type", tag="ack"):
+    command_id: str
+    status: str
+
+class BatchUpload(msgspec.Struct, kw_only=True):
+    records: List[Union[BatchAppSnapshot, BatchBrowserSnapshot, BatchScreenshot, BatchCommandAck]]
+
+# Icon registry: agents check which hashes the server lacks, then upload only those
+class IconCheck(msgspec.Struct, kw_only=True):
+    hashes: List[str]
+
+class IconData(msgspec.Struct, kw_only=True):
+    hash: str  # SHA-256 hex of the decoded bytes
+    data: str  # base64
+    media_type: str = "image/png"
+
+class IconUpload(msgspec.Struct, kw_only=True):
+    icons: List[IconData]
+
 # Admin
 class AdminUserList(BaseModel):
     users: List[Dict[str, Any]]
@@ -72,3 +123,14 @@ class NotifySchema(BaseModel):
 class NotificationReply(BaseModel):
     command_id: str
     message: str
+
+# Presence
+class PresenceDay(BaseModel):
+    user_id: str
+    date: date
+    seconds: int
+
+class PresenceReport(BaseModel):
+    start: date
+    end: date
+    days: List[PresenceDay]
@@ -0,0 +1,95 @@
+"""
+Bytes stored per app snapshot with delta encoding vs full JSON arrays, and the
+cost of rebuilding "apps at time T" from a keyframe and its deltas.
+
+Simulates an agent uploading every 10 s for a working day, with a few windows
+opening, closing, retitling or taking focus between snapshots.
+
+    cd "API Master"
+    python -m benchmarks.bench_app_deltas
+"""
+import copy
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+SNAPSHOTS = 8 * 360  # One upload every 10 s for 8 hours
+
+
+def _mutate(rng, apps, step, template):
+    apps = copy.deepcopy(apps)
+    roll = rng.random()
+    if roll < 0.05 and len(apps) > 5:
+        apps.pop(rng.randrange(1, len(apps)))
+    elif roll < 0.10:
+        new = dict(rng.choice(template), pid=5000 + step, title=f"New window {step}", duration="00:00:00",
+                   is_active=False)
+        apps.append(new)
+    elif roll < 0.30:
+        rng.choice(apps)["title"] = f"Document {step}"
+    elif roll < 0.40:
+        for app in apps:
+            app["is_active"] = False
+        rng.choice(apps)["is_active"] = True
+    return apps
+
+
+def main():
+    # Must happen before app.core.config is imported
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if "DATABASE_URL" not in os.environ:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    from benchmarks.local_server import use_fakeredis
+    use_fakeredis()
+
+    import orjson
+    from app.core import app_deltas
+    from app.core.database import Base, SessionLocal, engine
+    from app.core.redis import get_redis
+    from app.models.user import User
+    from benchmarks import payloads
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = User(email="deltas@example.com", name="Deltas", hashed_password="x")
+    db.add(user)
+    db.commit()
+
+    rng = random.Random(payloads.SEED)
+    template = payloads.apps_payload(count=20)["apps"]
+    apps = template
+    start = datetime(2026, 1, 5, 9, 0, tzinfo=timezone.utc)
+    full_bytes = stored_bytes = keyframes = 0
+    encode_seconds = 0.0
+    for step in range(SNAPSHOTS):
+        apps = _mutate(rng, apps, step, template)
+        at = start + timedelta(seconds=10 * step)
+        began = time.perf_counter()
+        kind, row = app_deltas.encode(get_redis(), user.id, None, apps, at)
+        encode_seconds += time.perf_counter() - began
+        db.add(row)
+        full_bytes += len(orjson.dumps(apps))
+        if kind == "apps":
+            keyframes += 1
+            stored_bytes += len(orjson.dumps(row.apps))
+        else:
+            stored_bytes += len(orjson.dumps(row.events))
+    db.commit()
+
+    print(f"{SNAPSHOTS} snapshots of ~{len(apps)} apps, {keyframes} keyframes")
+    print(f"full arrays: {full_bytes / 1e6:>8.2f} MB")
+    print(f"delta-coded: {stored_bytes / 1e6:>8.2f} MB  ({full_bytes / stored_bytes:.1f}x smaller)")
+    print(f"encode:      {encode_seconds / SNAPSHOTS * 1000:>8.3f} ms per snapshot")
+
+    samples = [start + timedelta(seconds=rng.randrange(10 * SNAPSHOTS)) for _ in range(200)]
+    began = time.perf_counter()
+    for at in samples:
+        app_deltas.apps_at(db, user.id, at)
+    print(f"apps at T:   {(time.perf_counter() - began) / len(samples) * 1000:>8.3f} ms per lookup")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
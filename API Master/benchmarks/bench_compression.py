@@ -0,0 +1,97 @@
+"""
+Bytes on the wire for typical agent and dashboard payloads, uncompressed vs
+gzip vs zstd at the levels the server uses, plus a round trip through the app
+to check what CompressionMiddleware actually sends and accepts.
+
+    cd "API Master"
+    python -m benchmarks.bench_compression
+"""
+import json
+import os
+import tempfile
+import time
+
+
+def _cases():
+    from benchmarks import payloads
+    return [
+        ("apps upload (50 apps, icons)", payloads.apps_payload(count=50)),
+        ("apps upload (50 apps, no icons)", payloads.apps_payload(count=50, with_icons=False)),
+        ("browser upload (300 tabs)", payloads.browser_payload(tabs=300)),
+        ("screenshot upload (1 MB PNG)", payloads.screenshot_payload(1024 * 1024)),
+        ("admin user list (500 users)", payloads.users_payload(count=500)),
+    ]
+
+
+def measure_payloads():
+    from app.core import compression
+
+    print(f"{'payload':<34} {'raw':>10} {'encoding':>9} {'wire':>10} {'ratio':>7} {'enc ms':>8} {'dec ms':>8}")
+    for name, payload in _cases():
+        raw = json.dumps(payload).encode()
+        for encoding in compression.SUPPORTED:
+            start = time.perf_counter()
+            wire = compression.compress(raw, encoding)
+            encode_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            compression.decompress(wire, encoding, len(raw))
+            decode_ms = (time.perf_counter() - start) * 1000
+            print(f"{name:<34} {len(raw):>10} {encoding:>9} {len(wire):>10} "
+                  f"{len(raw) / len(wire):>6.1f}x {encode_ms:>8.2f} {decode_ms:>8.2f}")
+
+
+def measure_app():
+    """Uploads the browser payload compressed, then reads it back with each Accept-Encoding."""
+    from fastapi.testclient import TestClient
+    from app.core import compression
+    from app.core.database import SessionLocal
+    from app.core.security import create_access_token
+    from app.main import app
+    from app.models.user import User
+    from benchmarks import payloads
+
+    db = SessionLocal()
+    try:
+        admin = User(email="compress-admin@example.com", name="Admin", hashed_password="x", is_superuser=True)
+        agent = User(email="compress-agent@example.com", name="Agent", hashed_password="x")
+        db.add_all([admin, agent])
+        db.commit()
+        admin_id, agent_id = admin.id, agent.id
+    finally:
+        db.close()
+
+    client = TestClient(app)
+    agent_headers = {"Authorization": f"Bearer {create_access_token(agent_id)}", "Content-Type": "application/json"}
+    admin_headers = {"Authorization": f"Bearer {create_access_token(admin_id)}"}
+
+    print(f"\n{'request':<34} {'encoding':>9} {'wire':>10} {'status':>7}")
+    body = json.dumps(payloads.browser_payload(tabs=300)).encode()
+    for encoding in ("identity",) + compression.SUPPORTED:
+        data = body if encoding == "identity" else compression.compress(body, encoding)
+        resp = client.post("/api/v1/client/browser/upload", content=data,
+                           headers={**agent_headers, "Content-Encoding": encoding})
+        print(f"{'POST /client/browser/upload':<34} {encoding:>9} {len(data):>10} {resp.status_code:>7}")
+
+    for encoding in ("identity",) + compression.SUPPORTED:
+        # iter_raw() skips httpx decoding, so the byte count is what crossed the wire
+        with client.stream("GET", f"/api/v1/admin/browser/{agent_id}",
+                           headers={**admin_headers, "Accept-Encoding": encoding}) as resp:
+            wire = sum(len(chunk) for chunk in resp.iter_raw())
+            served = resp.headers.get("content-encoding", "identity")
+        print(f"{'GET /admin/browser/{user_id}':<34} {served:>9} {wire:>10} {resp.status_code:>7}")
+
+
+def main():
+    # Must happen before app.core.config is imported
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if "DATABASE_URL" not in os.environ:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    from benchmarks.local_server import use_fakeredis
+    use_fakeredis()
+
+    measure_payloads()
+    measure_app()
+
+
+if __name__ == "__main__":
+    main()
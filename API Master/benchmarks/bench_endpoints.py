@@ -0,0 +1,217 @@
+"""
+Per-endpoint micro-benchmarks of the ingest and dashboard hot paths.
+
+Every case runs in-process through the ASGI app (Starlette TestClient) against
+fixed synthetic data, on SQLite + fakeredis unless DATABASE_URL points elsewhere.
+
+    cd "API Master"
+    python -m benchmarks.bench_endpoints --save-baseline      # record benchmarks/baseline.json
+    python -m benchmarks.bench_endpoints --compare            # fail (exit 1) on regressions
+    python -m benchmarks.bench_endpoints -k upload_apps       # run a subset
+
+A case regresses when its median is more than --threshold percent slower than the baseline.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+BENCHMARKS: List[dict] = []
+
+
+def benchmark(name: str, iterations: int = 50, warmup: int = 3):
+    """Registers `fn(ctx)` as a benchmark case; `fn` performs exactly one timed operation."""
+    def register(fn: Callable):
+        BENCHMARKS.append({"name": name, "fn": fn, "iterations": iterations, "warmup": warmup})
+        return fn
+    return register
+
+
+class Context:
+    """The app, a TestClient and the seeded fixture data shared by all cases."""
+
+    def __init__(self, online_users: int):
+        from fastapi import Depends
+        from fastapi.testclient import TestClient
+        from app.api import deps
+        from app.core import redis as app_redis
+        from app.core.database import SessionLocal
+        from app.core.security import create_access_token
+        from app.main import app
+        from app.models.user import User, Device
+
+        # Isolates the auth dependency (JWT decode + user lookup) behind the full ASGI stack
+        @app.get("/__bench/whoami", include_in_schema=False)
+        def whoami(current_user: User = Depends(deps.get_current_user)):
+            return {"id": current_user.id}
+
+        db = SessionLocal()
+        try:
+            admin = User(email="bench-admin@example.com", name="Bench Admin", hashed_password="x", is_superuser=True)
+            agent = User(email="bench-agent@example.com", name="Bench Agent", hashed_password="x")
+            fleet = [User(email=f"bench-{i}@example.com", name=f"Bench {i}", hashed_password="x")
+                     for i in range(online_users)]
+            db.add_all([admin, agent] + fleet)
+            db.flush()
+            db.add_all([Device(user_id=u.id, device_hw_id=f"bench-hw-{i}", name=f"BENCH-{i}")
+                        for i, u in enumerate(fleet)])
+            db.commit()
+            self.admin_id, self.agent_id = admin.id, agent.id
+            fleet_ids = [u.id for u in fleet]
+        finally:
+            db.close()
+
+        redis = app_redis.get_redis()
+        pipe = redis.pipeline()
+        for user_id in fleet_ids:
+            pipe.set(f"online:{user_id}", "online", ex=3600)
+        pipe.execute()
+
+        self.app = app
+        self.client = TestClient(app)
+        self.admin_headers = {"Authorization": f"Bearer {create_access_token(self.admin_id)}"}
+        self.agent_headers = {"Authorization": f"Bearer {create_access_token(self.agent_id)}",
+                              "Content-Type": "application/json"}
+
+    def post(self, path: str, body: bytes, headers=None):
+        resp = self.client.post(f"/api/v1{path}", content=body, headers=headers or self.agent_headers)
+        assert resp.status_code == 200, f"{path}: {resp.status_code} {resp.text[:200]}"
+        return resp
+
+    def get(self, path: str, headers=None):
+        resp = self.client.get(f"/api/v1{path}" if not path.startswith("/__") else path,
+                               headers=headers or self.admin_headers)
+        assert resp.status_code == 200, f"{path}: {resp.status_code} {resp.text[:200]}"
+        return resp
+
+
+# --- Cases ---
+def _screenshot_case(megabytes: int):
+    body = {}
+
+    def run(ctx):
+        if "raw" not in body:
+            from benchmarks import payloads
+            body["raw"] = json.dumps(payloads.screenshot_payload(megabytes * 1024 * 1024)).encode()
+        ctx.post("/client/screenshot/upload", body["raw"])
+    return run
+
+for _mb in (1, 4, 8):
+    benchmark(f"upload_screenshot_{_mb}mb", iterations=max(5, 40 // _mb))(_screenshot_case(_mb))
+
+
+@benchmark("upload_apps_50_icons")
+def bench_upload_apps(ctx):
+    if not hasattr(ctx, "apps_body"):
+        from benchmarks import payloads
+        ctx.apps_body = json.dumps(payloads.apps_payload(count=50)).encode()
+    ctx.post("/client/apps/upload", ctx.apps_body)
+
+
+@benchmark("upload_browser_300_tabs")
+def bench_upload_browser(ctx):
+    if not hasattr(ctx, "browser_body"):
+        from benchmarks import payloads
+        ctx.browser_body = json.dumps(payloads.browser_payload(tabs=300)).encode()
+    ctx.post("/client/browser/upload", ctx.browser_body)
+
+
+@benchmark("get_online_users", iterations=5, warmup=1)
+def bench_online_users(ctx):
+    ctx.get("/admin/online-users")
+
+
+@benchmark("get_current_user", iterations=200)
+def bench_current_user(ctx):
+    ctx.get("/__bench/whoami", headers=ctx.agent_headers)
+
+
+# --- Runner ---
+def run_case(ctx, case) -> Dict[str, float]:
+    for _ in range(case["warmup"]):
+        case["fn"](ctx)
+    timings = []
+    for _ in range(case["iterations"]):
+        start = time.perf_counter()
+        case["fn"](ctx)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "iterations": len(timings),
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(0.95 * len(timings)))], 3),
+        "min_ms": round(timings[0], 3),
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = (result["median_ms"] - base["median_ms"]) / base["median_ms"] * 100
+        result["vs_baseline_pct"] = round(change, 1)
+        if change > threshold:
+            regressions.append(f"{name}: {base['median_ms']}ms -> {result['median_ms']}ms (+{change:.1f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", "--filter", help="only run cases whose name contains this")
+    parser.add_argument("--online-users", type=int, default=5000)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true", help="compare against the baseline and exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=20.0, help="allowed median slowdown in percent")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # One agent user replays each request far faster than any real agent: measure the endpoints, not the 429s
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    if "DATABASE_URL" not in os.environ:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    from benchmarks.local_server import use_fakeredis
+    use_fakeredis()
+
+    ctx = Context(args.online_users)
+    cases = [c for c in BENCHMARKS if not args.filter or args.filter in c["name"]]
+    results = {}
+    print(f"{'case':<28} {'iters':>6} {'median ms':>10} {'p95 ms':>10} {'min ms':>10}")
+    for case in cases:
+        results[case["name"]] = r = run_case(ctx, case)
+        print(f"{case['name']:<28} {r['iterations']:>6} {r['median_ms']:>10} {r['p95_ms']:>10} {r['min_ms']:>10}")
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            sys.exit(f"No baseline at {args.baseline}; run with --save-baseline first")
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+        if regressions:
+            print("\nREGRESSIONS (>{:.0f}% slower than baseline):".format(args.threshold))
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+    if args.save_baseline:
+        baseline = {"results": results}
+        if os.path.exists(args.baseline) and args.filter:
+            # Partial runs update only their own cases
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            baseline["results"].update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
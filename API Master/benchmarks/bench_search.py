@@ -0,0 +1,124 @@
+"""
+Query plans and timings of the admin search filters (app.core.search) on seeded
+app, browser and command history.
+
+Meant for Postgres, where every filter should show a Bitmap Index Scan on its
+GIN index; a plan that falls back to a Seq Scan is reported and fails the run
+(exit 1). On SQLite, the default, the plans are printed for reference only.
+
+    cd "API Master"
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_search --rows 20000
+    python -m benchmarks.bench_search
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+
+def _seed(conn, rows: int, users: list, rng):
+    from app.core import search
+    from app.models.data import AppDelta, AppLog, BrowserLog, Command
+    from benchmarks import payloads
+
+    start = datetime(2026, 1, 5, tzinfo=timezone.utc)
+    apps = payloads.apps_payload(count=20, with_icons=False)["apps"]
+    app_rows, delta_rows, browser_rows, command_rows = [], [], [], []
+    for i in range(rows):
+        user_id = users[i % len(users)]
+        at = start + timedelta(seconds=30 * i)
+        # Only a few users ever run the searched-for app or open the searched-for domain
+        running = apps[:10] + ([{**apps[0], "name": "rare.exe"}] if i % 997 == 0 else [])
+        app_rows.append({"id": str(uuid.uuid4()), "user_id": user_id, "apps": running, "created_at": at})
+        opened = {**apps[0], "name": "rare.exe" if i % 989 == 0 else apps[i % len(apps)]["name"]}
+        delta_rows.append({"id": str(uuid.uuid4()), "user_id": user_id, "keyframe_id": app_rows[-1]["id"], "seq": 1,
+                           "events": [["open", 10, opened], ["set", 3, {"title": f"Document {i}"}]],
+                           "created_at": at + timedelta(seconds=10)})
+        details = payloads.browser_payload(tabs=20, seed=i)["details"]
+        if i % 991 == 0:
+            details["sessions"]["Chrome"].append({"title": "Rare", "url": "https://rare.example.org/x"})
+        search.annotate_browser(details)
+        browser_rows.append({"id": str(uuid.uuid4()), "user_id": user_id, "browser": "Chrome",
+                             "youtube_open": False, "details": details, "created_at": at})
+        command_rows.append({"id": str(uuid.uuid4()), "user_id": user_id, "command": "SEND_NOTIFICATION",
+                             "payload": {"title": "Rare" if i % 983 == 0 else f"Notice {rng.randrange(50)}",
+                                         "message": "..."},
+                             "status": "EXECUTED", "created_at": at})
+    for model, batch in ((AppLog, app_rows), (AppDelta, delta_rows), (BrowserLog, browser_rows), (Command, command_rows)):
+        for i in range(0, len(batch), 1000):
+            conn.execute(model.__table__.insert(), batch[i:i + 1000])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000, help="snapshots per table")
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    # Must happen before app.core.config is imported
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if "DATABASE_URL" not in os.environ:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+    from sqlalchemy import select, text
+    from sqlalchemy.orm import Session
+    from app.core import search
+    from app.core.database import Base, engine, migrate_json_columns
+    from app.models.data import AppDelta, AppLog, BrowserLog, Command
+    from app.models.user import User
+
+    Base.metadata.create_all(bind=engine)
+    migrate_json_columns(engine)
+    postgres = engine.dialect.name == "postgresql"
+    rng = random.Random(1)
+    users = []
+    with engine.begin() as conn:
+        for i in range(args.users):
+            user_id = str(uuid.uuid4())
+            conn.execute(User.__table__.insert(), {"id": user_id, "email": f"search{user_id}@example.com",
+                                                   "name": f"User {i}", "hashed_password": "x"})
+            users.append(user_id)
+        _seed(conn, args.rows, users, rng)
+        if postgres:
+            conn.execute(text("ANALYZE"))
+
+    keyframes, deltas = search.app_filters("rare.exe")
+    cases = {
+        "domain": (select(BrowserLog.id).where(search.domain_filter("rare.example.org")), "ix_browser_logs_domains"),
+        "app keyframes": (select(AppLog.id).where(keyframes), "ix_app_logs_apps"),
+        "app deltas": (select(AppDelta.id).where(deltas), "ix_app_deltas_events"),
+        "command payload": (select(Command.id).where(search.payload_filter({"title": "Rare"})), "ix_commands_payload"),
+    }
+    explain = "EXPLAIN (ANALYZE, BUFFERS)" if postgres else "EXPLAIN QUERY PLAN"
+    failed = False
+    with engine.connect() as conn:
+        for name, (query, index) in cases.items():
+            compiled = query.compile(dialect=engine.dialect)
+            began = time.perf_counter()
+            matches = len(conn.execute(query).all())
+            elapsed = (time.perf_counter() - began) * 1000
+            params = compiled.params
+            if compiled.positional:
+                params = tuple(params[key] for key in compiled.positiontup)
+            plan = "\n".join(" ".join(str(col) for col in row)
+                             for row in conn.exec_driver_sql(f"{explain} {compiled}", params))
+            uses_index = index in plan
+            if postgres and not uses_index:
+                failed = True
+            print(f"--- {name}: {matches} matches in {elapsed:.2f} ms"
+                  + (f", {'uses' if uses_index else 'DOES NOT USE'} {index}" if postgres else ""))
+            print(plan)
+
+    began = time.perf_counter()
+    with engine.connect() as conn:
+        hits = search.activity(Session(bind=conn), domain="rare.example.org", app="rare.exe")
+    print(f"--- activity(domain, app): {len(hits)} users in {(time.perf_counter() - began) * 1000:.2f} ms")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
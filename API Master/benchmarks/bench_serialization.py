@@ -0,0 +1,95 @@
+"""
+Micro-benchmark: response encoding and agent upload decoding.
+
+Compares the stock FastAPI path (jsonable_encoder + stdlib json, pydantic body
+parsing) with the orjson response class and msgspec decoders used by the app.
+
+    cd "API Master" && python -m benchmarks.bench_serialization
+"""
+import json
+import timeit
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import msgspec
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from app.core.responses import dumps
+from app.schemas import client as client_schema
+from benchmarks import payloads
+
+
+# Pydantic equivalents of the upload schemas, i.e. what FastAPI parsed before msgspec
+class PydAppInfo(BaseModel):
+    name: str
+    pid: int
+    title: Optional[str] = None
+    exe_path: Optional[str] = None
+    icon: Optional[str] = None
+    duration: Optional[str] = None
+
+class PydAppLogUpload(BaseModel):
+    command_id: Optional[str]
+    apps: List[PydAppInfo]
+
+class PydBrowserLogUpload(BaseModel):
+    command_id: Optional[str]
+    browser: str
+    youtube_open: bool
+    details: Optional[Dict[str, Any]] = None
+
+class PydScreenshotUpload(BaseModel):
+    command_id: Optional[str]
+    image_base64: str
+    is_auto: Optional[bool] = False
+
+
+def _best(fn, number):
+    """Best-of-5 per-call time in microseconds."""
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def _row(name, baseline_us, fast_us, size):
+    print(f"{name:<34} {size / 1024:>9.1f} KiB {baseline_us:>12.1f} {fast_us:>12.1f} {baseline_us / fast_us:>8.1f}x")
+
+
+def bench_encode(number):
+    now = datetime.now(timezone.utc)
+    apps = payloads.apps_payload(count=50)["apps"]
+    browser = payloads.browser_payload(tabs=300)
+    cases = {
+        "GET /admin/apps/{user_id}": {"apps": apps, "created_at": now},
+        "GET /admin/browser/{user_id}": {**browser, "created_at": now},
+        "GET /admin/users (500)": payloads.users_payload(500),
+    }
+    print(f"\n{'encode':<34} {'size':>13} {'stdlib us':>12} {'orjson us':>12} {'speedup':>9}")
+    for name, content in cases.items():
+        stdlib = lambda: json.dumps(jsonable_encoder(content)).encode()
+        fast = lambda: dumps(content)
+        _row(name, _best(stdlib, number), _best(fast, number), len(fast()))
+
+
+def bench_decode(number):
+    cases = {
+        "POST /client/apps/upload (50)": (payloads.apps_payload(count=50), PydAppLogUpload, client_schema.AppLogUpload),
+        "POST /client/browser/upload (300)": (payloads.browser_payload(tabs=300), PydBrowserLogUpload, client_schema.BrowserLogUpload),
+        "POST /client/screenshot/upload (1MB)": (payloads.screenshot_payload(1024 * 1024), PydScreenshotUpload, client_schema.ScreenshotUpload),
+    }
+    print(f"\n{'decode':<34} {'size':>13} {'pydantic us':>12} {'msgspec us':>12} {'speedup':>9}")
+    for name, (body, pyd_model, struct) in cases.items():
+        raw = json.dumps(body).encode()
+        decoder = msgspec.json.Decoder(struct)
+        # FastAPI parses the body with json.loads and then validates the dict
+        pyd = lambda: pyd_model.model_validate(json.loads(raw))
+        fast = lambda: decoder.decode(raw)
+        _row(name, _best(pyd, number), _best(fast, number), len(raw))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--number", type=int, default=50, help="calls per timing round")
+    args = parser.parse_args()
+    bench_encode(args.number)
+    bench_decode(args.number)
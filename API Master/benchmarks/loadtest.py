@@ -0,0 +1,309 @@
+"""
+Agent-fleet simulator: N asyncio agents following the real APIClient/BackgroundService
+traffic pattern against a running server.
+
+Each agent heartbeats every 10s and polls /client/commands every 5s. Commands
+queued by a simulated admin (TAKE_SCREENSHOT, GET_RUNNING_APPS,
+GET_BROWSER_STATUS) are executed like the real agent does: upload the result,
+then ACK. A fraction of agents also keep a signaling WebSocket open as `host`
+and answer offers from a simulated viewer, which measures the round trip.
+
+    # Stand-in server (SQLite + fakeredis), in another shell:
+    python -m benchmarks.local_server --sqlite loadtest.db --fakeredis
+
+    cd "API Master"
+    python -m benchmarks.loadtest --sqlite loadtest.db --agents 2000 --duration 120
+
+Agents are provisioned directly in the server's database with locally minted JWTs,
+so the test doesn't start with thousands of bcrypt logins. Both processes must use
+the same database: pass the same --sqlite file to both, or neither flag and one
+shared DATABASE_URL (.env) for the server and the load test.
+Use --provision api to go through /auth/register and /auth/login instead.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks import payloads
+
+HEARTBEAT_INTERVAL = 10
+COMMAND_POLL_INTERVAL = 5
+COMMAND_MIX = {"TAKE_SCREENSHOT": 1, "GET_RUNNING_APPS": 2, "GET_BROWSER_STATUS": 2}
+
+
+class Stats:
+    """Latencies and status codes per endpoint."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.started = time.perf_counter()
+
+    def record(self, name: str, seconds: float, status):
+        self.latencies[name].append(seconds)
+        self.statuses[name][str(status)] += 1
+
+    def report(self) -> List[dict]:
+        elapsed = time.perf_counter() - self.started
+        rows = []
+        for name in sorted(self.latencies):
+            values = sorted(self.latencies[name])
+            pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+            errors = sum(n for s, n in self.statuses[name].items() if not s.startswith("2"))
+            rows.append({
+                "endpoint": name,
+                "count": len(values),
+                "rps": round(len(values) / elapsed, 2),
+                "errors": errors,
+                "p50_ms": round(pick(0.50), 2),
+                "p95_ms": round(pick(0.95), 2),
+                "p99_ms": round(pick(0.99), 2),
+                "max_ms": round(values[-1] * 1000, 2),
+                "statuses": dict(self.statuses[name]),
+            })
+        return rows
+
+    def print_report(self):
+        print(f"\n{'endpoint':<38} {'count':>8} {'req/s':>8} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for r in self.report():
+            print(f"{r['endpoint']:<38} {r['count']:>8} {r['rps']:>8} {r['errors']:>7} "
+                  f"{r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {r['max_ms']:>9}")
+
+
+class Fleet:
+    def __init__(self, args):
+        self.args = args
+        self.stats = Stats()
+        self.stop = asyncio.Event()
+        self.agents: List[dict] = []
+        self.admin_token: Optional[str] = None
+        # Payloads are built once; agents share them like a fleet of identical machines would
+        self.bodies = {
+            "screenshot": json.dumps(payloads.screenshot_payload(args.screenshot_kb * 1024)),
+            "apps": json.dumps(payloads.apps_payload(count=args.apps)),
+            "browser": json.dumps(payloads.browser_payload(tabs=args.tabs)),
+        }
+
+    async def call(self, client: httpx.AsyncClient, name: str, method: str, url: str, token: str,
+                   body: Optional[str] = None, command_id: Optional[str] = None):
+        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+        if body is not None and command_id:
+            # Patch the command id into a pre-serialized payload instead of re-encoding megabytes of JSON
+            body = body.replace('"command_id": null', f'"command_id": "{command_id}"', 1)
+        start = time.perf_counter()
+        try:
+            resp = await client.request(method, url, content=body, headers=headers)
+            self.stats.record(name, time.perf_counter() - start, resp.status_code)
+            return resp
+        except httpx.HTTPError as e:
+            self.stats.record(name, time.perf_counter() - start, type(e).__name__)
+            return None
+
+    # --- Provisioning ---
+    def provision_db(self):
+        from app.core.database import SessionLocal, Base, engine
+        from app.core.security import create_access_token, get_password_hash
+        from app.models.user import User, Device
+        import app.models.data  # noqa: F401 - register tables
+
+        Base.metadata.create_all(bind=engine)
+        run_id = uuid.uuid4().hex[:8]
+        hashed = get_password_hash("loadtest")
+        db = SessionLocal()
+        try:
+            admin = User(email=f"loadtest-admin-{run_id}@example.com", name="Load Test Admin",
+                         hashed_password=hashed, is_superuser=True)
+            users = [User(email=f"agent-{run_id}-{i}@example.com", name=f"Agent {i}", hashed_password=hashed)
+                     for i in range(self.args.agents)]
+            db.add(admin)
+            db.add_all(users)
+            db.flush()
+            db.add_all([Device(user_id=u.id, device_hw_id=f"{run_id}-{i}", name=f"SIM-{i}") for i, u in enumerate(users)])
+            db.commit()
+            self.admin_token = create_access_token(admin.id)
+            self.agents = [{"id": u.id, "device_id": f"{run_id}-{i}", "token": create_access_token(u.id)}
+                           for i, u in enumerate(users)]
+        finally:
+            db.close()
+
+    async def provision_api(self, client: httpx.AsyncClient):
+        base, run_id = self.args.base_url, uuid.uuid4().hex[:8]
+        resp = await client.post(f"{base}/auth/login", json={
+            "email": self.args.admin_email, "password": self.args.admin_password, "device_id": "loadtest-admin"})
+        resp.raise_for_status()
+        self.admin_token = resp.json()["access_token"]
+        sem = asyncio.Semaphore(20)
+
+        async def one(i):
+            email, device_id = f"agent-{run_id}-{i}@example.com", f"{run_id}-{i}"
+            async with sem:
+                await client.post(f"{base}/auth/register", json={
+                    "name": f"Agent {i}", "email": email, "password": "loadtest",
+                    "device_id": device_id, "device_name": f"SIM-{i}"})
+                resp = await client.post(f"{base}/auth/login", json={
+                    "email": email, "password": "loadtest", "device_id": device_id})
+                resp.raise_for_status()
+                data = resp.json()
+                return {"id": data["user"]["id"], "device_id": device_id, "token": data["access_token"]}
+
+        self.agents = await asyncio.gather(*(one(i) for i in range(self.args.agents)))
+
+    # --- Agent behaviour ---
+    async def sleep(self, seconds: float) -> bool:
+        """Sleeps unless the test is stopping. Returns False once it is."""
+        try:
+            await asyncio.wait_for(self.stop.wait(), timeout=seconds)
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    async def heartbeat_loop(self, client, agent):
+        url = f"{self.args.base_url}/client/heartbeat"
+        body = json.dumps({"status": "online", "device_id": agent["device_id"]})
+        while await self.sleep(agent["heartbeat_interval"]):
+            resp = await self.call(client, "POST /client/heartbeat", "POST", url, agent["token"], body)
+            if resp is not None and resp.status_code == 200:
+                # Honour server-recommended intervals when the server sends them
+                agent["heartbeat_interval"] = resp.json().get("heartbeat_interval", agent["heartbeat_interval"])
+
+    async def command_loop(self, client, agent):
+        url = f"{self.args.base_url}/client/commands"
+        while await self.sleep(agent["poll_interval"]):
+            resp = await self.call(client, "GET /client/commands", "GET", url, agent["token"])
+            if resp is None or resp.status_code != 200:
+                continue
+            agent["poll_interval"] = float(resp.headers.get("X-Poll-Interval", agent["poll_interval"]))
+            for cmd in resp.json():
+                asyncio.create_task(self.execute(client, agent, cmd))
+
+    async def execute(self, client, agent, cmd):
+        base, token, kind = self.args.base_url, agent["token"], cmd.get("command")
+        if kind == "TAKE_SCREENSHOT":
+            await self.call(client, "POST /client/screenshot/upload", "POST", f"{base}/client/screenshot/upload",
+                            token, self.bodies["screenshot"], cmd["id"])
+        elif kind == "GET_RUNNING_APPS":
+            await self.call(client, "POST /client/apps/upload", "POST", f"{base}/client/apps/upload",
+                            token, self.bodies["apps"], cmd["id"])
+        elif kind == "GET_BROWSER_STATUS":
+            await self.call(client, "POST /client/browser/upload", "POST", f"{base}/client/browser/upload",
+                            token, self.bodies["browser"], cmd["id"])
+        await self.call(client, "POST /client/command/ack", "POST", f"{base}/client/command/ack", token,
+                        json.dumps({"command_id": cmd["id"], "status": "EXECUTED"}))
+
+    async def admin_loop(self, client):
+        """Queues commands for random agents at --command-rate per second."""
+        if self.args.command_rate <= 0:
+            return
+        url = f"{self.args.base_url}/admin/command/send"
+        kinds = [k for k, w in COMMAND_MIX.items() for _ in range(w)]
+        while await self.sleep(random.expovariate(self.args.command_rate)):
+            agent = random.choice(self.agents)
+            body = json.dumps({"user_id": agent["id"], "command": random.choice(kinds), "payload": {}})
+            asyncio.create_task(self.call(client, "POST /admin/command/send", "POST", url, self.admin_token, body))
+
+    async def signaling_pair(self, agent):
+        """Host (agent) and viewer (admin) in one room; measures offer -> answer round trip."""
+        import websockets
+        ws_base = self.args.base_url.replace("http", "ws", 1)
+        room = agent["id"]
+        host_url = f"{ws_base}/ws/ws?role=host&room_id={room}&token={agent['token']}"
+        viewer_url = f"{ws_base}/ws/ws?role=viewer&room_id={room}&token={self.admin_token}"
+        try:
+            async with websockets.connect(host_url) as host, websockets.connect(viewer_url) as viewer:
+                async def answer_offers():
+                    async for raw in host:
+                        if json.loads(raw).get("type") == "offer":
+                            await host.send(json.dumps({"type": "answer", "sdp": "v=0\r\n"}))
+                answerer = asyncio.create_task(answer_offers())
+                try:
+                    while await self.sleep(self.args.signal_interval):
+                        start = time.perf_counter()
+                        await viewer.send(json.dumps({"type": "offer", "sdp": "v=0\r\n"}))
+                        try:
+                            while json.loads(await asyncio.wait_for(viewer.recv(), 10)).get("type") != "answer":
+                                pass
+                            self.stats.record("WS signaling offer->answer", time.perf_counter() - start, 200)
+                        except asyncio.TimeoutError:
+                            self.stats.record("WS signaling offer->answer", time.perf_counter() - start, "timeout")
+                finally:
+                    answerer.cancel()
+        except Exception as e:
+            self.stats.record("WS signaling connect", 0.0, type(e).__name__)
+
+    async def run_agent(self, client, agent):
+        # Real agents start at different moments; spread the fleet over the ramp-up period
+        if not await self.sleep(random.uniform(0, self.args.ramp_up)):
+            return
+        agent["heartbeat_interval"] = HEARTBEAT_INTERVAL
+        agent["poll_interval"] = COMMAND_POLL_INTERVAL
+        await asyncio.gather(self.heartbeat_loop(client, agent), self.command_loop(client, agent))
+
+    async def progress(self):
+        while await self.sleep(self.args.report_interval):
+            total = sum(len(v) for v in self.stats.latencies.values())
+            elapsed = time.perf_counter() - self.stats.started
+            print(f"[{elapsed:6.0f}s] {total} requests, {total / elapsed:.1f} req/s")
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=self.args.connections, max_keepalive_connections=self.args.connections)
+        async with httpx.AsyncClient(limits=limits, timeout=self.args.timeout) as client:
+            if self.args.provision == "api":
+                await self.provision_api(client)
+            else:
+                self.provision_db()
+            print(f"Provisioned {len(self.agents)} agents; running for {self.args.duration}s")
+            self.stats = Stats()
+
+            tasks = [asyncio.create_task(self.run_agent(client, a)) for a in self.agents]
+            tasks.append(asyncio.create_task(self.admin_loop(client)))
+            tasks.append(asyncio.create_task(self.progress()))
+            streaming = random.sample(self.agents, int(len(self.agents) * self.args.ws_fraction))
+            tasks += [asyncio.create_task(self.signaling_pair(a)) for a in streaming]
+
+            await asyncio.sleep(self.args.duration)
+            self.stop.set()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.stats.print_report()
+        if self.args.json_out:
+            with open(self.args.json_out, "w") as f:
+                json.dump({"args": vars(self.args), "results": self.stats.report()}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000/api/v1")
+    parser.add_argument("--agents", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=60, help="seconds of steady load")
+    parser.add_argument("--ramp-up", type=float, default=10, help="agents start uniformly over this many seconds")
+    parser.add_argument("--command-rate", type=float, default=5, help="admin commands per second (fleet-wide)")
+    parser.add_argument("--ws-fraction", type=float, default=0.01, help="fraction of agents with a signaling session")
+    parser.add_argument("--signal-interval", type=float, default=5, help="seconds between offers per session")
+    parser.add_argument("--screenshot-kb", type=int, default=1024)
+    parser.add_argument("--apps", type=int, default=30)
+    parser.add_argument("--tabs", type=int, default=60)
+    parser.add_argument("--connections", type=int, default=500, help="HTTP connection pool size")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--provision", choices=["db", "api"], default="db")
+    parser.add_argument("--sqlite", metavar="PATH", help="--provision db only: the server's SQLite file (local_server --sqlite)")
+    parser.add_argument("--admin-email", default="admin@example.com", help="--provision api only")
+    parser.add_argument("--admin-password", default="admin", help="--provision api only")
+    parser.add_argument("--report-interval", type=float, default=10)
+    parser.add_argument("--json-out", help="write the final report as JSON")
+    args = parser.parse_args()
+    if args.sqlite:
+        # Must be set before app.core.config is imported (provision_db)
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.sqlite)}"
+    asyncio.run(Fleet(args).run())
+
+
+if __name__ == "__main__":
+    main()
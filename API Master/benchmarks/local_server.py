@@ -0,0 +1,51 @@
+"""
+Runs the API locally for load tests, optionally on SQLite and an in-process
+fakeredis instead of Postgres and Redis.
+
+    cd "API Master"
+    python -m benchmarks.local_server --sqlite loadtest.db --fakeredis --port 8000
+
+Without flags it behaves like `uvicorn app.main:app` with the usual .env settings.
+"""
+import argparse
+import os
+
+
+def use_fakeredis():
+    """Points every Redis client of the app at one shared in-memory fakeredis server."""
+    import fakeredis
+    import fakeredis.aioredis
+    from app.core import metrics
+    from app.core import redis as app_redis
+
+    server = fakeredis.FakeServer()
+    app_redis.redis_client = metrics.instrument_redis(
+        fakeredis.FakeRedis(server=server, decode_responses=True)
+    )
+    app_redis.async_redis_client = metrics.instrument_async_redis(
+        fakeredis.aioredis.FakeRedis(server=server)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--sqlite", metavar="PATH", help="use a SQLite file instead of Postgres")
+    parser.add_argument("--fakeredis", action="store_true", help="use in-process fakeredis instead of Redis")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        # Must be set before app.core.config is imported
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.sqlite)}"
+    if args.fakeredis:
+        use_fakeredis()
+
+    import uvicorn
+    from app.main import app
+    # A single worker: fakeredis state lives in this process
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Deterministic synthetic payloads shaped like what the desktop agent really sends
+(see Client/background.py, lists_apps.py and browser.py).
+"""
+import base64
+import random
+from datetime import datetime, timedelta
+
+SEED = 1234
+
+EXE_NAMES = [
+    "chrome.exe", "msedge.exe", "firefox.exe", "Code.exe", "explorer.exe", "Teams.exe",
+    "OUTLOOK.EXE", "EXCEL.EXE", "WINWORD.EXE", "slack.exe", "Spotify.exe", "notepad.exe",
+]
+DOMAINS = [
+    "youtube.com", "github.com", "mail.google.com", "docs.google.com", "stackoverflow.com",
+    "linkedin.com", "news.ycombinator.com", "wikipedia.org", "jira.atlassian.com", "figma.com",
+]
+
+
+def _rng(seed=SEED):
+    return random.Random(seed)
+
+
+def fake_icon(rng, size=2400):
+    """A PNG-looking data URL of roughly the size lists_apps.get_icon_base64 produces."""
+    raw = b"\x89PNG\r\n\x1a\n" + bytes(rng.getrandbits(8) for _ in range(size))
+    return f"data:image/png;base64,{base64.b64encode(raw).decode()}"
+
+
+def screenshot_payload(size_bytes=1024 * 1024, command_id=None, seed=SEED):
+    """Body of POST /client/screenshot/upload. `size_bytes` is the decoded PNG size."""
+    raw = _rng(seed).randbytes(size_bytes)
+    return {"command_id": command_id, "image_base64": base64.b64encode(raw).decode(), "is_auto": command_id is None}
+
+
+def apps_payload(count=50, with_icons=True, command_id=None, seed=SEED):
+    """Body of POST /client/apps/upload."""
+    rng = _rng(seed)
+    icons = [fake_icon(rng) for _ in EXE_NAMES] if with_icons else [None] * len(EXE_NAMES)
+    apps = []
+    for i in range(count):
+        idx = i % len(EXE_NAMES)
+        exe = EXE_NAMES[idx]
+        apps.append({
+            "name": exe,
+            "pid": 1000 + i * 4,
+            "title": f"Window {i} - {exe.split('.')[0]}",
+            "exe_path": f"C:\\Program Files\\{exe.split('.')[0]}\\{exe}",
+            "duration": f"{rng.randint(0, 8):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+            "icon": icons[idx],
+            "is_active": i == 0,
+        })
+    return {"command_id": command_id, "apps": apps}
+
+
+def browser_payload(tabs=200, browsers=("Chrome", "Edge"), command_id=None, seed=SEED):
+    """Body of POST /client/browser/upload, in the `sessions` format of background.get_browser_status."""
+    rng = _rng(seed)
+    now = datetime(2026, 1, 1, 9, 0, 0)
+    sessions = {}
+    for i in range(tabs):
+        name = browsers[i % len(browsers)]
+        domain = DOMAINS[rng.randrange(len(DOMAINS))]
+        sessions.setdefault(name, []).append({
+            "title": f"Tab {i} on {domain} - some descriptive page title",
+            "url": f"https://{domain}/path/{rng.getrandbits(32):x}?q={i}",
+            "timestamp": (now + timedelta(seconds=i)).isoformat(),
+            "browser": name,
+        })
+    youtube_open = any("youtube.com" in t["url"] for tabs_ in sessions.values() for t in tabs_)
+    return {
+        "command_id": command_id,
+        "browser": f"Multiple ({', '.join(sessions.keys())})",
+        "youtube_open": youtube_open,
+        "details": {"sessions": sessions, "meta": {"method": "Enhanced", "scanned_at": now.isoformat()}},
+    }
+
+
+def users_payload(count=500, seed=SEED):
+    """Rows shaped like GET /admin/users."""
+    rng = _rng(seed)
+    return [
+        {"id": f"{rng.getrandbits(128):032x}", "email": f"user{i}@example.com", "name": f"User {i}",
+         "is_active": True, "is_superuser": False}
+        for i in range(count)
+    ]
@@ -1,4 +1,6 @@
 import requests
+import gzip
+import json
 import logging
 from config import Config
 
@@ -30,16 +32,32 @@ except Exception as e:
     logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
     logger.error(f"Failed to setup file logging: {e}")
 
+# Bounds for server-recommended intervals (BackgroundService restarts if a loop stalls for 120s)
+MIN_INTERVAL = 1
+MAX_INTERVAL = 60
+
+def _interval(value, default):
+    try:
+        return min(MAX_INTERVAL, max(MIN_INTERVAL, float(value)))
+    except (TypeError, ValueError):
+        return default
+
 class APIClient:
     def __init__(self):
         self.base_url = Config.API_BASE_URL
         self.token = Config.load_token()
+        self.device_id = Config.get_device_id()
+        # Updated from every heartbeat / command poll response
+        self.heartbeat_interval = Config.HEARTBEAT_INTERVAL
+        self.poll_interval = Config.COMMAND_POLL_INTERVAL
         self.headers = {
             "Content-Type": "application/json",
             "ngrok-skip-browser-warning": "true"
         }
         if self.token:
             self.headers["Authorization"] = f"Bearer {self.token}"
+        # Turned off for this session if the server refuses compressed bodies (415)
+        self.compress_uploads = True
 
     def set_token(self, token):
         self.token = token
@@ -62,6 +80,20 @@ class APIClient:
         except:
             logger.debug(f"BODY: {response.text}")
 
+    def upload(self, path, payload):
+        """POSTs a JSON payload, gzip-compressed when it is large enough to be worth it."""
+        url = f"{self.base_url}{path}"
+        body = json.dumps(payload).encode()
+        if self.compress_uploads and len(body) >= Config.COMPRESS_MIN_BYTES:
+            compressed = gzip.compress(body, compresslevel=6)
+            logger.debug(f"Compressed {path} body {len(body)} -> {len(compressed)} bytes")
+            response = requests.post(url, data=compressed, headers={**self.headers, "Content-Encoding": "gzip"})
+            if response.status_code != 415:
+                return response
+            logger.warning("Server does not accept compressed uploads, sending uncompressed from now on")
+            self.compress_uploads = False
+        return requests.post(url, data=body, headers=self.headers)
+
     def login(self, email, password, device_id):
         url = f"{self.base_url}/auth/login"
         payload = {
@@ -108,12 +140,22 @@ class APIClient:
         url = f"{self.base_url}/client/heartbeat"
         self._log_request("POST", url)
         try:
-            response = requests.post(url, json={"status": "online"}, headers=self.headers)
+            response = requests.post(url, json={"status": "online", "device_id": self.device_id}, headers=self.headers)
             self._log_response(response)
             if response.status_code == 401:
                 Config.clear_token()
                 return False
-            return response.status_code == 200
+            if response.status_code in (429, 503):
+                # Server is shedding load; the session is still valid, so keep the service running
+                logger.warning(f"Heartbeat throttled ({response.status_code}), retry after {response.headers.get('Retry-After')}s")
+                self.heartbeat_interval = _interval(response.headers.get("Retry-After"), self.heartbeat_interval)
+                return True
+            if response.status_code == 200:
+                data = response.json()
+                self.heartbeat_interval = _interval(data.get("heartbeat_interval"), Config.HEARTBEAT_INTERVAL)
+                self.poll_interval = _interval(data.get("poll_interval"), self.poll_interval)
+                return True
+            return False
         except Exception as e:
             logger.error(f"Heartbeat error: {e}")
             return False
@@ -125,7 +167,10 @@ class APIClient:
         try:
             response = requests.get(url, headers=self.headers)
             self._log_response(response)
+            if response.status_code in (429, 503):
+                self.poll_interval = _interval(response.headers.get("Retry-After"), self.poll_interval)
             if response.status_code == 200:
+                self.poll_interval = _interval(response.headers.get("X-Poll-Interval"), Config.COMMAND_POLL_INTERVAL)
                 return response.json()
         except:
             pass
@@ -156,3 +201,26 @@ class APIClient:
         except Exception as e:
             logger.error(f"Failed to send notification reply: {e}")
             return False
+
+    def missing_icons(self, hashes):
+        """Hashes the server's icon registry lacks, or None if it could not be asked."""
+        if not self.token: return None
+        try:
+            response = self.upload("/client/icons/missing", {"hashes": hashes})
+            self._log_response(response)
+            if response.status_code == 200:
+                return response.json().get("missing", [])
+        except Exception as e:
+            logger.error(f"Icon check failed: {e}")
+        return None
+
+    def upload_icons(self, icons):
+        """Uploads [{"hash", "data", "media_type"}] to the icon registry."""
+        if not self.token: return False
+        try:
+            response = self.upload("/client/icons", {"icons": icons})
+            self._log_response(response)
+            return response.status_code == 200
+        except Exception as e:
+            logger.error(f"Icon upload failed: {e}")
+            return False
@@ -15,6 +15,7 @@ from datetime import datetime
 
 from api_client import APIClient
 from config import Config
+from icons import IconCache
 from lists_apps import get_running_applications
 from streamer import start_stream_service
 
@@ -47,6 +48,7 @@ except Exception as e:
 class BackgroundService:
     def __init__(self, screen_lock=None):
         self.api = APIClient()
+        self.icons = IconCache(self.api)
         self.running = True
         self.screen_lock = screen_lock if screen_lock else threading.Lock()
         self.streamer = None
@@ -97,7 +99,8 @@ class BackgroundService:
                # Actually, `main.py` calls `start_background` which blocks.
                # If we exit process, user has to restart app.
                # Better: `main.py` should loop.
-            time.sleep(10)
+            # Interval recommended by the server (load-dependent, jittered)
+            time.sleep(self.api.heartbeat_interval)
 
     def command_loop(self):
         while self.running:
@@ -110,7 +113,7 @@ class BackgroundService:
                     threading.Thread(target=self.process_command, args=(cmd,), daemon=True).start()
             except Exception as e:
                 logger.error(f"Error in command loop: {e}")
-            time.sleep(5)
+            time.sleep(self.api.poll_interval)
 
     def process_command(self, cmd):
         command_type = cmd.get("command")
@@ -156,7 +159,7 @@ class BackgroundService:
         
         logger.debug(f"UPLOADING SCREENSHOT to {url}")
         try:
-             resp = requests.post(url, json=payload, headers=self.api.headers)
+             resp = self.api.upload("/client/screenshot/upload", payload)
              logger.debug(f"UPLOAD RESULT: {resp.status_code} {resp.text}")
         except Exception as e:
             logger.error(f"Upload failed: {e}")
@@ -183,6 +186,11 @@ class BackgroundService:
             logger.info(f"Found {len(apps)} user-visible applications")
         except Exception as e:
             logger.error(f"Error getting apps: {e}")
+
+        try:
+            self.icons.apply_apps(apps)
+        except Exception as e:
+            logger.warning(f"Icon registry unavailable, sending icons inline: {e}")
         
         # Upload
         url = f"{self.api.base_url}/client/apps/upload"
@@ -192,7 +200,7 @@ class BackgroundService:
         }
         logger.debug(f"UPLOADING APPS ({len(apps)}) to {url}")
         try:
-            resp = requests.post(url, json=payload, headers=self.api.headers)
+            resp = self.api.upload("/client/apps/upload", payload)
             logger.debug(f"Result: {resp.status_code}")
         except Exception as e:
             logger.error(f"App upload failed: {e}")
@@ -253,6 +261,11 @@ class BackgroundService:
         else:
             browser_summary = f"Multiple ({', '.join(browsers.keys())})"
 
+        try:
+            self.icons.apply_browsers(browsers)
+        except Exception as e:
+            logger.warning(f"Icon registry unavailable, sending icons inline: {e}")
+
         # Upload
         url = f"{self.api.base_url}/client/browser/upload"
         payload = {
@@ -273,7 +286,7 @@ class BackgroundService:
         
         logger.info(f"UPLOADING BROWSER STATUS ({method_used}) to {url}")
         try:
-            resp = requests.post(url, json=payload, headers=self.api.headers)
+            resp = self.api.upload("/client/browser/upload", payload)
             logger.debug(f"Upload Result: {resp.status_code}")
         except Exception as e:
             logger.error(f"Browser upload failed: {e}")
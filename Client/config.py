@@ -6,11 +6,20 @@ import subprocess
 class Config:
     API_BASE_URL = os.getenv("SERVER_URL", "https://employee-monitoring.duckdns.org/api/v1")
     WS_BASE_URL = os.getenv("WS_URL", "wss://employee-monitoring.duckdns.org/api/v1/ws")
+
+    # Defaults until the server recommends intervals (HeartbeatResponse / X-Poll-Interval)
+    HEARTBEAT_INTERVAL = 10
+    COMMAND_POLL_INTERVAL = 5
+
+    # Upload bodies at least this large are sent gzip-compressed (Content-Encoding: gzip)
+    COMPRESS_MIN_BYTES = 1024
     
     # Persistent storage for the token and logs
     APP_DATA_DIR = os.path.join(os.getenv('APPDATA', os.path.expanduser('~')), "EmployeeMonitoring")
     TOKEN_FILE = os.path.join(APP_DATA_DIR, "client_token.key")
     LOG_FILE = os.path.join(APP_DATA_DIR, "client.log")
+    # Icon hashes the server's registry already has (see icons.py)
+    KNOWN_ICONS_FILE = os.path.join(APP_DATA_DIR, "known_icons.json")
     
     @staticmethod
     def _ensure_data_dir():
@@ -0,0 +1,125 @@
+"""
+Replaces inline icon data URLs in uploads with content-addressed references
+("sha256:<hash>") to the server's icon registry.
+
+Icons barely change between snapshots, so the bytes are uploaded once: a batched
+check asks which hashes the server lacks, only those are sent, and hashes the
+server is known to have are remembered in known_icons.json across restarts.
+If the registry cannot be reached the data URLs are left inline, which the
+server still accepts.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+REF_PREFIX = "sha256:"
+# Match the server's ICON_BATCH_MAX, ICON_MAX_BYTES and accepted types. Other
+# icons stay inline: one the server refuses would fail its whole upload batch
+BATCH_MAX = 500
+ICON_MAX_BYTES = 64 * 1024
+MEDIA_TYPES = {"image/png", "image/x-icon", "image/jpeg", "image/gif", "image/webp"}
+
+
+def _parse(value):
+    """(hash, base64 data, media type) of an image data URL the registry accepts, None for anything else."""
+    if not isinstance(value, str) or not value.startswith("data:image/"):
+        return None
+    header, _, encoded = value.partition(",")
+    media_type = header[5:].split(";")[0]
+    if not header.endswith(";base64") or media_type not in MEDIA_TYPES:
+        return None
+    try:
+        data = base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if len(data) > ICON_MAX_BYTES:
+        return None
+    return hashlib.sha256(data).hexdigest(), encoded, media_type
+
+
+class IconCache:
+    def __init__(self, api):
+        self.api = api
+        self.lock = threading.Lock()
+        self.known = self._load()
+
+    def _load(self):
+        try:
+            with open(Config.KNOWN_ICONS_FILE, "r") as f:
+                return set(json.load(f))
+        except (OSError, ValueError):
+            return set()
+
+    def _save(self):
+        try:
+            Config._ensure_data_dir()
+            tmp = Config.KNOWN_ICONS_FILE + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(sorted(self.known), f)
+            os.replace(tmp, Config.KNOWN_ICONS_FILE)
+        except OSError as e:
+            logger.warning(f"Could not save known icons: {e}")
+
+    def _sync(self, icons):
+        """Makes sure the server has every {hash: (data, media type)}; returns the hashes it has."""
+        unknown = [h for h in icons if h not in self.known]
+        if not unknown:
+            return set(icons)
+        reported = set()
+        for i in range(0, len(unknown), BATCH_MAX):
+            batch = self.api.missing_icons(unknown[i:i + BATCH_MAX])
+            if batch is None:
+                return self.known & set(icons)
+            reported.update(batch)
+        missing = [h for h in unknown if h in reported]
+        uploaded = set()
+        for i in range(0, len(missing), BATCH_MAX):
+            batch = missing[i:i + BATCH_MAX]
+            # Whatever does not make it stays inline this time
+            if not self.api.upload_icons([{"hash": h, "data": icons[h][0], "media_type": icons[h][1]} for h in batch]):
+                break
+            uploaded.update(batch)
+        self.known.update(h for h in unknown if h in uploaded or h not in reported)
+        self._save()
+        return self.known & set(icons)
+
+    def references(self, values):
+        """Maps each data URL in `values` the server has (or now has) to its reference."""
+        parsed = {}
+        for value in values:
+            icon = _parse(value)
+            if icon is not None:
+                parsed[value] = icon
+        if not parsed:
+            return {}
+        with self.lock:
+            present = self._sync({h: (data, media_type) for h, data, media_type in parsed.values()})
+        return {value: REF_PREFIX + h for value, (h, _, _) in parsed.items() if h in present}
+
+    def apply_apps(self, apps):
+        """Replaces the `icon` data URLs of an app list in place."""
+        refs = self.references({app.get("icon") for app in apps})
+        for app in apps:
+            if app.get("icon") in refs:
+                app["icon"] = refs[app["icon"]]
+
+    def apply_browsers(self, browsers):
+        """Same for browser sessions: the `icon_meta` entries and each tab's `icon`."""
+        icon_meta = browsers.get("icon_meta") or {}
+        tabs = [tab for name, session in browsers.items() if name != "icon_meta" and isinstance(session, list)
+                for tab in session if isinstance(tab, dict)]
+        refs = self.references(set(icon_meta.values()) | {tab.get("icon") for tab in tabs})
+        for name, value in icon_meta.items():
+            if value in refs:
+                icon_meta[name] = refs[value]
+        for tab in tabs:
+            if tab.get("icon") in refs:
+                tab["icon"] = refs[tab["icon"]]
@@ -19,6 +19,7 @@ class APIClient {
         // this.baseUrl = envApiUrl || window.API_BASE_URL || `${protocol}//${host}/api/v1`;
 
         this.token = localStorage.getItem('access_token');
+        this.overviewCache = {}; // userId -> { etag, data }
         window.api = this;
         this.initEventListeners();
     }
@@ -149,7 +150,24 @@ class APIClient {
     }
 
     async getAllUsers() {
-        return this.request('/admin/users');
+        // Keyset-paginated: follow X-Next-Cursor until the last page
+        const headers = {
+            'Authorization': `Bearer ${localStorage.getItem('access_token')}`,
+            'ngrok-skip-browser-warning': 'true'
+        };
+        const users = [];
+        let cursor = null;
+        do {
+            const query = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+            const response = await fetch(`${this.baseUrl}/admin/users?limit=200${query}`, { headers });
+            if (!response.ok) {
+                if (users.length === 0) return this.request('/admin/users'); // Surface the error the usual way
+                break;
+            }
+            users.push(...await response.json());
+            cursor = response.headers.get('X-Next-Cursor');
+        } while (cursor);
+        return users;
     }
 
     async sendCommand(userId, commandType) {
@@ -198,6 +216,51 @@ class APIClient {
         return this.request(`/admin/screenshot-count/${userId}`);
     }
 
+    async getAppUsageChart(params = {}) {
+        // { start, end, user_id, top }: hours per app from the hourly rollups
+        return this.request(`/admin/charts/apps?${new URLSearchParams(params)}`);
+    }
+
+    async getActivityChart(params = {}) {
+        // { start, end, user_id, app, points }: downsampled hours per bucket
+        return this.request(`/admin/charts/activity?${new URLSearchParams(params)}`);
+    }
+
+    async getUserOverview(userId) {
+        // Conditional GET: the server answers 304 (no body) when the panel has not changed
+        const cached = this.overviewCache[userId];
+        const headers = {
+            'Authorization': `Bearer ${localStorage.getItem('access_token')}`,
+            'ngrok-skip-browser-warning': 'true'
+        };
+        if (cached) headers['If-None-Match'] = cached.etag;
+
+        const response = await fetch(`${this.baseUrl}/admin/users/${userId}/overview`, { headers });
+        if (response.status === 304 && cached) return cached.data;
+        if (response.status === 401) {
+            localStorage.removeItem('access_token');
+            window.location.href = 'login.html';
+            throw new Error("Unauthorized");
+        }
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.detail || 'Request failed');
+
+        const etag = response.headers.get('ETag');
+        if (etag) this.overviewCache[userId] = { etag, data };
+        return data;
+    }
+
+    absoluteUrl(path) {
+        // Server-relative URLs (e.g. signed screenshot links) resolved against the API host
+        return new URL(path, this.baseUrl).href;
+    }
+
+    iconUrl(icon) {
+        // Registry references ("sha256:<hash>") become immutable, cacheable icon URLs
+        if (icon && icon.startsWith('sha256:')) return `${this.baseUrl}/icons/${icon.slice(7)}`;
+        return icon;
+    }
+
     async startLiveStream(userId) {
         return this.request('/admin/live/start', 'POST', {
             user_id: userId,
@@ -35,23 +35,31 @@ document.addEventListener('DOMContentLoaded', () => {
     initCharts();
 });
 
-function initCharts() {
+async function initCharts() {
+    // Last 7 days across all employees, from the server's hourly rollups
+    const chartColors = ['#ef4444', '#8b5cf6', '#3b82f6', '#10b981', '#f59e0b', '#ec4899', '#14b8a6', '#6366f1', '#1f2937'];
+    const end = new Date();
+    const start = new Date(end.getTime() - 7 * 24 * 3600 * 1000);
+    const range = { start: start.toISOString(), end: end.toISOString() };
+
     // Pie Chart: Applications Usage
     const appsEl = document.getElementById('appsChart');
     if (appsEl) {
+        let usage = { labels: [], datasets: [{ data: [] }] };
+        try {
+            usage = await api.getAppUsageChart({ ...range, top: chartColors.length - 1 });
+        } catch (e) {
+            console.error('Failed to load app usage chart', e);
+        }
         const ctxPie = appsEl.getContext('2d');
         new Chart(ctxPie, {
             type: 'doughnut',
             data: {
-                labels: ['Chrome', 'Word', 'Slack', 'Others'],
+                labels: usage.labels,
                 datasets: [{
-                    data: [45, 25, 20, 10],
-                    backgroundColor: [
-                        '#ef4444', // Red (Chrome)
-                        '#8b5cf6', // Purple (Word)
-                        '#3b82f6', // Blue (Slack)
-                        '#1f2937'  // Dark (Others)
-                    ],
+                    // Hours each app was running
+                    data: usage.datasets[0].data,
+                    backgroundColor: chartColors.slice(0, usage.labels.length),
                     borderWidth: 0,
                     hoverOffset: 4
                 }]
@@ -73,14 +81,21 @@ function initCharts() {
     // Bar Chart: Weekly Active Hours
     const hoursEl = document.getElementById('hoursChart');
     if (hoursEl) {
+        let activity = { labels: [], datasets: [{ data: [] }] };
+        try {
+            // Seven points: one bucket per day
+            activity = await api.getActivityChart({ ...range, points: 7 });
+        } catch (e) {
+            console.error('Failed to load activity chart', e);
+        }
         const ctxBar = hoursEl.getContext('2d');
         new Chart(ctxBar, {
             type: 'bar',
             data: {
-                labels: ['Mon', 'Tue', 'Wed', 'Thu', 'Fri'],
+                labels: activity.labels.map(label => new Date(label).toLocaleDateString(undefined, { weekday: 'short' })),
                 datasets: [{
                     label: 'Hours',
-                    data: [6, 8, 7, 5, 8],
+                    data: activity.datasets[0].data,
                     backgroundColor: '#3b82f6',
                     borderRadius: 4
                 }]
@@ -133,11 +148,7 @@ async function loadDashboard() {
 
         // If a user is currently selected, refresh their specific details too
         if (currentUserId) {
-            loadScreenshotCount(currentUserId);
-            // Only auto-load screenshot if we are currently in image mode
-            if (currentLiveFeedMode === 'image' || currentLiveFeedMode === 'reset') {
-                loadLatestScreenshot(currentUserId);
-            }
+            loadOverview(currentUserId);
         }
     } catch (err) {
         console.error("Dashboard refresh failed", err);
@@ -260,11 +271,44 @@ function selectUser(user, isOnline) {
     log(`Selected user: ${user.name}`);
     loadHistory(user.id);
 
-    // Load latest screenshot automatically - this resets the view to Image
-    loadLatestScreenshot(user.id, true);
+    // Screenshot count, online state and latest screenshot in one request
+    loadOverview(user.id, true);
+}
+
+let overviewShotId = null;
+
+async function loadOverview(userId, forceRefresh = false) {
+    if (!userId) return;
+    try {
+        const data = await api.getUserOverview(userId);
+        if (userId !== currentUserId) return; // Selection changed while loading
+
+        const countEl = document.getElementById('detailScreenshots');
+        if (countEl) countEl.textContent = data.screenshots_today;
+
+        const statusEl = document.getElementById('detailStatus');
+        if (statusEl) {
+            statusEl.textContent = data.online ? 'Online' : 'Offline';
+            statusEl.className = data.online
+                ? 'text-2xl font-extrabold text-green-600 mt-0.5'
+                : 'text-2xl font-extrabold text-gray-800 mt-0.5';
+        }
+
+        // Same guard as loadLatestScreenshot: don't replace Apps/Browser/Live views unless forced
+        if (!forceRefresh && currentLiveFeedMode !== 'image' && currentLiveFeedMode !== 'reset') return;
+        const shotId = data.screenshot ? data.screenshot.id : null;
+        if (!forceRefresh && shotId === overviewShotId) return;
+        overviewShotId = shotId;
 
-    // Load screenshot count for today
-    loadScreenshotCount(user.id);
+        if (data.screenshot) {
+            updateLiveFeed('image', api.absoluteUrl(data.screenshot.url));
+            log('Latest screenshot loaded', 'success');
+        } else {
+            updateLiveFeed('reset');
+        }
+    } catch (err) {
+        console.error("Failed to load user overview:", err);
+    }
 }
 
 async function loadScreenshotCount(userId) {
@@ -362,7 +406,7 @@ function updateLiveFeed(type, data) {
 
         const rows = data.map(app => {
             const name = app.name || 'Unknown';
-            const icon = app.icon || 'https://placehold.co/32x32?text=?';
+            const icon = api.iconUrl(app.icon) || 'https://placehold.co/32x32?text=?';
             const duration = app.duration || '00:00:00';
 
             return `
@@ -443,7 +487,7 @@ function renderBrowserList() {
     } else {
         browserNames.forEach(name => {
             const count = sessions[name].length;
-            const icon = icons[name];
+            const icon = api.iconUrl(icons[name]);
 
             const iconHtml = icon
                 ? `<div class="relative">
@@ -506,7 +550,7 @@ function renderTabList(browserName) {
         // Use tab icon (favicon) with fallback
         const tabIconHtml = tab.icon
             ? `<div class="relative shrink-0">
-                 <img src="${tab.icon}" class="w-9 h-9 object-contain rounded-lg bg-white/5 p-1 border border-slate-700/50 group-hover:border-blue-500/30 transition-colors shadow-sm"
+                 <img src="${api.iconUrl(tab.icon)}" class="w-9 h-9 object-contain rounded-lg bg-white/5 p-1 border border-slate-700/50 group-hover:border-blue-500/30 transition-colors shadow-sm"
                       onerror="this.src='https://www.google.com/s2/favicons?sz=64&domain=google.com'">
                </div>`
             : `<div class="w-9 h-9 rounded-lg bg-slate-800/80 flex items-center justify-center shrink-0 border border-slate-700/50 group-hover:border-blue-500/30 transition-colors">
@@ -594,8 +638,8 @@ async function pollForCommandResult(commandId, type, userId) {
                     if (res.image_data) {
                         imageUrl = res.image_data;
                     } else {
-                        // Fallback to URL with timestamp
-                        imageUrl = `${res.url}?t=${new Date().getTime()}`;
+                        // Fallback to the (signed, per-screenshot) image URL
+                        imageUrl = api.absoluteUrl(res.url);
                     }
 
                     updateLiveFeed('image', imageUrl);
@@ -774,8 +818,8 @@ async function loadLatestScreenshot(userId, forceRefresh = false) {
         if (data.image_data) {
             imageUrl = data.image_data;
         } else {
-            // Fallback to URL with cache-busting timestamp
-            imageUrl = `${data.url}?t=${new Date().getTime()}`;
+            // Fallback to the (signed, per-screenshot) image URL
+            imageUrl = api.absoluteUrl(data.url);
         }
 
         // Update live feed with the screenshot